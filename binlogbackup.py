@@ -0,0 +1,433 @@
+#!/usr/bin/python
+
+import sys
+import getopt
+import os
+import os.path
+import re
+import errno
+import shutil
+import struct
+import logging
+import datetime
+import tempfile
+import subprocess
+import json
+import time
+import dumpcodecs
+import rotatejournal
+import storelock
+
+"""
+-----------------------------------------------------------------------------
+Incremental mysql backups from the binary log.  Between full dumps the closed
+binlog segments of the server are copied into the binlogs directory of the
+store, compressed, and indexed by the time of their first and last events.
+Segments already in the store are never copied again so the copy can run as
+often as every few minutes.
+
+Every full dump records the binlog position its data is consistent with, see
+mysqlbackup.py.  A point in time restore restores the newest full dump from
+before the requested time and replays the binlogs of each database from the
+dump position up to that time with mysqlbinlog.
+
+Segments are read from the binlog directory of a local mysqld, or a directory
+of recorded binlogs, or from a remote server through mysqlbinlog.  The active
+segment is never copied, use the flush option to close it first.
+
+Use the -h or the --help flag to get a listing of options.
+
+Program: Binlog Backups
+Author: agent
+Date: October 17, 2026
+Revision: 1.0
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+-----------------------------------------------------------------------------
+"""
+
+BINLOGS_NAME = "binlogs"
+INDEX_NAME = "index.json"
+POSITION_SUFFIX = ".position.json"
+BINLOG_LOCK_NAME = ".binlog.lock"
+BINLOG_MAGIC = b"\xfebin"
+
+# timestamp, type, server id, event size, next position, flags
+EVENT_HEADER = struct.Struct("<IBIIIH")
+
+# the position comment mysqldump writes with master data, older servers name
+# it master, newer ones source
+DUMP_POSITION = re.compile(br"CHANGE (?:MASTER|REPLICATION SOURCE) TO " +
+  br"(?:MASTER|SOURCE)_LOG_FILE='([^']+)', (?:MASTER|SOURCE)_LOG_POS=(\d+)")
+
+def segment_key(name):
+
+  # segments are ordered by their number, not their name, so mysql-bin.1000000
+  # comes after mysql-bin.999999
+  base, number = os.path.splitext(name)
+  number = number[1:]
+  return (base, int(number) if number.isdigit() else -1, name)
+
+def binlogs_path(store):
+  return os.path.join(os.path.abspath(store), BINLOGS_NAME)
+
+def read_event_times(path):
+
+  # walks the event headers of a binlog segment, skipping the event bodies,
+  # and returns the times of the first and last events and the event count
+  first = None
+  last = None
+  events = 0
+  with open(path, "rb") as binlog:
+    if binlog.read(len(BINLOG_MAGIC)) != BINLOG_MAGIC:
+      raise ValueError("%s is not a binlog" % path)
+    offset = len(BINLOG_MAGIC)
+    while True:
+      header = binlog.read(EVENT_HEADER.size)
+      if len(header) < EVENT_HEADER.size:
+        break
+      tstamp, etype, server_id, size, next_pos, flags = \
+        EVENT_HEADER.unpack(header)
+      if size < EVENT_HEADER.size:
+        raise ValueError("Bad event at %d in %s" % (offset, path))
+      if tstamp:
+        first = tstamp if first == None else first
+        last = tstamp
+      events += 1
+      offset += size
+      binlog.seek(offset)
+  return first, last, events
+
+def save_positions(store, tstamp, positions):
+
+  # the binlog position of each database of a full dump, by timestamp
+  path = binlogs_path(store)
+  if not os.path.isdir(path):
+    os.mkdir(path)
+  rotatejournal.write_file(os.path.join(path, tstamp + POSITION_SUFFIX),
+    json.dumps(positions, indent=2, sort_keys=True))
+
+def load_positions(store):
+  positions = {}
+  path = binlogs_path(store)
+  if os.path.isdir(path):
+    for name in os.listdir(path):
+      if name.endswith(POSITION_SUFFIX):
+        with open(os.path.join(path, name), "r") as position_file:
+          positions[name[:-len(POSITION_SUFFIX)]] = json.load(position_file)
+  return positions
+
+class DumpPositionReader:
+
+  def __init__(self, in_file, scan_bytes=1024 * 1024):
+    self.in_file = in_file
+    self.scan_bytes = scan_bytes
+    self.head = b""
+    self.position = None
+
+  def read(self, size=-1):
+
+    # passes the dump through while looking for the position comment in
+    # its first bytes
+    data = self.in_file.read(size)
+    if self.position == None and len(self.head) < self.scan_bytes:
+      self.head += data
+      match = DUMP_POSITION.search(self.head)
+      if match:
+        self.position = {"file": match.group(1).decode("utf-8"),
+          "position": int(match.group(2))}
+    return data
+
+class BinlogBackup:
+
+  def __init__(self, store=None, user="root", password=None, host=None,
+    compression=None, binlog_dir=None, flush=False):
+    self.store = os.path.abspath(store)
+    self.user = user
+    self.password = password
+    self.host = host
+    self.codec = dumpcodecs.get_codec(compression)
+    self.binlog_dir = binlog_dir
+    self.flush = flush
+    self.path = binlogs_path(store)
+    self.index_path = os.path.join(self.path, INDEX_NAME)
+
+  def connect_args(self):
+    args = ["-u", self.user]
+    if self.host != None:
+      args.extend(["-h", self.host])
+    if self.password != None:
+      args.append("-p" + self.password)
+    return args
+
+  def query(self, sql):
+    query_cmd = ["mysql"] + self.connect_args() + ["--silent", "-N", "-e", sql]
+    output = subprocess.check_output(query_cmd, universal_newlines=True)
+    return [line.split("\t") for line in output.splitlines()]
+
+  def load_index(self):
+    if not os.path.exists(self.index_path):
+      return {"segments": []}
+    with open(self.index_path, "r") as index_file:
+      return json.load(index_file)
+
+  def save_index(self, index):
+    rotatejournal.write_file(self.index_path, json.dumps(index, indent=2,
+      sort_keys=True))
+
+  def source_segments(self):
+
+    # segment names in order, the last one is the active segment
+    if self.binlog_dir == None:
+      return [row[0] for row in self.query("SHOW BINARY LOGS")]
+    index_files = [name for name in os.listdir(self.binlog_dir)
+      if name.endswith(".index")]
+    if index_files:
+      with open(os.path.join(self.binlog_dir, index_files[0]), "r") as index:
+        return [os.path.basename(line.strip()) for line in index
+          if line.strip()]
+    return sorted([name for name in os.listdir(self.binlog_dir)
+      if os.path.splitext(name)[1][1:].isdigit()], key=segment_key)
+
+  def fetch_segment(self, name, tmp_dir):
+
+    # a local segment is read in place, a remote one is fetched raw
+    if self.binlog_dir != None:
+      return os.path.join(self.binlog_dir, name)
+    fetch_cmd = ["mysqlbinlog", "--read-from-remote-server", "--raw",
+      "--result-file=" + tmp_dir + os.sep] + self.connect_args() + [name]
+    subprocess.check_call(fetch_cmd)
+    return os.path.join(tmp_dir, name)
+
+  def copy(self):
+
+    # copy the closed segments that aren't in the store yet, the index is
+    # saved after every segment so an interrupted copy loses nothing
+    if not os.path.isdir(self.path):
+      os.mkdir(self.path)
+    if self.flush:
+      self.query("FLUSH BINARY LOGS")
+    index = self.load_index()
+    copied_names = set([segment["name"] for segment in index["segments"]])
+    copied = []
+    tmp_dir = tempfile.mkdtemp(dir=self.path)
+    try:
+      for name in self.source_segments()[:-1]:
+        if name in copied_names:
+          continue
+        start = time.time()
+        source = self.fetch_segment(name, tmp_dir)
+        first, last, events = read_event_times(source)
+        file_name = name + self.codec.extension
+        dest = os.path.join(self.path, file_name)
+        with open(source, "rb") as in_file:
+          with open(dest + ".tmp", "wb") as out_file:
+            dumpcodecs.compress_stream(self.codec, in_file, out_file)
+        os.rename(dest + ".tmp", dest)
+        if source.startswith(tmp_dir):
+          os.remove(source)
+        segment = {"name": name, "file": file_name, "first_time": first,
+          "last_time": last, "events": events, "size": os.path.getsize(dest)}
+        index["segments"].append(segment)
+        self.save_index(index)
+        copied.append(segment)
+        logging.info("Copied binlog %s, %d events in %.1fs." % (name, events,
+          time.time() - start))
+    finally:
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+      self.codec.close()
+    return copied
+
+  def expire(self, tstamps):
+
+    # positions of dumps no longer in the store are dropped, and segments
+    # from before the oldest remaining position are removed
+    positions = load_positions(self.store)
+    oldest = None
+    for tstamp, dbs in positions.items():
+      if tstamp not in tstamps:
+        os.remove(os.path.join(self.path, tstamp + POSITION_SUFFIX))
+        continue
+      for position in dbs.values():
+        if oldest == None or segment_key(position["file"]) < oldest:
+          oldest = segment_key(position["file"])
+    if oldest == None:
+      return []
+    index = self.load_index()
+    expired = [s for s in index["segments"] if segment_key(s["name"]) < oldest]
+    index["segments"] = [s for s in index["segments"]
+      if segment_key(s["name"]) >= oldest]
+    self.save_index(index)
+    for segment in expired:
+      os.remove(os.path.join(self.path, segment["file"]))
+      logging.info("Expired binlog %s." % segment["name"])
+    return expired
+
+  def replay_segments(self, position, until=None):
+
+    # segments from the dump position on, up to the first one that starts
+    # after the restore time, the copied segments must reach the restore time
+    # or the restore would silently stop short of it
+    index = self.load_index()
+    start = segment_key(position["file"])
+    segments = sorted([s for s in index["segments"]
+      if segment_key(s["name"]) >= start],
+      key=lambda segment: segment_key(segment["name"]))
+    if not segments or segments[0]["name"] != position["file"]:
+      raise ValueError("Binlog %s is not in the store" % position["file"])
+    if until != None:
+      until_time = time.mktime(until.timetuple())
+      ends = [s["last_time"] for s in segments if s["last_time"] != None]
+      if not ends or max(ends) < until_time:
+        raise ValueError("Binlogs in the store end before %s, copy them " %
+          until.strftime("%Y-%m-%d %H:%M:%S") + "with the flush option first")
+      segments = [s for s in segments if s["first_time"] == None or
+        s["first_time"] <= until_time]
+    return segments
+
+  def replay(self, db, position, until=None):
+
+    # the segments are decompressed together so mysqlbinlog can carry state
+    # across them, the start position applies to the first one
+    segments = self.replay_segments(position, until)
+    tmp_dir = tempfile.mkdtemp(dir=self.path)
+    try:
+      paths = []
+      for segment in segments:
+        path = os.path.join(tmp_dir, segment["name"])
+        segment_path = os.path.join(self.path, segment["file"])
+        codec = dumpcodecs.codec_for_path(segment_path)
+        with open(segment_path, "rb") as in_file:
+          with open(path, "wb") as out_file:
+            dumpcodecs.decompress_stream(codec, in_file, out_file)
+        codec.close()
+        paths.append(path)
+      replay_cmd = ["mysqlbinlog", "--database=" + db,
+        "--start-position=%d" % position["position"]]
+      if until != None:
+        replay_cmd.append("--stop-datetime=" +
+          until.strftime("%Y-%m-%d %H:%M:%S"))
+      replay = subprocess.Popen(replay_cmd + paths, stdout=subprocess.PIPE)
+      restore = subprocess.Popen(["mysql"] + self.connect_args() + [db],
+        stdin=replay.stdout)
+      replay.stdout.close()
+      result = restore.wait()
+      result = replay.wait() or result
+      if result:
+        raise RuntimeError("Replay of binlogs into %s failed %d" % (db,
+          result))
+      logging.info("Replayed %d binlogs into %s." % (len(paths), db))
+      return len(paths)
+    finally:
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+
+"""
+Prints out the usage for the command line.
+"""
+def usage():
+  usage = ["binlogbackup.py [-htupsbfzl]\n"]
+  usage.append("  [-h | --help] prints this help and usage message\n")
+  usage.append("  [-t | --store] the mysql backup store to copy binlogs into\n")
+  usage.append("  [-u | --user] the database user\n")
+  usage.append("  [-p | --password] the database password\n")
+  usage.append("  [-s | --host] the database server hostname\n")
+  usage.append("  [-b | --binlog-dir] read binlogs from this directory instead of the server\n")
+  usage.append("  [-f | --flush] flush the binary logs so the active one is copied\n")
+  usage.append("  [-z | --compression] codec and level to compress binlogs with\n")
+  usage.append("  [-l | --list] list the binlogs in the store and their times\n")
+  message = "".join(usage)
+  print(message)
+
+"""
+Main method that starts up the binlog copy.
+"""
+def main(argv):
+
+  # set the default values
+  store = None
+  user = "root"
+  password = None
+  host = None
+  binlog_dir = None
+  flush = False
+  compression = None
+  list_binlogs = False
+
+  try:
+
+    # process the command line options
+    opts, args = getopt.getopt(argv, "ht:u:p:s:b:fz:l", ["help", "store=",
+      "user=", "password=", "host=", "binlog-dir=", "flush", "compression=",
+      "list"])
+
+    # if no arguments print usage
+    if len(argv) == 0:
+      usage()
+      sys.exit()
+
+    # loop through all of the command line options and set the appropriate
+    # values, overriding defaults
+    for opt, arg in opts:
+      if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+      elif opt in ("-t", "--store"):
+        store = arg
+      elif opt in ("-u", "--user"):
+        user = arg
+      elif opt in ("-p", "--password"):
+        password = arg
+      elif opt in ("-s", "--host"):
+        host = arg
+      elif opt in ("-b", "--binlog-dir"):
+        binlog_dir = arg
+      elif opt in ("-f", "--flush"):
+        flush = True
+      elif opt in ("-z", "--compression"):
+        compression = arg
+      elif opt in ("-l", "--list"):
+        list_binlogs = True
+
+  except getopt.GetoptError as msg:
+    # if an error happens print the usage and exit with an error
+    logging.warning(msg)
+    usage()
+    sys.exit(errno.EIO)
+
+  # check options are set correctly
+  if store == None:
+    usage()
+    sys.exit(errno.EPERM)
+
+  binlog_backup = BinlogBackup(store, user, password, host, compression,
+    binlog_dir, flush)
+  if list_binlogs:
+    for segment in binlog_backup.load_index()["segments"]:
+      times = [datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")
+        if t else "-" for t in (segment["first_time"], segment["last_time"])]
+      print("%s %s %s %d events" % (segment["name"], times[0], times[1],
+        segment["events"]))
+    return
+
+  # only one copy at a time per store
+  lock = storelock.StoreLock(store, BINLOG_LOCK_NAME)
+  try:
+    lock.acquire()
+  except storelock.StoreLockBusy as e:
+    logging.warning("Binlog copy running, %s, exiting." % e)
+    sys.exit(errno.EBUSY)
+
+  try:
+    copied = binlog_backup.copy()
+    print("Copied %d binlogs." % len(copied))
+  except(Exception):
+    logging.exception("Binlog backup failed.")
+    sys.exit(1)
+  finally:
+    lock.release()
+
+# if we are running the script from the command line, run the main function
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+
+import sys
+import os
+import os.path
+import signal
+import logging
+import threading
+import datetime
+import subprocess
+import time
+import reapbackups
+
+"""
+-----------------------------------------------------------------------------
+Bandwidth and time of day scheduling of the rsyncs of a backup.  A backup can
+be given an aggregate bandwidth budget, a cap per rsync and time of day windows
+each with their own budget.  The budget is shared evenly by the rsyncs that
+are running or still waiting to run, as many as run at once, and every rsync
+is started with its share as its --bwlimit.
+
+rsync can't change its limit while it runs, so a watcher checks the running
+rsyncs as the windows and the number of jobs change.  An rsync whose share
+fell, because a lower window started, is stopped and started again at its new
+limit.  One that has run for a while and whose share at least doubled, because
+other jobs finished, is restarted to use the freed budget.  Outside of every window rsyncs are stopped
+and wait for the next window.  Stopped rsyncs keep their partly sent files in
+a partial dir so a restart carries on where they stopped.
+
+The limits are set in the config file of the backup, bandwidth is in KB per
+second as with rsync --bwlimit.
+
+      "bwlimit" : 10000,
+      "job_bwlimit" : 4000,
+      "windows" : [
+        {"window" : "20:00-07:00", "bwlimit" : 50000},
+        {"window" : "07:00-20:00", "bwlimit" : 2000}
+      ]
+
+Program: Transfer Scheduler
+Author: agent
+Date: October 17, 2026
+Revision: 1.1
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+20261017-1.1  agent               Restart callback for per attempt totals.
+-----------------------------------------------------------------------------
+"""
+
+# how often the watcher checks windows and shares, in seconds
+CHECK_INTERVAL = 30
+
+# a running rsync is restarted when its share grew by this factor, once it
+# has run long enough for the restart to pay off
+REBALANCE_FACTOR = 2
+REBALANCE_AFTER = 300
+
+PARTIAL_DIR = ".rsync-partial"
+
+class TransferScheduler:
+
+  def __init__(self, config=None, slots=1, interval=CHECK_INTERVAL):
+    config = config or {}
+    self.bwlimit = config.get("bwlimit")
+    self.job_bwlimit = config.get("job_bwlimit")
+    self.windows = [(reapbackups.parse_window(window["window"]),
+      window.get("bwlimit", self.bwlimit))
+      for window in config.get("windows", [])]
+    self.slots = max(1, slots)
+    self.interval = interval
+    self.enabled = bool(self.bwlimit or self.job_bwlimit or self.windows)
+    self.condition = threading.Condition()
+    self.pending = 0
+    self.running = {}
+    self.restarts = set()
+
+  def budget(self, now=None):
+
+    # the aggregate budget now, None when unlimited and 0 outside the windows
+    if not self.windows:
+      return self.bwlimit
+    for window, bwlimit in self.windows:
+      if reapbackups.in_window(window, now):
+        return bwlimit
+    return 0
+
+  def share(self, now=None):
+
+    # the budget split evenly across the jobs that run at once
+    budget = self.budget(now)
+    if budget == 0:
+      return 0
+    active = min(self.slots, max(1, len(self.running) + self.pending))
+    limit = budget and max(1, int(budget / active))
+    if self.job_bwlimit:
+      limit = min(limit or self.job_bwlimit, self.job_bwlimit)
+    return limit
+
+  def add(self, count=1):
+    with self.condition:
+      self.pending += count
+
+  def start(self, label):
+
+    # blocks outside of the windows, returns the limit to start with
+    with self.condition:
+      while self.enabled and self.share() == 0:
+        logging.info("Outside of the transfer windows, %s waiting." % label)
+        self.condition.wait(self.interval)
+      self.pending = max(0, self.pending - 1)
+      self.running[label] = None
+      limit = self.share() if self.enabled else None
+      self.running[label] = limit
+      return limit
+
+  def finish(self, label):
+
+    # returns True when the watcher stopped the job to restart it
+    with self.condition:
+      self.running.pop(label, None)
+      restart = label in self.restarts
+      self.restarts.discard(label)
+      if restart:
+        self.pending += 1
+      self.condition.notify_all()
+      return restart
+
+  def needs_restart(self, limit, share, elapsed):
+    if share == 0 or (limit and share and share < limit):
+      return True
+    if limit and elapsed >= REBALANCE_AFTER and (share == None or
+      share >= limit * REBALANCE_FACTOR):
+      return True
+    return False
+
+  def watch(self, label, proc, limit):
+
+    # stops the job when the window closes or its share moved enough
+    start = time.time()
+    while proc.poll() == None:
+      with self.condition:
+        self.condition.wait(self.interval)
+        if proc.poll() != None:
+          return
+        share = self.share()
+        if not self.needs_restart(limit, share, time.time() - start):
+          continue
+        self.restarts.add(label)
+      logging.info("Stopping %s at %s KB/s, share is now %s KB/s." % (label,
+        limit, share))
+      proc.send_signal(signal.SIGTERM)
+      return
+
+  def command(self, rsync_cmd, limit):
+
+    # limit and partial dir go right after the rsync executable
+    options = []
+    if limit:
+      options.append("--bwlimit=%d" % limit)
+    if self.enabled and not [arg for arg in rsync_cmd
+      if arg.startswith("--partial-dir")]:
+      options.append("--partial-dir=" + PARTIAL_DIR)
+    return rsync_cmd[:1] + options + rsync_cmd[1:]
+
+  def run(self, label, rsync_cmd, on_line=None, queued=False,
+    on_restart=None):
+
+    # runs the rsync until it finishes, restarting it when it was stopped,
+    # output lines are passed to on_line if given and on_restart is called
+    # before every restart so per attempt totals can be dropped, jobs queued
+    # up front were already added so they count towards the shares before
+    # they start
+    if not queued:
+      self.add()
+    while True:
+      limit = self.start(label)
+      cmd = self.command(rsync_cmd, limit)
+      logging.debug(cmd)
+      if on_line:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+          stderr=subprocess.STDOUT, universal_newlines=True)
+      else:
+        proc = subprocess.Popen(cmd)
+      watcher = None
+      if self.enabled:
+        watcher = threading.Thread(target=self.watch, args=(label, proc,
+          limit))
+        watcher.daemon = True
+        watcher.start()
+      if on_line:
+        for line in proc.stdout:
+          on_line(line)
+        proc.stdout.close()
+      result = proc.wait()
+      with self.condition:
+        self.condition.notify_all()
+      if watcher:
+        watcher.join()
+      if not self.finish(label):
+        return result
+      logging.info("Restarting %s." % label)
+      if on_restart:
+        on_restart()
@@ -0,0 +1,351 @@
+#!/usr/bin/python
+
+import sys
+import getopt
+import os
+import os.path
+import errno
+import logging
+import threading
+import sqlite3
+import time
+import tabledump
+
+"""
+-----------------------------------------------------------------------------
+A catalog of the snapshots and dumps in a backup store.  Every snapshot and
+dump is recorded in an sqlite database in the store with its timestamp,
+namespace, host, path, size, file count, duration and exit status, and is
+marked removed when it is expired.
+
+Rotation, retention and the restore menu read the catalog instead of listing
+and parsing the names in the store, and rotation updates it in the same
+journaled steps that rename and remove the snapshots, see rotatejournal.py.
+A store without a catalog is scanned once to fill it, and a catalog that has
+drifted from the store, for example after backups were removed by hand, is
+brought back in line with the scan option.  Rotation scans the store before
+it plans, under the store lock, so a snapshot that was never recorded, from a
+crashed backup or copied in by hand, is still rotated and expired.
+
+Use the -h or the --help flag to get a listing of options.
+
+Program: Backup Catalog
+Author: agent
+Date: October 17, 2026
+Revision: 1.0
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+-----------------------------------------------------------------------------
+"""
+
+CATALOG_NAME = ".catalog.db"
+
+# the snapshots directory of the timestamp layout, see snapshotstore.py
+SNAPSHOTS_NAME = "snapshots"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+  id INTEGER PRIMARY KEY,
+  kind TEXT NOT NULL,
+  tstamp TEXT NOT NULL,
+  namespace TEXT NOT NULL,
+  host TEXT,
+  path TEXT UNIQUE,
+  size INTEGER,
+  files INTEGER,
+  duration REAL,
+  status INTEGER,
+  created REAL,
+  removed REAL
+);
+CREATE INDEX IF NOT EXISTS entries_kind ON entries (kind, namespace, tstamp);
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value TEXT
+);
+"""
+
+FIELDS = ("kind", "tstamp", "namespace", "host", "path", "size", "files",
+  "duration", "status", "created", "removed")
+
+def is_tstamp(value):
+  return len(value) == 14 and value.isdigit()
+
+def parse_entry(path):
+
+  # the kind, timestamp and namespace of a name in the store, numbered
+  # snapshots are NNN.tstamp.name, snapshot store snapshots are tstamp.name
+  # in the snapshots directory and dumps are tstamp.db.sql.ext files or
+  # tstamp.db table dump directories
+  parts = os.path.basename(path).split(".")
+  if len(parts) < 2 or not parts[0].isdigit():
+    return None
+  if os.path.dirname(path) == SNAPSHOTS_NAME and is_tstamp(parts[0]):
+    return ("snapshot", parts[0], ".".join(parts[1:]))
+  if is_tstamp(parts[0]):
+    return ("dump", parts[0], parts[1])
+  if len(parts) >= 3 and is_tstamp(parts[1]):
+    return ("snapshot", parts[1], ".".join(parts[2:]))
+  return None
+
+class Catalog:
+
+  def __init__(self, store=None):
+    self.store = os.path.abspath(store)
+    self.path = os.path.join(self.store, CATALOG_NAME)
+    self.lock = threading.Lock()
+    new_catalog = not os.path.exists(self.path)
+    self.conn = sqlite3.connect(self.path, timeout=60,
+      check_same_thread=False)
+    self.conn.row_factory = sqlite3.Row
+    with self.conn:
+      self.conn.executescript(SCHEMA)
+
+    # an existing store is scanned the first time it is cataloged
+    if new_catalog or self.get_meta("scanned") == None:
+      self.scan()
+
+  def close(self):
+    self.conn.close()
+
+  def get_meta(self, key):
+    row = self.conn.execute("SELECT value FROM meta WHERE key = ?",
+      (key,)).fetchone()
+    return row[0] if row else None
+
+  def set_meta(self, key, value):
+    self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+      (key, value))
+
+  def upsert(self, entry):
+
+    # fields not given keep their recorded values
+    entry = dict(entry)
+    entry.setdefault("created", time.time())
+    names = [name for name in FIELDS if name in entry]
+    updates = [name for name in names if name not in ("path", "created")]
+    sql = "INSERT INTO entries (%s) VALUES (%s) ON CONFLICT(path) DO UPDATE SET %s" % (
+      ", ".join(names), ", ".join(["?"] * len(names)),
+      ", ".join(["%s = excluded.%s" % (name, name) for name in updates]))
+    self.conn.execute(sql, [entry[name] for name in names])
+
+  def record(self, kind, tstamp, namespace, path, **fields):
+
+    # record a snapshot or dump, paths are relative to the store
+    entry = dict(fields)
+    entry.update({"kind": kind, "tstamp": tstamp, "namespace": namespace,
+      "path": os.path.relpath(os.path.abspath(path), self.store)})
+    with self.lock:
+      with self.conn:
+        self.upsert(entry)
+
+  def apply(self, changes):
+
+    # a batch of changes in one transaction, every change can be applied
+    # again, a rotation journal replays the batch after a crash
+    with self.lock:
+      with self.conn:
+        for change in changes:
+          action = change["action"]
+          if action == "add":
+            self.upsert(change["entry"])
+          elif action == "move":
+            self.conn.execute("UPDATE entries SET path = ? WHERE path = ?",
+              (change["dst"], change["src"]))
+          elif action == "remove":
+            self.conn.execute("UPDATE entries SET path = NULL, removed = ? " +
+              "WHERE path = ?", (time.time(), change["path"]))
+          else:
+            raise ValueError("Unknown catalog change %s" % action)
+
+  def remove(self, path):
+    self.apply([{"action": "remove", "path": os.path.relpath(
+      os.path.abspath(path), self.store)}])
+
+  def entries(self, kind=None, namespace=None, removed=False):
+
+    # newest first
+    sql = "SELECT * FROM entries WHERE 1 = 1"
+    args = []
+    if kind != None:
+      sql += " AND kind = ?"
+      args.append(kind)
+    if namespace != None:
+      sql += " AND namespace = ?"
+      args.append(namespace)
+    if not removed:
+      sql += " AND removed IS NULL"
+    sql += " ORDER BY tstamp DESC, path DESC"
+    with self.lock:
+      return [dict(row) for row in self.conn.execute(sql, args)]
+
+  def full_path(self, entry):
+    return os.path.join(self.store, entry["path"])
+
+  def query(self, sql, args=()):
+    with self.lock:
+      cursor = self.conn.execute(sql, args)
+      columns = [column[0] for column in cursor.description or []]
+      return columns, [tuple(row) for row in cursor.fetchall()]
+
+  def listing(self):
+
+    # the entries of the names in the store, known only from their names
+    found = []
+    for name in os.listdir(self.store):
+      found.append(name)
+    snapshots_path = os.path.join(self.store, SNAPSHOTS_NAME)
+    if os.path.isdir(snapshots_path):
+      for name in os.listdir(snapshots_path):
+        found.append(os.path.join(SNAPSHOTS_NAME, name))
+
+    entries = {}
+    for path in found:
+      parsed = parse_entry(path)
+      full_path = os.path.join(self.store, path)
+      if parsed == None or full_path.endswith(".tmp"):
+        continue
+      if (parsed[0] == "dump" and os.path.isdir(full_path) and
+        not os.path.exists(os.path.join(full_path, tabledump.MANIFEST_NAME))):
+        continue
+      entries[path] = {"kind": parsed[0], "tstamp": parsed[1],
+        "namespace": parsed[2], "path": path}
+      if not os.path.isdir(full_path):
+        entries[path]["size"] = os.path.getsize(full_path)
+        entries[path]["files"] = 1
+    return entries
+
+  def unknown(self, kind=None, namespace=None):
+
+    # names in the store the catalog doesn't know, newest first, read only so
+    # it is safe without the store lock while a rotation renames snapshots
+    with self.lock:
+      known = set([row[0] for row in self.conn.execute(
+        "SELECT path FROM entries WHERE path IS NOT NULL")])
+    entries = [entry for path, entry in self.listing().items()
+      if path not in known and (kind == None or entry["kind"] == kind) and
+      (namespace == None or entry["namespace"] == namespace)]
+    return sorted(entries, key=lambda entry: (entry["tstamp"], entry["path"]),
+      reverse=True)
+
+  def scan(self):
+
+    # bring the catalog in line with the store, names found are added and
+    # entries whose names are gone are marked removed
+    entries = self.listing()
+    with self.lock:
+      with self.conn:
+        known = set([row[0] for row in self.conn.execute(
+          "SELECT path FROM entries WHERE removed IS NULL")])
+        for path, entry in entries.items():
+          if path not in known:
+            self.upsert(entry)
+        for path in known - set(entries.keys()):
+          self.conn.execute("UPDATE entries SET path = NULL, removed = ? " +
+            "WHERE path = ?", (time.time(), path))
+        self.set_meta("scanned", str(time.time()))
+    return len(entries)
+
+"""
+Prints out the usage for the command line.
+"""
+def usage():
+  usage = ["catalog.py [-htlknasq]\n"]
+  usage.append("  [-h | --help] prints this help and usage message\n")
+  usage.append("  [-t | --store] the backup store of the catalog\n")
+  usage.append("  [-l | --list] list the snapshots and dumps, newest first\n")
+  usage.append("  [-k | --kind] only list this kind, snapshot or dump\n")
+  usage.append("  [-n | --namespace] only list this namespace or database\n")
+  usage.append("  [-a | --all] include removed entries in the listing\n")
+  usage.append("  [-s | --scan] sync the catalog with the names in the store\n")
+  usage.append("  [-q | --query] run an sql query against the catalog\n")
+  message = "".join(usage)
+  print(message)
+
+def format_row(values):
+  return "\t".join(["" if value == None else str(value) for value in values])
+
+"""
+Main method that starts up the catalog commands.
+"""
+def main(argv):
+
+  # set the default values
+  store = None
+  list_entries = False
+  kind = None
+  namespace = None
+  removed = False
+  scan = False
+  sql = None
+
+  try:
+
+    # process the command line options
+    opts, args = getopt.getopt(argv, "ht:lk:n:asq:", ["help", "store=",
+      "list", "kind=", "namespace=", "all", "scan", "query="])
+
+    # if no arguments print usage
+    if len(argv) == 0:
+      usage()
+      sys.exit()
+
+    # loop through all of the command line options and set the appropriate
+    # values, overriding defaults
+    for opt, arg in opts:
+      if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+      elif opt in ("-t", "--store"):
+        store = arg
+      elif opt in ("-l", "--list"):
+        list_entries = True
+      elif opt in ("-k", "--kind"):
+        kind = arg
+      elif opt in ("-n", "--namespace"):
+        namespace = arg
+      elif opt in ("-a", "--all"):
+        removed = True
+      elif opt in ("-s", "--scan"):
+        scan = True
+      elif opt in ("-q", "--query"):
+        sql = arg
+
+  except getopt.GetoptError as msg:
+    # if an error happens print the usage and exit with an error
+    logging.warning(msg)
+    usage()
+    sys.exit(errno.EIO)
+
+  # check options are set correctly
+  if store == None:
+    usage()
+    sys.exit(errno.EPERM)
+
+  backup_catalog = Catalog(store)
+  try:
+    if scan:
+      print("%d entries in %s." % (backup_catalog.scan(), store))
+    if list_entries:
+      columns = ["kind", "tstamp", "namespace", "host", "path", "size",
+        "files", "duration", "status"]
+      print("\t".join(columns))
+      for entry in backup_catalog.entries(kind, namespace, removed):
+        print(format_row([entry[column] for column in columns]))
+    if sql:
+      columns, rows = backup_catalog.query(sql)
+      if columns:
+        print("\t".join(columns))
+      for row in rows:
+        print(format_row(row))
+  except sqlite3.Error as e:
+    logging.error("Catalog query failed, %s." % e)
+    sys.exit(1)
+  finally:
+    backup_catalog.close()
+
+# if we are running the script from the command line, run the main function
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,353 @@
+#!/usr/bin/python
+
+import sys
+import getopt
+import os
+import os.path
+import re
+import errno
+import logging
+import hashlib
+import gzip
+import zlib
+import time
+import tempfile
+import dumpcodecs
+
+"""
+-----------------------------------------------------------------------------
+A deduplicating store for database dumps.  The uncompressed dump stream is
+split into content defined chunks, each chunk is compressed and stored once in
+the chunks directory of the store under its sha256, and the dump itself is
+kept as a recipe listing its chunks in order.  Consecutive dumps of a database
+are almost identical so each new dump only adds the chunks that changed.
+
+Chunk boundaries are placed where the hash of the bytes before a row or line
+separator matches a mask, so an insert or update only changes the chunks
+around it and the boundaries after it line up again.  Chunks are between a
+minimum and maximum size, 256KB on average for typical dumps.
+
+The store is used as the dedup codec of mysqlbackup.py, a recipe is written
+where the compressed dump would be and restores reassemble the dump from its
+chunks as a stream.  Chunks no longer used by any recipe in the store are
+removed by the garbage collector once the recipes are expired.
+
+Use the -h or the --help flag to get a listing of options.
+
+Program: Chunk Store
+Author: agent
+Date: October 17, 2026
+Revision: 1.0
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+-----------------------------------------------------------------------------
+"""
+
+CODEC_NAME = "dedup"
+CHUNKS_NAME = "chunks"
+RECIPE_EXTENSION = ".chunks"
+RECIPE_HEADER = "# chunkstore 1\n"
+
+MIN_CHUNK = 64 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+BOUNDARY_WINDOW = 48
+BOUNDARY_MASK = 0x3ff
+
+# candidate boundaries, newlines and the separators of extended inserts
+BOUNDARY = re.compile(br"\n|\),\(")
+
+# chunks younger than this are never collected, a running dump may be about to
+# reference them
+GC_GRACE = 6 * 3600
+
+def find_boundary(data, start=0):
+
+  # the first content defined boundary at or after start, or None if the data
+  # needs more bytes to find one
+  start = max(start, MIN_CHUNK)
+  end = min(len(data), MAX_CHUNK)
+  for match in BOUNDARY.finditer(data, start, end):
+    cut = match.end()
+    if zlib.crc32(data[cut - BOUNDARY_WINDOW:cut]) & BOUNDARY_MASK == 0:
+      return cut
+  if len(data) >= MAX_CHUNK:
+    return MAX_CHUNK
+  return None
+
+class ChunkStore:
+
+  def __init__(self, store=None, level=6):
+    self.store = os.path.abspath(store)
+    self.path = os.path.join(self.store, CHUNKS_NAME)
+    self.level = level
+
+  def chunk_path(self, digest):
+    return os.path.join(self.path, digest[:2], digest)
+
+  def put(self, data):
+
+    # a chunk already stored is only touched so the collector keeps it
+    digest = hashlib.sha256(data).hexdigest()
+    path = self.chunk_path(digest)
+    if os.path.exists(path):
+      os.utime(path, None)
+      return digest, False
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+      os.makedirs(parent, exist_ok=True)
+    # every writer has its own temp file, threads storing the same new chunk
+    # each rename a complete copy into place
+    fd, tmp_path = tempfile.mkstemp(prefix=digest + ".", suffix=".tmp",
+      dir=parent)
+    with os.fdopen(fd, "wb") as chunk_file:
+      chunk_file.write(zlib.compress(data, self.level))
+    os.rename(tmp_path, path)
+    return digest, True
+
+  def get(self, digest):
+    with open(self.chunk_path(digest), "rb") as chunk_file:
+      data = zlib.decompress(chunk_file.read())
+    if hashlib.sha256(data).hexdigest() != digest:
+      raise ValueError("Chunk %s is corrupt" % digest)
+    return data
+
+  def recipes(self):
+
+    # recipes sit in the store or in the dump directories of table dumps
+    found = []
+    for root, dirs, names in os.walk(self.store):
+      if root == self.store and CHUNKS_NAME in dirs:
+        dirs.remove(CHUNKS_NAME)
+      for name in names:
+        if name.endswith(RECIPE_EXTENSION):
+          found.append(os.path.join(root, name))
+    return found
+
+  def referenced(self):
+    digests = set()
+    for recipe_path in self.recipes():
+      with open(recipe_path, "rb") as recipe_file:
+        for digest, size in read_recipe(recipe_file):
+          digests.add(digest)
+    return digests
+
+  def gc(self, grace=GC_GRACE):
+
+    # remove the chunks no recipe in the store references
+    if not os.path.isdir(self.path):
+      return 0, 0
+    start = time.time()
+    digests = self.referenced()
+    removed = 0
+    freed = 0
+    for prefix in os.listdir(self.path):
+      prefix_path = os.path.join(self.path, prefix)
+      for name in os.listdir(prefix_path):
+        if name in digests:
+          continue
+        path = os.path.join(prefix_path, name)
+        st = os.stat(path)
+        if st.st_mtime > start - grace:
+          continue
+        os.remove(path)
+        removed += 1
+        freed += st.st_size
+    logging.info("Removed %d chunks, %d bytes in %.1fs." % (removed, freed,
+      time.time() - start))
+    return removed, freed
+
+  def stats(self):
+
+    # bytes the recipes describe against bytes the chunks take on disk
+    logical = 0
+    recipes = self.recipes()
+    for recipe_path in recipes:
+      with open(recipe_path, "rb") as recipe_file:
+        logical += sum([size for digest, size in read_recipe(recipe_file)])
+    chunks = 0
+    stored = 0
+    if os.path.isdir(self.path):
+      for prefix in os.listdir(self.path):
+        prefix_path = os.path.join(self.path, prefix)
+        for name in os.listdir(prefix_path):
+          chunks += 1
+          stored += os.path.getsize(os.path.join(prefix_path, name))
+    return {"recipes": len(recipes), "chunks": chunks, "logical": logical,
+      "stored": stored}
+
+def read_recipe(recipe_file):
+
+  # a recipe is gzipped lines of chunk digest and size
+  with gzip.GzipFile(fileobj=recipe_file, mode="rb") as lines:
+    header = lines.readline().decode("ascii")
+    if header != RECIPE_HEADER:
+      raise ValueError("Not a chunk recipe")
+    for line in lines:
+      digest, size = line.decode("ascii").split()
+      yield digest, int(size)
+
+class ChunkWriter:
+
+  def __init__(self, chunk_store, out_file):
+    self.chunk_store = chunk_store
+    self.recipe = gzip.GzipFile(fileobj=out_file, mode="wb")
+    self.recipe.write(RECIPE_HEADER.encode("ascii"))
+    self.buffer = b""
+    self.scanned = 0
+    self.new_chunks = 0
+
+  def put(self, data):
+    digest, new = self.chunk_store.put(data)
+    self.new_chunks += new
+    self.recipe.write(("%s %d\n" % (digest, len(data))).encode("ascii"))
+
+  def write(self, data):
+
+    # scanning resumes where the last write stopped, less the window so a
+    # separator split across writes is still seen
+    self.buffer += data
+    while True:
+      cut = find_boundary(self.buffer, self.scanned)
+      if cut == None:
+        self.scanned = max(0, len(self.buffer) - BOUNDARY_WINDOW)
+        break
+      self.put(self.buffer[:cut])
+      self.buffer = self.buffer[cut:]
+      self.scanned = 0
+    return len(data)
+
+  def close(self):
+    if self.buffer:
+      self.put(self.buffer)
+      self.buffer = b""
+    self.recipe.close()
+
+class ChunkReader:
+
+  def __init__(self, chunk_store, in_file):
+    self.chunk_store = chunk_store
+    self.chunks = read_recipe(in_file)
+    self.buffer = b""
+
+  def read(self, size=-1):
+
+    # reassembles the dump a chunk at a time
+    while size < 0 or len(self.buffer) < size:
+      digest = next(self.chunks, None)
+      if digest == None:
+        break
+      self.buffer += self.chunk_store.get(digest[0])
+    if size < 0:
+      size = len(self.buffer)
+    data = self.buffer[:size]
+    self.buffer = self.buffer[size:]
+    return data
+
+  def close(self):
+    self.chunks.close()
+
+class ChunkCodec(dumpcodecs.Codec):
+
+  def __init__(self, store=None, level=None):
+    dumpcodecs.Codec.__init__(self, CODEC_NAME, RECIPE_EXTENSION,
+      6 if level == None else level)
+    self.chunk_store = ChunkStore(store, self.level)
+
+  def open_writer(self, out_file):
+    return ChunkWriter(self.chunk_store, out_file)
+
+  def open_reader(self, in_file):
+    return ChunkReader(self.chunk_store, in_file)
+
+def get_codec(store, spec=None):
+
+  # the dedup codec needs the store its chunks live in
+  if spec and spec.split(":")[0] == CODEC_NAME:
+    return ChunkCodec(store, *[int(part) for part in spec.split(":")[1:]])
+  return dumpcodecs.get_codec(spec)
+
+def codec_for_path(store, path):
+  if path.endswith(RECIPE_EXTENSION):
+    return ChunkCodec(store)
+  return dumpcodecs.codec_for_path(path)
+
+"""
+Prints out the usage for the command line.
+"""
+def usage():
+  usage = ["chunkstore.py [-htgsr]\n"]
+  usage.append("  [-h | --help] prints this help and usage message\n")
+  usage.append("  [-t | --store] the dump store holding the chunks\n")
+  usage.append("  [-g | --gc] remove the chunks no dump uses anymore\n")
+  usage.append("  [-s | --stats] print the dedup ratio of the store\n")
+  usage.append("  [-r | --reassemble] write the dump of a recipe to stdout\n")
+  message = "".join(usage)
+  print(message)
+
+"""
+Main method that starts up the chunk store commands.
+"""
+def main(argv):
+
+  # set the default values
+  store = None
+  collect = False
+  stats = False
+  recipe_path = None
+
+  try:
+
+    # process the command line options
+    opts, args = getopt.getopt(argv, "ht:gsr:", ["help", "store=", "gc",
+      "stats", "reassemble="])
+
+    # if no arguments print usage
+    if len(argv) == 0:
+      usage()
+      sys.exit()
+
+    # loop through all of the command line options and set the appropriate
+    # values, overriding defaults
+    for opt, arg in opts:
+      if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+      elif opt in ("-t", "--store"):
+        store = arg
+      elif opt in ("-g", "--gc"):
+        collect = True
+      elif opt in ("-s", "--stats"):
+        stats = True
+      elif opt in ("-r", "--reassemble"):
+        recipe_path = arg
+
+  except getopt.GetoptError as msg:
+    # if an error happens print the usage and exit with an error
+    logging.warning(msg)
+    usage()
+    sys.exit(errno.EIO)
+
+  # check options are set correctly
+  if store == None:
+    usage()
+    sys.exit(errno.EPERM)
+
+  chunk_store = ChunkStore(store)
+  if recipe_path:
+    codec = ChunkCodec(store)
+    with open(recipe_path, "rb") as in_file:
+      dumpcodecs.decompress_stream(codec, in_file, sys.stdout.buffer)
+  if collect:
+    removed, freed = chunk_store.gc()
+    print("Removed %d chunks, %d bytes." % (removed, freed))
+  if stats:
+    info = chunk_store.stats()
+    print("%d recipes, %d chunks, %d bytes of dumps in %d bytes, %.1fx" % (
+      info["recipes"], info["chunks"], info["logical"], info["stored"],
+      float(info["logical"]) / max(info["stored"], 1)))
+
+# if we are running the script from the command line, run the main function
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,474 @@
+#!/usr/bin/python
+
+import sys
+import getopt
+import os
+import os.path
+import errno
+import logging
+import time
+import gzip
+import bz2
+import lzma
+import zlib
+import struct
+import threading
+import collections
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+"""
+-----------------------------------------------------------------------------
+Streaming compression codecs for database dumps.  A codec is chosen by a spec
+of the form name or name:level, for example gzip:6, bz2, xz:3 or zstd:10, and
+the dump is compressed in process as it is read from mysqldump.  On restore
+the codec is detected from the file extension.
+
+The pgzip codec splits the dump into blocks and compresses each block into its
+own gzip member on a pool of processes.  Concatenated gzip members are a valid
+gzip file so gunzip restores them as usual.  Each member records its size in
+a gzip extra field, the same way bgzf does, so the members can be found
+without decompressing and restore decompresses them in parallel too.  The
+spec is pgzip:level or pgzip:level:processes, all cores by default.
+
+The zstd codec needs the zstandard module, the others only need the python
+standard library.  Run this script on a sample dump to compare the size and
+speed of the codecs against each other.
+
+Use the -h or the --help flag to get a listing of options.
+
+Program: Dump Codecs
+Author: agent
+Date: October 17, 2026
+Revision: 1.1
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+20261017-1.1  agent               Added block parallel gzip codec.
+-----------------------------------------------------------------------------
+"""
+
+# size of the blocks streamed through a codec
+BLOCK_SIZE = 1024 * 1024
+
+# how the pgzip workers are started, never by a plain fork of the dump threads
+if "forkserver" in multiprocessing.get_all_start_methods():
+  POOL_START_METHOD = "forkserver"
+else:
+  POOL_START_METHOD = "spawn"
+
+class Codec:
+
+  def __init__(self, name=None, extension=None, level=None):
+    self.name = name
+    self.extension = extension
+    self.level = level
+
+  def spec(self):
+    if self.level == None:
+      return self.name
+    return "%s:%d" % (self.name, self.level)
+
+  def open_writer(self, out_file):
+    raise NotImplementedError()
+
+  def open_reader(self, in_file):
+    raise NotImplementedError()
+
+  def close(self):
+    pass
+
+class NoneCodec(Codec):
+
+  def __init__(self, level=None):
+    Codec.__init__(self, "none", "", None)
+
+  def open_writer(self, out_file):
+    return out_file
+
+  def open_reader(self, in_file):
+    return in_file
+
+class GzipCodec(Codec):
+
+  def __init__(self, level=None):
+    Codec.__init__(self, "gzip", ".gz", 6 if level == None else level)
+
+  def open_writer(self, out_file):
+    return gzip.GzipFile(fileobj=out_file, mode="wb",
+      compresslevel=self.level)
+
+  def open_reader(self, in_file):
+    return gzip.GzipFile(fileobj=in_file, mode="rb")
+
+class Bz2Codec(Codec):
+
+  def __init__(self, level=None):
+    Codec.__init__(self, "bz2", ".bz2", 9 if level == None else level)
+
+  def open_writer(self, out_file):
+    return bz2.BZ2File(out_file, mode="wb", compresslevel=self.level)
+
+  def open_reader(self, in_file):
+    return bz2.BZ2File(in_file, mode="rb")
+
+class XzCodec(Codec):
+
+  def __init__(self, level=None):
+    Codec.__init__(self, "xz", ".xz", 6 if level == None else level)
+
+  def open_writer(self, out_file):
+    return lzma.LZMAFile(out_file, mode="wb", preset=self.level)
+
+  def open_reader(self, in_file):
+    return lzma.LZMAFile(in_file, mode="rb")
+
+class ZstdCodec(Codec):
+
+  def __init__(self, level=None):
+    if zstandard == None:
+      raise ValueError("The zstd codec needs the zstandard module")
+    Codec.__init__(self, "zstd", ".zst", 3 if level == None else level)
+
+  def open_writer(self, out_file):
+    compressor = zstandard.ZstdCompressor(level=self.level)
+    return compressor.stream_writer(out_file, closefd=False)
+
+  def open_reader(self, in_file):
+    return zstandard.ZstdDecompressor().stream_reader(in_file,
+      closefd=False)
+
+# block size of the pgzip codec and the id of the extra field holding the
+# size of each member
+PGZIP_BLOCK_SIZE = 4 * 1024 * 1024
+PGZIP_EXTRA_ID = b"BP"
+
+def pgzip_member(block, level):
+
+  # a complete gzip member with the total member size in an extra field,
+  # run in the worker processes
+  compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+  deflated = compressor.compress(block) + compressor.flush()
+  header_size = 10 + 2 + 8
+  member_size = header_size + len(deflated) + 8
+  header = struct.pack("<BBBBIBBH2sHI", 0x1f, 0x8b, 8, 4, 0, 0, 255, 8,
+    PGZIP_EXTRA_ID, 4, member_size)
+  trailer = struct.pack("<II", zlib.crc32(block) & 0xffffffff,
+    len(block) & 0xffffffff)
+  return header + deflated + trailer
+
+def pgzip_inflate(path, offset, size):
+
+  # decompress a single member read straight from the file, run in the
+  # worker processes
+  with open(path, "rb") as in_file:
+    in_file.seek(offset)
+    member = in_file.read(size)
+  return zlib.decompress(member, 16 + zlib.MAX_WBITS)
+
+def pgzip_members(in_file):
+
+  # the offset and size of every member, or None if any member doesn't carry
+  # its size and the file has to be read serially
+  members = []
+  offset = 0
+  end = os.fstat(in_file.fileno()).st_size
+  while offset < end:
+    in_file.seek(offset)
+    header = in_file.read(20)
+    if len(header) < 20:
+      return None
+    (id1, id2, method, flags, mtime, xfl, os_id, xlen, extra_id, extra_len,
+      member_size) = struct.unpack("<BBBBIBBH2sHI", header)
+    if (id1, id2, flags, extra_id, extra_len) != (0x1f, 0x8b, 4,
+      PGZIP_EXTRA_ID, 4):
+      return None
+    members.append((offset, member_size))
+    offset += member_size
+  in_file.seek(0)
+  return members
+
+class ParallelGzipWriter:
+
+  def __init__(self, codec, out_file):
+    self.codec = codec
+    self.out_file = out_file
+    self.pool = codec.get_pool()
+    self.buffer = []
+    self.buffered = 0
+    self.pending = collections.deque()
+
+  def flush_pending(self, limit):
+
+    # members are written in order, at most limit blocks are in flight
+    while len(self.pending) > limit:
+      self.out_file.write(self.pending.popleft().result())
+
+  def submit(self):
+    block = b"".join(self.buffer)
+    self.buffer = []
+    self.buffered = 0
+    self.pending.append(self.pool.submit(pgzip_member, block,
+      self.codec.level))
+    self.flush_pending(2 * self.codec.processes)
+
+  def write(self, data):
+    self.buffer.append(data)
+    self.buffered += len(data)
+    if self.buffered >= PGZIP_BLOCK_SIZE:
+      self.submit()
+    return len(data)
+
+  def close(self):
+    if self.buffered or not self.pending:
+      self.submit()
+    self.flush_pending(0)
+
+class ParallelGzipReader:
+
+  def __init__(self, codec, in_file, members):
+    self.codec = codec
+    self.path = in_file.name
+    self.members = collections.deque(members)
+    self.pool = codec.get_pool()
+    self.pending = collections.deque()
+    self.block = b""
+
+  def fill(self):
+
+    # keep the pool busy with the next members while the current is read
+    while self.members and len(self.pending) < 2 * self.codec.processes:
+      offset, size = self.members.popleft()
+      self.pending.append(self.pool.submit(pgzip_inflate, self.path, offset,
+        size))
+
+  def read(self, size=-1):
+    while not self.block:
+      self.fill()
+      if not self.pending:
+        return b""
+      self.block = self.pending.popleft().result()
+    if size < 0 or size >= len(self.block):
+      data, self.block = self.block, b""
+    else:
+      data, self.block = self.block[:size], self.block[size:]
+    return data
+
+  def close(self):
+    for future in self.pending:
+      future.cancel()
+    self.pending.clear()
+
+class ParallelGzipCodec(Codec):
+
+  def __init__(self, level=None, processes=None):
+    Codec.__init__(self, "pgzip", ".gz", 6 if level == None else level)
+
+    # not part of the spec, the output is the same on any number of processes
+    # and a previous dump is only reused while the spec matches
+    self.processes = processes or os.cpu_count() or 1
+    self.pool = None
+    self.pool_lock = threading.Lock()
+
+  def get_pool(self):
+
+    # one pool shared by every dump and restore using the codec, it is first
+    # used from a dump thread so the workers are started by a forkserver, a
+    # fork of the threaded process could inherit a lock another thread held
+    with self.pool_lock:
+      if self.pool == None:
+        self.pool = ProcessPoolExecutor(max_workers=self.processes,
+          mp_context=multiprocessing.get_context(POOL_START_METHOD))
+      return self.pool
+
+  def open_writer(self, out_file):
+    return ParallelGzipWriter(self, out_file)
+
+  def close(self):
+    with self.pool_lock:
+      if self.pool != None:
+        self.pool.shutdown()
+        self.pool = None
+
+  def open_reader(self, in_file):
+
+    # gzip files not written by this codec are read serially
+    members = pgzip_members(in_file)
+    if members == None:
+      return gzip.GzipFile(fileobj=in_file, mode="rb")
+    return ParallelGzipReader(self, in_file, members)
+
+CODECS = {
+  "none": NoneCodec,
+  "gzip": GzipCodec,
+  "pgzip": ParallelGzipCodec,
+  "bz2": Bz2Codec,
+  "xz": XzCodec,
+  "zstd": ZstdCodec
+}
+
+def get_codec(spec=None):
+
+  # a spec is name or name:level, gzip at its default level if not given
+  if not spec:
+    return GzipCodec()
+  parts = spec.split(":")
+  name = parts[0]
+  if name not in CODECS:
+    raise ValueError("Unknown codec %s, expected one of %s" % (name,
+      ", ".join(sorted(CODECS.keys()))))
+  return CODECS[name](*[int(part) for part in parts[1:]])
+
+# file extensions of the compressed codecs
+EXTENSIONS = {
+  ".gz": "gzip",
+  ".bz2": "bz2",
+  ".xz": "xz",
+  ".zst": "zstd"
+}
+
+def codec_for_path(path):
+
+  # detect the codec of a dump from its extension, gzip files written by the
+  # pgzip codec are read back in parallel
+  extension = os.path.splitext(path)[1]
+  name = EXTENSIONS.get(extension, "none")
+  if name == "gzip":
+    with open(path, "rb") as in_file:
+      header = in_file.read(16)
+    if header[3:4] == b"\x04" and header[12:14] == PGZIP_EXTRA_ID:
+      name = "pgzip"
+  return CODECS[name]()
+
+def copy_stream(in_file, out_file, progress=None):
+
+  # copy in blocks, returning the number of bytes copied
+  copied = 0
+  while True:
+    block = in_file.read(BLOCK_SIZE)
+    if not block:
+      break
+    out_file.write(block)
+    copied += len(block)
+    if progress:
+      progress(copied)
+  return copied
+
+def compress_stream(codec, in_file, out_file):
+  writer = codec.open_writer(out_file)
+  try:
+    return copy_stream(in_file, writer)
+  finally:
+    if writer is not out_file:
+      writer.close()
+
+def decompress_stream(codec, in_file, out_file, progress=None):
+  reader = codec.open_reader(in_file)
+  try:
+    return copy_stream(reader, out_file, progress)
+  finally:
+    if reader is not in_file:
+      reader.close()
+
+class NullWriter:
+
+  def write(self, data):
+    return len(data)
+
+def benchmark(sample_path, specs):
+
+  # compress the sample to a file next to it and decompress it back with
+  # each codec, timing both
+  results = []
+  sample_size = os.path.getsize(sample_path)
+  for spec in specs:
+    codec = get_codec(spec)
+    out_path = sample_path + ".bench" + codec.extension
+    start = time.time()
+    with open(sample_path, "rb") as in_file:
+      with open(out_path, "wb") as out_file:
+        compress_stream(codec, in_file, out_file)
+    compress_time = time.time() - start
+    size = os.path.getsize(out_path)
+    start = time.time()
+    with open(out_path, "rb") as in_file:
+      decompress_stream(codec, in_file, NullWriter())
+    decompress_time = time.time() - start
+    os.remove(out_path)
+    results.append((codec.spec(), size, float(sample_size) / max(size, 1),
+      sample_size / max(compress_time, 1e-9) / 1048576,
+      sample_size / max(decompress_time, 1e-9) / 1048576))
+    codec.close()
+  return results
+
+"""
+Prints out the usage for the command line.
+"""
+def usage():
+  usage = ["dumpcodecs.py [-hfc]\n"]
+  usage.append("  [-h | --help] prints this help and usage message\n")
+  usage.append("  [-f | --file] uncompressed sample dump to benchmark with\n")
+  usage.append("  [-c | --codecs] comma separated codec specs, name or name:level\n")
+  message = "".join(usage)
+  print(message)
+
+"""
+Main method that starts up the benchmark.
+"""
+def main(argv):
+
+  # set the default values
+  sample_path = None
+  specs = "gzip:1,gzip:6,gzip:9,pgzip:6,bz2,xz:1,xz:6"
+  if zstandard != None:
+    specs += ",zstd:3,zstd:10,zstd:19"
+
+  try:
+
+    # process the command line options
+    opts, args = getopt.getopt(argv, "hf:c:", ["help", "file=", "codecs="])
+
+    # if no arguments print usage
+    if len(argv) == 0:
+      usage()
+      sys.exit()
+
+    # loop through all of the command line options and set the appropriate
+    # values, overriding defaults
+    for opt, arg in opts:
+      if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+      elif opt in ("-f", "--file"):
+        sample_path = arg
+      elif opt in ("-c", "--codecs"):
+        specs = arg
+
+  except getopt.GetoptError as msg:
+    # if an error happens print the usage and exit with an error
+    logging.warning(msg)
+    usage()
+    sys.exit(errno.EIO)
+
+  # check options are set correctly
+  if sample_path == None:
+    usage()
+    sys.exit(errno.EPERM)
+
+  print("%-10s %14s %8s %12s %12s" % ("codec", "bytes", "ratio", "comp MB/s",
+    "decomp MB/s"))
+  for spec, size, ratio, comp_rate, decomp_rate in benchmark(sample_path,
+    [s.strip() for s in specs.split(",")]):
+    print("%-10s %14d %8.2f %12.1f %12.1f" % (spec, size, ratio, comp_rate,
+      decomp_rate))
+
+# if we are running the script from the command line, run the main function
+if __name__ == "__main__":
+  main(sys.argv[1:])
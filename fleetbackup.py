@@ -0,0 +1,284 @@
+#!/usr/bin/python
+
+import sys
+import getopt
+import os
+import os.path
+import errno
+import logging
+import threading
+import time
+import json
+import incrbackup
+import storelock
+
+"""
+-----------------------------------------------------------------------------
+Backs up a fleet of servers from a single process.  The servers are listed in
+a json manifest and each one is backed up with the incremental backup system
+in incrbackup.py.  Backups run in parallel up to a global limit, with further
+limits on how many backups can run against the same host and how many can
+write to the same store filesystem at once.
+
+Each backup locks its own store so independent stores never block each other.
+A server whose store is locked by another backup or can't be reached is
+skipped and reported.
+
+Use the -h or the --help flag to get a listing of options.
+
+Program: Fleet Backups
+Author: agent
+Date: October 17, 2026
+Revision: 1.0
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+-----------------------------------------------------------------------------
+"""
+
+# manifest keys for each server and the default values when not given
+SERVER_DEFAULTS = {
+  "server": None,
+  "user": "backup",
+  "config": None,
+  "store": None,
+  "name": "backup",
+  "keep": 90,
+  "jobs": None,
+  "link_dest": False
+}
+
+class FleetJob:
+
+  def __init__(self, entry):
+    self.server = entry["server"]
+    self.user = entry["user"]
+    self.config = entry["config"]
+    self.store = entry["store"]
+    self.name = entry["name"]
+    self.keep = int(entry["keep"])
+    self.jobs = entry["jobs"]
+    self.link_dest = bool(entry["link_dest"])
+    self.host_key = self.server or "localhost"
+    self.status = "pending"
+    self.elapsed = 0.0
+
+    # an unreachable store fails its own backup, not the whole fleet
+    try:
+      self.store_key = os.stat(self.store).st_dev
+    except OSError as e:
+      logging.error("Skipping %s, store unreachable: %s." % (self.label(), e))
+      self.store_key = None
+      self.status = "unreachable"
+
+  def label(self):
+    return "%s:%s" % (self.host_key, self.store)
+
+class FleetBackup:
+
+  def __init__(self, manifest_file=None, jobs=None, per_host=None,
+    per_store=None):
+    self.manifest_file = manifest_file
+    self.jobs = jobs
+    self.per_host = per_host
+    self.per_store = per_store
+    self.condition = threading.Condition()
+    self.pending = []
+    self.running_hosts = {}
+    self.running_stores = {}
+
+  def load_manifest(self):
+
+    mf = open(self.manifest_file, "r")
+    manifest = json.load(mf)
+    mf.close()
+
+    # command line limits override the manifest limits
+    if self.jobs == None:
+      self.jobs = int(manifest.get("jobs", 4))
+    if self.per_host == None:
+      self.per_host = int(manifest.get("per_host", 1))
+    if self.per_store == None:
+      self.per_store = int(manifest.get("per_store", 2))
+
+    # a limit below one would leave every job waiting forever
+    for limit in ("jobs", "per_host", "per_store"):
+      if getattr(self, limit) < 1:
+        raise ValueError("The %s limit must be at least 1" % limit)
+
+    # each server entry is merged over the manifest defaults
+    defaults = dict(SERVER_DEFAULTS)
+    defaults.update(manifest.get("defaults", {}))
+    fleet_jobs = []
+    for server in manifest["servers"]:
+      entry = dict(defaults)
+      entry.update(server)
+      if entry["config"] == None or entry["store"] == None:
+        raise ValueError("Server %s needs a config and store" %
+          entry["server"])
+      fleet_jobs.append(FleetJob(entry))
+    return fleet_jobs
+
+  def next_job(self):
+
+    # first pending job whose host and store are under their limits, called
+    # with the condition held
+    for job in self.pending:
+      if (self.running_hosts.get(job.host_key, 0) < self.per_host and
+        self.running_stores.get(job.store_key, 0) < self.per_store):
+        self.pending.remove(job)
+        self.running_hosts[job.host_key] = \
+          self.running_hosts.get(job.host_key, 0) + 1
+        self.running_stores[job.store_key] = \
+          self.running_stores.get(job.store_key, 0) + 1
+        return job
+    return None
+
+  def finish_job(self, job):
+    with self.condition:
+      self.running_hosts[job.host_key] -= 1
+      self.running_stores[job.store_key] -= 1
+      self.condition.notify_all()
+
+  def run_job(self, job):
+
+    # lock the store for the backup, a busy store is skipped not waited on
+    start = time.time()
+    lock = storelock.StoreLock(job.store)
+    try:
+      lock.acquire()
+    except storelock.StoreLockBusy as e:
+      logging.warning("Skipping %s, %s." % (job.label(), e))
+      job.status = "busy"
+      return
+
+    try:
+      logging.info("Starting backup of %s." % job.label())
+      ibackup = incrbackup.IncrementalBackup(job.name, job.server, job.keep,
+        job.store, job.config, job.user, job.jobs, job.link_dest)
+      results = ibackup.backup()
+      failed = [r for r in results
+        if r[1] and r[1] not in incrbackup.RSYNC_PARTIAL_CODES]
+      job.status = "failed" if failed else "ok"
+    except Exception:
+      logging.exception("Backup of %s failed." % job.label())
+      job.status = "failed"
+    finally:
+      lock.release()
+      job.elapsed = time.time() - start
+
+  def worker(self):
+    while True:
+      with self.condition:
+        job = self.next_job()
+        while job == None:
+          if not self.pending:
+            return
+          self.condition.wait()
+          job = self.next_job()
+      try:
+        self.run_job(job)
+      finally:
+        self.finish_job(job)
+
+  def backup(self):
+
+    fleet_jobs = self.load_manifest()
+    self.pending = [job for job in fleet_jobs if job.status == "pending"]
+
+    # the global limit is the number of worker threads, the host and store
+    # limits are enforced when a worker picks its next job
+    workers = []
+    for i in range(min(self.jobs, len(self.pending))):
+      t = threading.Thread(target=self.worker)
+      t.start()
+      workers.append(t)
+    for t in workers:
+      t.join()
+
+    self.print_summary(fleet_jobs)
+    return fleet_jobs
+
+  def print_summary(self, fleet_jobs):
+    lines = ["Fleet summary:"]
+    for job in fleet_jobs:
+      lines.append("  %s %s (%.1fs)" % (job.status, job.label(), job.elapsed))
+    failed = len([job for job in fleet_jobs if job.status != "ok"])
+    lines.append("%d of %d servers not backed up." % (failed, len(fleet_jobs)))
+    print("\n".join(lines))
+
+"""
+Prints out the usage for the command line.
+"""
+def usage():
+  usage = ["fleetbackup.py [-hmjwd]\n"]
+  usage.append("  [-h | --help] prints this help and usage message\n")
+  usage.append("  [-m | --manifest] json manifest of servers to backup\n")
+  usage.append("  [-j | --jobs] number of backups to run at once\n")
+  usage.append("  [-w | --per-host] number of backups to run at once per host\n")
+  usage.append("  [-d | --per-store] number of backups to run at once per store filesystem\n")
+  message = "".join(usage)
+  print(message)
+
+"""
+Main method that starts up the backup.
+"""
+def main(argv):
+
+  # set the default values
+  manifest_file = None
+  jobs = None
+  per_host = None
+  per_store = None
+
+  try:
+
+    # process the command line options
+    opts, args = getopt.getopt(argv, "hm:j:w:d:", ["help", "manifest=",
+      "jobs=", "per-host=", "per-store="])
+
+    # if no arguments print usage
+    if len(argv) == 0:
+      usage()
+      sys.exit()
+
+    # loop through all of the command line options and set the appropriate
+    # values, overriding defaults
+    for opt, arg in opts:
+      if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+      elif opt in ("-m", "--manifest"):
+        manifest_file = arg
+      elif opt in ("-j", "--jobs"):
+        jobs = int(arg)
+      elif opt in ("-w", "--per-host"):
+        per_host = int(arg)
+      elif opt in ("-d", "--per-store"):
+        per_store = int(arg)
+
+  except getopt.GetoptError as msg:
+    # if an error happens print the usage and exit with an error
+    logging.warning(msg)
+    usage()
+    sys.exit(errno.EIO)
+
+  # check options are set correctly
+  if manifest_file == None:
+    usage()
+    sys.exit(errno.EPERM)
+
+  # each server backup locks its own store, no global lock is needed
+  try:
+    fleet = FleetBackup(manifest_file, jobs, per_host, per_store)
+    fleet_jobs = fleet.backup()
+    if [job for job in fleet_jobs if job.status != "ok"]:
+      sys.exit(1)
+  except(Exception):
+    logging.exception("Fleet backup failed.")
+    sys.exit(1)
+
+# if we are running the script from the command line, run the main function
+if __name__ == "__main__":
+  main(sys.argv[1:])
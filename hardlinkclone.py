@@ -0,0 +1,243 @@
+#!/usr/bin/python
+
+import sys
+import getopt
+import os
+import os.path
+import stat
+import errno
+import signal
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+-----------------------------------------------------------------------------
+Clones a directory tree using hard links, the same as cp -al, using a pool of
+threads.  Directories are walked with os.scandir and each directory is a task
+for the pool so independent subtrees are linked in parallel.  Files, symlinks
+and special files are hard linked, directories are recreated with the same
+permissions, ownership and timestamps once all of their entries are linked.
+
+A clone can be stopped at any time and resumed by running it again.  Entries
+already linked to the same inode are skipped and directories that already
+exist are walked again, only missing entries are linked.
+
+Use the -h or the --help flag to get a listing of options.
+
+Program: Hardlink Clone
+Author: agent
+Date: October 17, 2026
+Revision: 1.0
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+-----------------------------------------------------------------------------
+"""
+class HardlinkCloner:
+
+  def __init__(self, source=None, dest=None, jobs=8, progress_interval=30):
+    self.source = os.path.abspath(source)
+    self.dest = os.path.abspath(dest)
+    self.jobs = jobs
+    self.progress_interval = progress_interval
+    self.stop_event = threading.Event()
+    self.condition = threading.Condition()
+    self.unfinished = 0
+    self.errors = []
+    self.dirs = []
+    self.linked = 0
+    self.skipped = 0
+
+  def stop(self):
+    self.stop_event.set()
+
+  def stopped(self):
+    return self.stop_event.is_set()
+
+  def progress(self):
+    with self.condition:
+      return {"dirs": len(self.dirs), "linked": self.linked,
+        "skipped": self.skipped, "errors": len(self.errors)}
+
+  def submit(self, pool, src_dir, dst_dir):
+    with self.condition:
+      self.unfinished += 1
+    pool.submit(self.clone_dir, pool, src_dir, dst_dir)
+
+  def link_entry(self, entry, dst_path):
+
+    # an entry already linked to the same inode is left alone, this is what
+    # makes a stopped clone resumable
+    try:
+      os.link(entry.path, dst_path, follow_symlinks=False)
+      return True
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+    src_st = entry.stat(follow_symlinks=False)
+    dst_st = os.lstat(dst_path)
+    if (src_st.st_dev, src_st.st_ino) == (dst_st.st_dev, dst_st.st_ino):
+      return False
+    os.unlink(dst_path)
+    os.link(entry.path, dst_path, follow_symlinks=False)
+    return True
+
+  def clone_dir(self, pool, src_dir, dst_dir):
+    linked = 0
+    skipped = 0
+    try:
+      if self.stopped():
+        return
+
+      # directories are created writable by us, the real permissions are
+      # applied after all of the entries are linked
+      try:
+        os.mkdir(dst_dir, 0o700)
+      except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(dst_dir):
+          raise
+        os.chmod(dst_dir, stat.S_IMODE(os.lstat(dst_dir).st_mode) | 0o700)
+
+      for entry in os.scandir(src_dir):
+        if self.stopped():
+          return
+        dst_path = os.path.join(dst_dir, entry.name)
+        if entry.is_dir(follow_symlinks=False):
+          self.submit(pool, entry.path, dst_path)
+        elif self.link_entry(entry, dst_path):
+          linked += 1
+        else:
+          skipped += 1
+
+      with self.condition:
+        self.dirs.append((src_dir, dst_dir))
+
+    except Exception as e:
+      logging.exception("Clone of %s failed." % src_dir)
+      with self.condition:
+        self.errors.append((src_dir, e))
+      self.stop()
+    finally:
+      with self.condition:
+        self.linked += linked
+        self.skipped += skipped
+        self.unfinished -= 1
+        self.condition.notify_all()
+
+  def copy_dir_stat(self, src_dir, dst_dir):
+    st = os.lstat(src_dir)
+    try:
+      os.lchown(dst_dir, st.st_uid, st.st_gid)
+    except OSError as e:
+      if e.errno != errno.EPERM:
+        raise
+    os.chmod(dst_dir, stat.S_IMODE(st.st_mode))
+    os.utime(dst_dir, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+  def clone(self):
+
+    # the pool walks the tree, the calling thread waits for the walk to drain
+    # and logs progress while it does
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+      self.submit(pool, self.source, self.dest)
+      with self.condition:
+        while self.unfinished > 0:
+          self.condition.wait(self.progress_interval)
+          if self.unfinished > 0:
+            logging.info("Cloning %s, %d dirs, %d linked, %d skipped." %
+              (self.source, len(self.dirs), self.linked, self.skipped))
+
+    if self.errors:
+      raise self.errors[0][1]
+    if self.stopped():
+      logging.warning("Clone of %s stopped, run again to resume." %
+        self.source)
+      return False
+
+    # directory metadata last, deepest first, so linking entries into a
+    # directory doesn't change its timestamps after they are set
+    self.dirs.sort(key=lambda d: d[1].count(os.sep), reverse=True)
+    for src_dir, dst_dir in self.dirs:
+      self.copy_dir_stat(src_dir, dst_dir)
+
+    logging.info("Cloned %s to %s, %d dirs, %d linked, %d skipped in %.1fs." %
+      (self.source, self.dest, len(self.dirs), self.linked, self.skipped,
+      time.time() - start))
+    return True
+
+"""
+Prints out the usage for the command line.
+"""
+def usage():
+  usage = ["hardlinkclone.py [-hsdj]\n"]
+  usage.append("  [-h | --help] prints this help and usage message\n")
+  usage.append("  [-s | --source] the directory tree to clone\n")
+  usage.append("  [-d | --dest] the directory to clone to, run again to resume\n")
+  usage.append("  [-j | --jobs] number of directories to link at once\n")
+  message = "".join(usage)
+  print(message)
+
+"""
+Main method that starts up the clone.
+"""
+def main(argv):
+
+  # set the default values
+  source = None
+  dest = None
+  jobs = 8
+
+  try:
+
+    # process the command line options
+    opts, args = getopt.getopt(argv, "hs:d:j:", ["help", "source=", "dest=",
+      "jobs="])
+
+    # if no arguments print usage
+    if len(argv) == 0:
+      usage()
+      sys.exit()
+
+    # loop through all of the command line options and set the appropriate
+    # values, overriding defaults
+    for opt, arg in opts:
+      if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+      elif opt in ("-s", "--source"):
+        source = arg
+      elif opt in ("-d", "--dest"):
+        dest = arg
+      elif opt in ("-j", "--jobs"):
+        jobs = int(arg)
+
+  except getopt.GetoptError as msg:
+    # if an error happens print the usage and exit with an error
+    logging.warning(msg)
+    usage()
+    sys.exit(errno.EIO)
+
+  # check options are set correctly
+  if source == None or dest == None:
+    usage()
+    sys.exit(errno.EPERM)
+
+  # interrupting the clone stops it cleanly so it can be resumed
+  cloner = HardlinkCloner(source, dest, jobs)
+  signal.signal(signal.SIGINT, lambda signum, frame: cloner.stop())
+  signal.signal(signal.SIGTERM, lambda signum, frame: cloner.stop())
+  try:
+    if not cloner.clone():
+      sys.exit(errno.EINTR)
+  except(Exception):
+    logging.exception("Hardlink clone failed.")
+    sys.exit(1)
+
+# if we are running the script from the command line, run the main function
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -13,9 +13,19 @@ import tempfile
 import datetime
 import subprocess
 import json
+import threading
+import time
 import rotatebackups
+import storelock
+import catalog
+import snapmanifest
+import spaceusage
+import rsyncbatch
+import bwscheduler
+import runmetrics
 
 from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 
 """
 -----------------------------------------------------------------------------
@@ -24,11 +34,29 @@ backups of one or more systems while using minimal space.  If backing up remote
 servers this script assumes that the proper ssh keys have been setup from the
 backup server hosting this script to the servers being backed up.
 
-A pid file is placed into the system temp directory to prevent concurrent 
-backups from running at once.  The script provides options for the number of 
+A lock file is placed into the backup store to prevent concurrent backups into
+the same store from running at once.  The script provides options for the number of 
 backups to keep.  After the max number of backups is reached, backups are 
 deleted starting with the oldest backup first.
 
+Each snapshot is recorded in the store catalog with its size, file count,
+duration and exit status taken from the rsync stats, see catalog.py.  A file
+manifest of each snapshot is built from the itemized rsync output, see
+snapmanifest.py, and the space accounting of the namespace is updated from it,
+see spaceusage.py.
+
+In batch mode all backup paths are sent by a single rsync from a files-from
+list instead of one rsync per path, see rsyncbatch.py.  Paths with more files
+than the shard threshold in the previous snapshot are split into shards of
+their top level directories that are sent by concurrent rsyncs.
+
+Bandwidth budgets and time of day windows from the config file are applied to
+the rsyncs by a scheduler, see bwscheduler.py.
+
+The rotation, every rsync and the manifest are timed and the rsync stats of
+each path kept, a JSON report and a Prometheus textfile of the run are written
+to the metrics_dir of the config file, see runmetrics.py.
+
 Backup paths can be either local or remote.  The backup root directory where
 the backups are stored must be local and must already exist.  If a users isn't
 specified then the remote user used by ssh for rsync is considered to be backup.
@@ -38,24 +66,50 @@ Use the -h or the --help flag to get a listing of options.
 Program: Incremental Backups
 Author: Dennis E. Kubes
 Date: August 01, 2011
-Revision: 1.2
+Revision: 1.10
 
 Revision      | Author            | Comment
 -----------------------------------------------------------------------------
 20111122-1.0  Dennis E. Kubes     Initial creation of script.
 20131430-1.2  Dennis E. Kubes     Added excludes logic, config json file.
+20261017-1.3  Dennis E. Kubes     Run per path rsyncs concurrently, jobs option.
+20261017-1.4  Dennis E. Kubes     Record snapshots in the store catalog.
+20261017-1.5  Dennis E. Kubes     Snapshot manifests from itemized rsync output.
+20261017-1.6  Dennis E. Kubes     Update space accounting after each backup.
+20261017-1.7  Dennis E. Kubes     Batch mode, all paths in one rsync.
+20261017-1.8  Dennis E. Kubes     Shard huge paths across concurrent rsyncs.
+20261017-1.9  Dennis E. Kubes     Bandwidth budgets and transfer windows.
+20261017-1.10 Dennis E. Kubes     Run metrics and phase timings.
 -----------------------------------------------------------------------------
 """
+
+# rsync exit codes for transfers that completed with some files skipped
+RSYNC_PARTIAL_CODES = (23, 24)
+
+# paths with more entries than this in the previous snapshot are sharded
+SHARD_FILES = 1000000
+
 class IncrementalBackup:
 
   def __init__(self, name="backup", server=None, keep=90, store=None, 
-    config_file=None, user="root"):
+    config_file=None, user="root", jobs=None, link_dest=False, batch=None):
     self.name = name
     self.server = server
     self.keep = keep
     self.config_file = config_file
     self.store = store
     self.user = user
+    self.jobs = jobs
+    self.link_dest = link_dest
+    self.batch = batch
+    self.batch_results = None
+    self.shard_lists = []
+    self.scheduler = bwscheduler.TransferScheduler()
+    self.output_lock = threading.Lock()
+    self.stats = {"files": 0, "size": 0}
+    self.manifest = None
+    self.metrics = runmetrics.RunMetrics("incrbackup", name, server,
+      ok_codes=(0,) + RSYNC_PARTIAL_CODES)
     
   def run_command(self, command=None, shell=False, ignore_errors=False, 
     ignore_codes=None):
@@ -65,9 +119,30 @@ class IncrementalBackup:
         
   def backup(self):
 
-    # rotate the backups
-    rotater = rotatebackups.RotateBackups(self.keep, self.store)
-    rotated_names = rotater.rotate_backups()
+    # load the config file with the paths to backup and the backup options
+    config = {}
+    if self.config_file:
+      pf = open(self.config_file, "r")
+      config = json.load(pf)
+      pf.close()
+
+    # every phase of the run is timed into the run report, partial transfers
+    # count as a successful run
+    self.metrics.metrics_dir = config.get("metrics_dir")
+    with self.metrics.run():
+      return self.run_backup(config)
+
+  def run_backup(self, config):
+
+    # rotate the backups, hardlink copying in process if clone jobs are set
+    # and leaving expired backups to the reaper if delete is deferred
+    rotater = rotatebackups.RotateBackups(self.keep, self.store, self.name,
+      link_dest=self.link_dest, clone_jobs=config.get("clone_jobs"),
+      defer_delete=config.get("defer_delete", False),
+      layout=config.get("layout"), view=config.get("view", False),
+      metrics=self.metrics)
+    with self.metrics.phase("rotate"):
+      rotated_names = rotater.rotate_backups()
 
     rsync_to = None
     if not rotated_names:
@@ -81,16 +156,20 @@ class IncrementalBackup:
       rsync_to = rotated_names[0]
     
     # create the base rsync command with excludes
-    rsync_base = ["rsync", "-avR", "--ignore-errors", "--delete", "--delete-excluded"]
+    rsync_base = ["rsync", "-avR", "--stats", "--ignore-errors", "--delete", 
+      "--delete-excluded"]
+
+    # in link dest mode the new 0 is empty, link unchanged files against 1
+    if self.link_dest and len(rotated_names) > 1:
+      rsync_base.append("--link-dest=" + rotated_names[1])
+
+    # the manifest is built from the entries rsync itemizes as changed
+    if config.get("manifest", True):
+      rsync_base.append(snapmanifest.OUT_FORMAT)
     
-    # get the paths to backup either from the command line or from a paths file
+    # get the paths to backup from the config file
     bpaths = []
-    expaths = []
-    if self.config_file:
-
-      pf = open(self.config_file, "r")
-      config = json.load(pf)
-      pf.close()
+    if "backup" in config:
 
       # add the paths to backup
       bpaths.extend(config["backup"])
@@ -101,10 +180,20 @@ class IncrementalBackup:
           rsync_base.extend(["--exclude", exclude])
     
       if "port" in config:
-	for thePort in config["port"]:
+        for thePort in config["port"]:
           rsync_base.extend(["-e", thePort])
 
-    # one rsync command per path, ignore files vanished errors
+    # number of concurrent rsyncs, command line overrides the config file
+    jobs = self.jobs
+    if jobs == None:
+      jobs = int(config.get("jobs", 1))
+    jobs = max(1, jobs)
+
+    # the bandwidth budget is shared by the rsyncs that run at once
+    self.scheduler = bwscheduler.TransferScheduler(config, jobs)
+
+    # one rsync command per path, all writing into the same snapshot
+    rsync_cmds = []
     for bpath in bpaths:
       bpath = bpath.strip()
       rsync_cmd = rsync_base[:]      
@@ -112,14 +201,239 @@ class IncrementalBackup:
         bpath = self.user + "@" + self.server + ":" + bpath
       rsync_cmd.append(bpath)
       rsync_cmd.append(rsync_to)
-      logging.debug(rsync_cmd)
-      self.run_command(command=rsync_cmd, ignore_errors=True)
+      rsync_cmds.append((bpath, rsync_cmd))
+
+    # a link dest snapshot only holds the configured paths, a cloned one
+    # keeps whatever the previous snapshot held
+    if config.get("manifest", True):
+      prefixes = None
+      if self.link_dest:
+        prefixes = [bpath.strip().strip("/") for bpath in bpaths]
+      self.manifest = snapmanifest.ManifestBuilder(self.store, rsync_to,
+        rotated_names[1] if len(rotated_names) > 1 else None,
+        config.get("manifest_hashes", False), prefixes)
+
+    # batch mode sends every path through one rsync, command line overrides
+    # the config file
+    batch = self.batch
+    if batch == None:
+      batch = config.get("batch", False)
+
+    start = time.time()
+    source_root = "/"
+    if self.server:
+      source_root = self.user + "@" + self.server + ":/"
+    if batch and bpaths:
+      results = self.run_batch(rsync_base, bpaths, source_root, rsync_to)
+    else:
+
+      # huge paths are split into shards run by the same pool of workers
+      shards = int(config.get("shards", jobs))
+      order = [bpath for bpath, rsync_cmd in rsync_cmds]
+      sharded = {}
+      if len(rotated_names) > 1 and shards > 1:
+        rsync_cmds, sharded = self.shard_paths(config, rsync_base, rsync_cmds,
+          rotated_names[1], shards, source_root, rsync_to)
+      results = self.merge_shards(self.run_rsyncs(rsync_cmds, jobs), sharded,
+        order)
+    self.print_summary(results)
+    self.record(rsync_to, results, time.time() - start)
+    if self.manifest:
+      with self.metrics.phase("manifest"):
+        self.write_manifest(rsync_to, rotated_names)
+    return results
+
+  def write_manifest(self, rsync_to, rotated_names):
+
+    # a failed manifest doesn't fail the backup, the next one walks the tree,
+    # space accounting is updated from the new manifest
+    try:
+      self.manifest.build()
+      snapmanifest.expire_manifests(self.store, self.name,
+        rotated_names or [rsync_to])
+    except Exception:
+      logging.exception("Manifest of %s failed." % rsync_to)
+      return
+    space = spaceusage.SpaceUsage(self.store, self.name)
+    try:
+      space.update()
+    except Exception:
+      logging.exception("Space accounting of %s failed." % rsync_to)
+    finally:
+      space.close()
+
+  def record(self, rsync_to, results, duration):
+
+    # the status is the first failure, or a partial transfer, or ok
+    codes = [result for bpath, result, elapsed in results if result]
+    failed = [code for code in codes if code not in RSYNC_PARTIAL_CODES]
+    status = (failed or codes or [0])[0]
+    self.metrics.status = status
+    kind, tstamp, name = catalog.parse_entry(os.path.relpath(rsync_to, 
+      self.store))
+    backup_catalog = catalog.Catalog(self.store)
+    try:
+      backup_catalog.record(kind, tstamp, self.name, rsync_to,
+        host=self.server or "localhost", size=self.stats["size"], 
+        files=self.stats["files"], duration=duration, status=status)
+    finally:
+      backup_catalog.close()
+
+  def run_batch(self, rsync_base, bpaths, source_root, rsync_to):
+
+    # one rsync for all paths, the per path results come from its output
+    files_from = rsyncbatch.write_files_from(bpaths)
+    try:
+      self.batch_results = rsyncbatch.BatchResults(bpaths)
+      rsync_cmd = rsyncbatch.batch_command(rsync_base, files_from,
+        source_root, rsync_to)
+      bpath, result, elapsed = self.run_rsync("batch", rsync_cmd)
+      return self.batch_results.results(result, elapsed)
+    finally:
+      self.batch_results = None
+      os.remove(files_from)
+
+  def shard_paths(self, config, rsync_base, rsync_cmds, previous, shards,
+    source_root, rsync_to):
+
+    # the entry counts of the previous snapshot pick the paths to shard and
+    # balance their top level directories across the shards
+    key = snapmanifest.manifest_key(self.store, previous)
+    manifest_path = key and snapmanifest.manifest_path(self.store, key)
+    if not manifest_path or not os.path.exists(manifest_path):
+      return rsync_cmds, {}
+    threshold = int(config.get("shard_files", SHARD_FILES))
+    local_paths = [bpath.strip() for bpath in config.get("backup", [])]
+    counts = rsyncbatch.top_level_counts(manifest_path, local_paths)
+
+    planned = []
+    sharded = {}
+    for local_path, (bpath, rsync_cmd) in zip(local_paths, rsync_cmds):
+      total, dirs = counts[local_path]
+      if total < threshold or not dirs:
+        planned.append((bpath, rsync_cmd))
+        continue
+
+      # the top level first, it copies the files directly in the path,
+      # deletes removed directories and creates new ones which are added
+      # to the smallest shard
+      lines = []
+      label = "%s [top]" % bpath
+      result = self.run_rsync(label, rsyncbatch.top_level_command(rsync_base,
+        bpath, rsync_to), lines)
+      sharded[bpath] = [result]
+      if result[1] and result[1] not in RSYNC_PARTIAL_CODES:
+        continue
+      for name in rsyncbatch.new_directories(lines, local_path):
+        dirs.setdefault(name, 0)
+      groups = rsyncbatch.balance_shards(dirs, shards)
+      logging.info("Sharding %s, %d entries in %d directories, %d shards." % (
+        bpath, total, len(dirs), len(groups)))
+      for num, names in enumerate(groups):
+        files_from = rsyncbatch.write_files_from([local_path.rstrip("/") +
+          "/" + name for name in names])
+        self.shard_lists.append(files_from)
+        planned.append(("%s [shard %d/%d]" % (bpath, num + 1, len(groups)),
+          rsyncbatch.batch_command(rsync_base, files_from, source_root,
+          rsync_to)))
+    return planned, sharded
+
+  def merge_shards(self, results, sharded, order):
+
+    # one result per configured path, a sharded path takes the worst result
+    # of its shards and the time of its top level sync plus its slowest shard
+    for files_from in self.shard_lists:
+      os.remove(files_from)
+    self.shard_lists = []
+    if not sharded:
+      return results
+    merged = {}
+    for label, result, elapsed in results:
+      bpath = label.split(" [")[0]
+      if bpath in sharded:
+        sharded[bpath].append((label, result, elapsed))
+      else:
+        merged[bpath] = (label, result, elapsed)
+    for bpath, shard_results in sharded.items():
+      codes = [result for label, result, elapsed in shard_results if result]
+      failed = [code for code in codes if code not in RSYNC_PARTIAL_CODES]
+      merged[bpath] = (bpath, (failed or codes or [0])[0], shard_results[0][2] +
+        max([elapsed for label, result, elapsed in shard_results[1:]] or [0]))
+    return [merged[bpath] for bpath in order]
+
+  def run_rsync(self, bpath, rsync_cmd, lines=None, queued=False):
+
+    # stream the rsync output prefixed with the path it belongs to so output
+    # from concurrent rsyncs can be told apart, the scheduler sets the rsync
+    # bandwidth limit and restarts it when the limit changes, the stats of
+    # the attempt that finished are kept with its phase in the run metrics
+    # and added to the snapshot totals
+    start = time.time()
+    stats = {}
+    def on_line(line):
+      if self.manifest:
+        self.manifest.add_line(line)
+      if self.batch_results:
+        self.batch_results.add_line(line)
+      if lines != None:
+        lines.append(line)
+      with self.output_lock:
+        sys.stdout.write("[%s] %s" % (bpath, line))
+        sys.stdout.flush()
+        runmetrics.add_stat(stats, line)
+    def on_restart():
+      stats.clear()
+      if self.batch_results:
+        self.batch_results.restart()
+    result = self.scheduler.run(bpath, rsync_cmd, on_line, queued, on_restart)
+    elapsed = time.time() - start
+    with self.output_lock:
+      for key in self.stats:
+        self.stats[key] += stats.get(key, 0)
+    self.metrics.add_phase("rsync", bpath, elapsed, result, **stats)
+    return (bpath, result, elapsed)
+
+  def run_rsyncs(self, rsync_cmds, jobs):
+
+    # bounded pool of workers, results are kept in configured path order
+    self.scheduler.add(len(rsync_cmds))
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+      futures = [pool.submit(self.run_rsync, bpath, rsync_cmd, None, True) 
+        for bpath, rsync_cmd in rsync_cmds]
+    results = []
+    for (bpath, rsync_cmd), future in zip(rsync_cmds, futures):
+      try:
+        results.append(future.result())
+      except Exception:
+        logging.exception("Rsync of %s failed." % bpath)
+        results.append((bpath, -1, 0.0))
+    return results
+
+  def print_summary(self, results):
+
+    # vanished source files (24) and partial transfers (23) are expected on
+    # live systems, anything else is reported as a failure
+    failed = 0
+    lines = ["Backup summary:"]
+    for bpath, result, elapsed in results:
+      status = "ok"
+      if result in RSYNC_PARTIAL_CODES:
+        status = "partial"
+      elif result:
+        status = "failed"
+        failed += 1
+      lines.append("  %s %s (exit %d, %.1fs)" % (status, bpath, result, 
+        elapsed))
+    lines.append("%d of %d paths failed." % (failed, len(results)))
+    print("\n".join(lines))
+    if failed:
+      logging.warning("%d of %d backup paths failed." % (failed, len(results)))
 
 """
 Prints out the usage for the command line.
 """
 def usage():
-  usage = ["incrbackup.py [-hnksctu]\n"]
+  usage = ["incrbackup.py [-hnksctujlb]\n"]
   usage.append("  [-h | --help] prints this help and usage message\n")
   usage.append("  [-n | --name] backup namespace\n")
   usage.append("  [-k | --keep] number of backups to keep before deleting\n")
@@ -127,6 +441,9 @@ def usage():
   usage.append("  [-c | --config] configuration file with backup paths\n")
   usage.append("  [-t | --store] directory locally to store the backups\n")
   usage.append("  [-u | --user] the remote username used to ssh for backups\n")
+  usage.append("  [-j | --jobs] number of paths to rsync concurrently\n")
+  usage.append("  [-l | --link-dest] rsync into a new snapshot linked against the last\n")
+  usage.append("  [-b | --batch] send all backup paths in a single rsync\n")
   message = "".join(usage)
   print(message)
 
@@ -136,19 +453,22 @@ Main method that starts up the backup.
 def main(argv):
 
   # set the default values
-  pid_file = tempfile.gettempdir() + os.sep + "incrbackup.pid"
   name = "backup"
   keep = 90
   server = None
   config_file = None
   store = None
   user = "backup"
+  jobs = None
+  link_dest = False
+  batch = None
                    
   try:
     
     # process the command line options   
-    opts, args = getopt.getopt(argv, "hn:k:s:c:t:u:", ["help", "name=", 
-      "keep=", "server=", "config=", "store=", "user="])
+    opts, args = getopt.getopt(argv, "hn:k:s:c:t:u:j:lb", ["help", "name=", 
+      "keep=", "server=", "config=", "store=", "user=", "jobs=", "link-dest",
+      "batch"])
     
     # if no arguments print usage
     if len(argv) == 0:      
@@ -173,8 +493,14 @@ def main(argv):
         store = arg
       elif opt in ("-u", "--user"): 
         user = arg
+      elif opt in ("-j", "--jobs"): 
+        jobs = int(arg)
+      elif opt in ("-l", "--link-dest"): 
+        link_dest = True
+      elif opt in ("-b", "--batch"): 
+        batch = True
                                        
-  except(getopt.GetoptError, msg):
+  except getopt.GetoptError as msg:
     # if an error happens print the usage and exit with an error       
     usage()                          
     sys.exit(errno.EIO)
@@ -187,25 +513,25 @@ def main(argv):
   # process backup, catch any errors, and perform cleanup
   try:
   
-    # another backup can't already be running, if pid file doesn't exist, then
-    # create it
-    if os.path.exists(pid_file):
-      logging.warning("Backup running, %s pid exists, exiting." % pid_file)
+    # another backup can't already be running into the same store, backups
+    # into other stores are not blocked
+    lock = storelock.StoreLock(store)
+    try:
+      lock.acquire()
+    except storelock.StoreLockBusy as e:
+      logging.warning("Backup running, %s, exiting." % e)
       sys.exit(errno.EBUSY)
-    else:
-      pid = str(os.getpid())
-      f = open(pid_file, "w")
-      f.write("%s\n" % pid)
-      f.close()
       
     # create the backup object and call its backup method
-    ibackup = IncrementalBackup(name, server, keep, store, config_file, user)
-    ibackup.backup()
+    try:
+      ibackup = IncrementalBackup(name, server, keep, store, config_file, user,
+        jobs, link_dest, batch)
+      ibackup.backup()
+    finally:
+      lock.release()
 
   except(Exception):            
     logging.exception("Incremental backup failed.")      
-  finally:
-    os.remove(pid_file)
       
 # if we are running the script from the command line, run the main function
 if __name__ == "__main__":
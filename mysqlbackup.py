@@ -14,6 +14,16 @@ import datetime
 import subprocess
 import readline
 import json
+import time
+import threading
+import dumpcodecs
+import tabledump
+import binlogbackup
+import chunkstore
+import catalog
+import runmetrics
+
+from concurrent.futures import ThreadPoolExecutor
 
 from operator import itemgetter
 
@@ -21,23 +31,68 @@ from operator import itemgetter
 -----------------------------------------------------------------------------
 A script to backup mysql databases through the mysqldump utility.
 
+Databases are dumped by a pool of concurrent dumps, largest database first so
+the longest dump isn't started last.  The exit status of mysqldump and of the
+compression is checked for every database and a failed dump is reported and its
+partial output removed.
+
+Dumps are compressed in process as they stream out of mysqldump, by default
+with gzip.  The codec and level are chosen with the compression option and on
+restore the codec is detected from the file extension, see dumpcodecs.py.
+The pgzip codec compresses and decompresses gzip blocks on all cores.  The
+dedup codec stores the dumps in content defined chunks shared by all of the
+dumps in the store, see chunkstore.py.
+
+Every dump is recorded in the store catalog with its size, duration and exit
+status, see catalog.py.  Retention and the restore menu read the catalog
+instead of listing the store.
+
+With the tables option each database is dumped to a directory with one file per
+table, large tables split into primary key ranges, all dumped concurrently in
+one consistent snapshot, see tabledump.py.  Tables that haven't changed since
+the last table dump can be hardlinked from it instead of dumped again.
+
+Restores can be run without prompts by giving the timestamp of a backup, or
+latest, and optionally the databases or tables to restore.  The files of a
+backup are restored by a pool of concurrent mysql clients, table dumps a phase
+at a time, schemas, data, then views and triggers.  Progress is printed in
+bytes per second.
+
+With the binlogs option every dump records the binlog position it is
+consistent with so binlogbackup.py can copy the binlogs between dumps, and a
+restore can replay them up to a point in time.
+
+With a metrics directory every dump is recorded as a phase of the run with its
+duration, size and exit status, along with the retention, chunk collection
+and binlog phases, and a JSON report and a Prometheus textfile of the run are
+written there, see runmetrics.py.
+
 Use the -h or the --help flag to get a listing of options.
 
 Program: Mysql Database Backups
 Author: Dennis E. Kubes
 Date: April 28, 2013
-Revision: 1.0
+Revision: 1.9
 
 Revision      | Author            | Comment
 -----------------------------------------------------------------------------
 20130428-1.0    Dennis E. Kubes     Initial creation of script.
+20261017-1.1    Dennis E. Kubes     Parallel dumps, largest first, exit status.
+20261017-1.2    Dennis E. Kubes     In process compression codecs.
+20261017-1.3    Dennis E. Kubes     Per table chunked dumps.
+20261017-1.4    Dennis E. Kubes     Non interactive parallel restores.
+20261017-1.5    Dennis E. Kubes     Binlog positions, point in time restores.
+20261017-1.6    Dennis E. Kubes     Skip unchanged tables in table dumps.
+20261017-1.7    Dennis E. Kubes     Deduplicating chunk store codec.
+20261017-1.8    Dennis E. Kubes     Dumps recorded in the store catalog.
+20261017-1.9    Dennis E. Kubes     Run metrics and dump timings.
 -----------------------------------------------------------------------------
 """
 
 def rlinput(prompt, prefill=''):
      readline.set_startup_hook(lambda: readline.insert_text(prefill))
      try:
-        return raw_input(prompt)
+        return input(prompt)
      finally:
         readline.set_startup_hook()
 
@@ -45,10 +100,47 @@ def format_date(raw_date):
   return "%s-%s-%s %s:%s:%s" % (raw_date[0:4], raw_date[4:6], 
     raw_date[6:8], raw_date[8:10], raw_date[10:12], raw_date[12:14])
 
+class RestoreProgress:
+
+  def __init__(self, files=0, interval=10):
+    self.files = files
+    self.interval = interval
+    self.lock = threading.Lock()
+    self.start = time.time()
+    self.last_report = self.start
+    self.streams = {}
+    self.done = 0
+    self.restored = 0
+
+  def update(self, path, copied):
+
+    # called by every restore stream with the bytes it has copied so far
+    with self.lock:
+      self.restored += copied - self.streams.get(path, 0)
+      self.streams[path] = copied
+      now = time.time()
+      if now - self.last_report >= self.interval:
+        self.last_report = now
+        self.report()
+
+  def file_done(self, path):
+    with self.lock:
+      self.done += 1
+      self.streams.pop(path, None)
+
+  def report(self):
+    elapsed = max(time.time() - self.start, 0.001)
+    print("Restored %d of %d files, %.1f MB in %.1fs, %.1f MB/s" % (self.done,
+      self.files, self.restored / 1048576.0, elapsed, 
+      self.restored / 1048576.0 / elapsed))
+    sys.stdout.flush()
+
 class MysqlBackup:
 
   def __init__(self, keep=90, databases=None, store=None, user="root", 
-    password=None, host=None):
+    password=None, host=None, jobs=1, compression=None, tables=False,
+    chunk_rows=1000000, binlogs=False, skip_unchanged=False, checksum=False,
+    metrics_dir=None):
     self.host = host
     self.keep = keep
     self.databases = databases
@@ -56,6 +148,15 @@ class MysqlBackup:
     self.user = user
     self.password = password
     self.host = host
+    self.jobs = jobs
+    self.codec = chunkstore.get_codec(store, compression)
+    self.tables = tables
+    self.chunk_rows = chunk_rows
+    self.binlogs = binlogs
+    self.skip_unchanged = skip_unchanged
+    self.checksum = checksum
+    self.metrics = runmetrics.RunMetrics("mysqlbackup", "mysql", host,
+      metrics_dir)
     
   def run_command(self, command=None, shell=False, ignore_errors=False, 
     ignore_codes=None, get_output=False, path="."):
@@ -66,6 +167,31 @@ class MysqlBackup:
     if result and not ignore_errors and (not ignore_codes or result in set(ignore_codes)):
       raise BaseException(str(command) + " " + str(result))
 
+  def connect_args(self):
+    args = ["-u", self.user]
+    if self.host != None:
+      args.extend(["-h", self.host])
+    if self.password != None:
+      args.append("-p" + self.password)
+    return args
+
+  def query(self, sql):
+
+    # run a query through the mysql client, rows are lists of column values
+    query_cmd = ["mysql"] + self.connect_args() + ["--silent", "-N", "-e", sql]
+    output = subprocess.check_output(query_cmd, universal_newlines=True)
+    return [line.split("\t") for line in output.splitlines()]
+
+  def get_database_sizes(self):
+    sizes = {}
+    rows = self.query("SELECT table_schema, " + 
+      "SUM(data_length + index_length) FROM information_schema.tables " +
+      "GROUP BY table_schema")
+    for row in rows:
+      if len(row) == 2 and row[1] not in ("", "NULL"):
+        sizes[row[0]] = int(row[1])
+    return sizes
+
   def get_databases(self):
 
     if self.databases != None:
@@ -80,139 +206,385 @@ class MysqlBackup:
     databases = os.popen(list_cmd).readlines()
     return [s.strip() for s in databases]
     
+  def list_backups(self):
+
+    # complete backups grouped by timestamp, newest first, each a map of the
+    # database to its dump file or table dump directory
+    backups = {}
+    backup_catalog = catalog.Catalog(self.store)
+    try:
+      for entry in backup_catalog.entries("dump"):
+        if not entry["status"]:
+          backups.setdefault(entry["tstamp"], {})[entry["namespace"]] = \
+            backup_catalog.full_path(entry)
+    finally:
+      backup_catalog.close()
+    return sorted(backups.items(), reverse=True)
+
+  def record_dumps(self, tstamp, results):
+
+    # failed dumps are recorded with their status and as already removed
+    backup_catalog = catalog.Catalog(self.store)
+    try:
+      for res in results:
+        files = 1
+        if os.path.isdir(res["path"]):
+          files = len(os.listdir(res["path"]))
+        backup_catalog.record("dump", tstamp, res["database"], res["path"],
+          host=self.host or "localhost", size=res["size"], files=files,
+          duration=res["duration"], status=res["result"])
+        if res["result"]:
+          backup_catalog.remove(res["path"])
+    finally:
+      backup_catalog.close()
+
   def restore(self):    
-    dbbackup_path = self.store + os.sep 
-    backups = sorted(os.listdir(dbbackup_path), reverse=True)
+    backups = self.list_backups()
+    if not backups:
+      print("No backups to restore in %s." % self.store)
+      sys.exit()
 
     # show available options
-    k = 1
-    options = {}
-    prev_date = ""
-    databases = ""
-    filenames = ""
-
     print("Available backups to restore:")
-    for i in range(len(backups)):
-      data = backups[i].split(".")
-      date = data[0]
-
-      if not prev_date:
-        prev_date = date
-
-      if (date != prev_date):
-        print("["+str(k)+"]", "(%s) %s" % (format_date(prev_date), databases))
-
-        options[k] = {
-          "date": prev_date,
-          "databases": databases,
-          "filenames": filenames
-        }
-
-        k += 1
-        prev_date = date
-        databases = ""
-        filenames = ""
-
-      databases += ("" if databases == "" else ",") + data[1]
-      filenames += ("" if filenames == "" else ",") + backups[i]
-
-    print("["+str(k)+"]", "(%s) %s" % (format_date(prev_date), databases))
-    options[k] = {
-      "date": prev_date,
-      "databases": databases,
-      "filenames": filenames
-    }
+    for k, (tstamp, dumps) in enumerate(backups):
+      print("["+str(k + 1)+"]", "(%s) %s" % (format_date(tstamp), 
+        ",".join(sorted(dumps.keys()))))
 
     # get the selection
     user_input = -1
-    max_option = len(options.keys())
+    max_option = len(backups)
     while True:
-      user_input = int(raw_input("\nSelect backup: "))
+      user_input = int(input("\nSelect backup: "))
       if (user_input < 1) or (max_option < user_input):
         print("Error: The value should be between 1 and", max_option)
       else:
         break
     
     # get the databases to restore
-    date = format_date(options[user_input]["date"])
-    filenames = options[user_input]["filenames"]
-    selected_databases = rlinput("Databases to restore: ", options[user_input]["databases"])
-    databases = ",".join(filter(lambda db: db in selected_databases, self.get_databases()))
-    if databases == "":
+    tstamp, dumps = backups[user_input - 1]
+    date = format_date(tstamp)
+    selected_databases = rlinput("Databases to restore: ", 
+      ",".join(sorted(dumps.keys())))
+    databases = [db.strip() for db in selected_databases.split(",") 
+      if db.strip() in dumps]
+    if not databases:
       print("Error: The selected databases doesn't match any created databases.")
       sys.exit()
 
     # ask for confirmation
-    print("The databases \"%s\" are going to be restored using the version dated \"%s\"" % (databases, date))
+    print("The databases \"%s\" are going to be restored using the version dated \"%s\"" % (",".join(databases), date))
     confirmation = rlinput("Continue? [Y/n] ", "Y")
     if confirmation != "Y":
       print("Aborted.")
       sys.exit()
 
-    # expand the filenames of the databases
-    databases = databases.split(",")
-    filenames = filter(lambda fln: reduce(lambda x,y: x or y, 
-                        map(lambda dbn: dbn in fln, databases)), 
-                      filenames.split(","))
-
-    # restore the databases
-    for filename in filenames:
-      db = filename.split(".")[1]
-      restore_cmd = "gunzip < " + dbbackup_path + filename + \
-        " | mysql -u " + self.user
-      if self.host != None:
-        restore_cmd += " -h " + "'" + self.host + "'"
-      if self.password != None:
-        restore_cmd += " -p" + self.password
-      restore_cmd += " " + db
-
-      print("Restoring \"" + db + "\"...")
-      sys.stdout.flush()
-      logging.info("Restore db, %s from %s." % (db, dbbackup_path + filename))
-      self.run_command(restore_cmd)
-      print("done")
-
-    print("Restore complete!")
+    results = self.restore_backup(tstamp, databases)
+    if not [res for res in results if res["result"]]:
+      print("Restore complete!")
+    return results
+
+  def restore_plan(self, dumps, databases, tables):
+
+    # the files to restore in phases, every file of a phase is restored
+    # before the next phase starts, schemas, then data, then views and
+    # triggers, whole database dumps are restored with the data
+    db_tables = {}
+    for table in tables or []:
+      db, name = table.split(".", 1)
+      db_tables.setdefault(db, set()).add(name)
+    phases = [[], [], []]
+    for db in databases:
+      if db not in dumps:
+        raise ValueError("No dump of %s in the backup" % db)
+      dump_path = dumps[db]
+      if os.path.isdir(dump_path):
+        for idx, phase in enumerate(tabledump.restore_phases(dump_path, 
+          db_tables.get(db))):
+          phases[idx].extend([(db, path) for path in phase])
+      elif db in db_tables:
+        raise ValueError("Tables can't be restored from the single file " +
+          "dump %s" % dump_path)
+      else:
+        phases[1].append((db, dump_path))
+    return phases
+
+  def restore_backup(self, tstamp="latest", databases=None, tables=None,
+    until=None):
+
+    # find the backup, latest is the newest complete one, or for a point in
+    # time restore the newest one from before that time with binlog positions
+    backups = self.list_backups()
+    positions = {}
+    if until != None:
+      if tables:
+        raise ValueError("Tables can't be restored to a point in time")
+      positions = binlogbackup.load_positions(self.store)
+      until_tstamp = until.strftime("%Y%m%d%H%M%S")
+      backups = [(t, d) for t, d in backups if t in positions and 
+        t <= until_tstamp]
+    if tstamp == "latest" and backups:
+      tstamp, dumps = backups[0]
+    else:
+      dumps = dict(backups).get(tstamp)
+    if dumps == None:
+      raise ValueError("No backup %s in %s" % (tstamp, self.store))
+
+    # restore every database in the backup unless given databases or tables
+    if tables:
+      databases = sorted(set([table.split(".", 1)[0] for table in tables]))
+    elif databases == None:
+      databases = sorted(dumps.keys())
+
+    # the binlogs must reach the restore time before anything is restored
+    if until != None:
+      binlog_backup = binlogbackup.BinlogBackup(self.store, self.user, 
+        self.password, self.host)
+      for db in databases:
+        if db not in positions[tstamp]:
+          raise ValueError("No binlog position for %s in %s" % (db, tstamp))
+        binlog_backup.replay_segments(positions[tstamp][db], until)
+    phases = self.restore_plan(dumps, databases, tables)
+    for db in databases:
+      self.query("CREATE DATABASE IF NOT EXISTS `%s`" % db)
+
+    # each phase is restored by the pool, largest files first
+    restore_files = sum([len(phase) for phase in phases])
+    logging.info("Restore %s from %s, %d files." % (",".join(databases), 
+      tstamp, restore_files))
+    progress = RestoreProgress(restore_files)
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as pool:
+      for phase in phases:
+        phase.sort(key=lambda entry: os.path.getsize(entry[1]), reverse=True)
+        futures = [pool.submit(self.restore_entry, db, path, progress) 
+          for db, path in phase]
+        phase_results = [future.result() for future in futures]
+        results.extend(phase_results)
+        if [res for res in phase_results if res["result"]]:
+          logging.warning("Restore phase failed, stopping.")
+          break
+    progress.report()
+    self.print_restore_summary(results, restore_files)
+
+    # replay the binlogs of each database from its dump position
+    if until != None and not [res for res in results if res["result"]]:
+      for db in databases:
+        replayed = binlog_backup.replay(db, positions[tstamp][db], until)
+        print("Replayed %d binlogs into %s up to %s." % (replayed, db, 
+          until.strftime("%Y-%m-%d %H:%M:%S")))
+    return results
+
+  def restore_entry(self, db, restore_path, progress=None):
+    start = time.time()
+    result = 0
+    try:
+      self.restore_file(db, restore_path, progress)
+    except Exception:
+      logging.exception("Restore of %s from %s failed." % (db, restore_path))
+      result = 1
+    finally:
+      if progress:
+        progress.file_done(restore_path)
+    return {"database": db, "path": restore_path, "result": result,
+      "duration": time.time() - start, "size": os.path.getsize(restore_path)}
+
+  def restore_file(self, db, restore_path, progress=None):
+
+    # the dump is decompressed in process, by the codec of its extension, and
+    # streamed into the mysql client, its output is not captured
+    codec = chunkstore.codec_for_path(self.store, restore_path)
+    restore_cmd = ["mysql"] + self.connect_args() + [db]
+    restore = subprocess.Popen(restore_cmd, stdin=subprocess.PIPE)
+    update = None
+    if progress:
+      update = lambda copied: progress.update(restore_path, copied)
+    try:
+      with open(restore_path, "rb") as in_file:
+        dumpcodecs.decompress_stream(codec, in_file, restore.stdin, update)
+    finally:
+      codec.close()
+      restore.stdin.close()
+      result = restore.wait()
+    if result:
+      raise RuntimeError("Restore of %s from %s failed %d" % (db, 
+        restore_path, result))
+
+  def print_restore_summary(self, results, restore_files):
+    failed = len([res for res in results if res["result"]])
+    lines = ["Restore summary:"]
+    for res in results:
+      status = "failed" if res["result"] else "ok"
+      lines.append("  %s %s %s (%.1fs, %d bytes)" % (status, res["database"],
+        os.path.basename(res["path"]), res["duration"], res["size"]))
+    lines.append("%d of %d files failed, %d not restored." % (failed, 
+      restore_files, restore_files - len(results)))
+    print("\n".join(lines))
 
   def backup(self):
+
+    # the run report is written however the backup ends
+    with self.metrics.run():
+      results = self.run_backup()
+      self.metrics.status = ([res["result"] for res in results 
+        if res["result"]] or [0])[0]
+      return results
+
+  def run_backup(self):
     
     padding = len(str(self.keep))    
     backups = []
   
-    # remove files older than keep days
+    # remove files older than keep days, found through the catalog
     cutdate = datetime.datetime.now() - datetime.timedelta(days=self.keep)   
-    for backup_file in os.listdir(self.store):
-      bparts = backup_file.split(".")
-      if bparts[0].isdigit():
-        dumpdate = datetime.datetime.strptime(bparts[0], "%Y%m%d%H%M%S")
-        if dumpdate < cutdate:
-          os.remove(os.path.join(self.store, backup_file))
+    cut_tstamp = cutdate.strftime("%Y%m%d%H%M%S")
+    backup_catalog = catalog.Catalog(self.store)
+    try:
+      with self.metrics.phase("expire") as phase:
+        phase["removed"] = 0
+        for entry in backup_catalog.entries("dump"):
+          if entry["tstamp"] < cut_tstamp:
+            expired_path = backup_catalog.full_path(entry)
+            if os.path.isdir(expired_path):
+              shutil.rmtree(expired_path)
+            elif os.path.exists(expired_path):
+              os.remove(expired_path)
+            backup_catalog.remove(expired_path)
+            phase["removed"] += 1
+    finally:
+      backup_catalog.close()
         
     # get the current date and timestamp and the zero backup name
     tstamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")    
     dbs = self.get_databases()
     skip = ["information_schema", "performance_schema", "test"]
-    for db in dbs:
-      if db in skip:
-        continue
-
-      dbbackup_name = ".".join([tstamp, db, "sql"])
-      dbbackup_path = self.store + os.sep + dbbackup_name 
-
-      dump_cmd = "mysqldump -u " + self.user
-      if self.host != None:
-        dump_cmd += " -h " + "'" + self.host + "'"
-      if self.password != None:
-        dump_cmd += " -p" + self.password
-      dump_cmd += " -e --opt -c " + db + " | gzip > " + dbbackup_path + ".gz"
-      logging.info("Dump db, %s to %s." % (db, dbbackup_path))
-      os.popen(dump_cmd)
+    dbs = [db for db in dbs if db not in skip]
+
+    # largest databases first so the longest dumps start earliest
+    try:
+      sizes = self.get_database_sizes()
+    except (OSError, subprocess.CalledProcessError):
+      logging.warning("Unable to get database sizes, dumping in list order.")
+      sizes = {}
+    dbs.sort(key=lambda db: sizes.get(db, 0), reverse=True)
+
+    try:
+      if self.tables:
+        results = self.dump_tables(tstamp, dbs)
+      else:
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as pool:
+          futures = [pool.submit(self.dump_database, tstamp, db) 
+            for db in dbs]
+        results = [future.result() for future in futures]
+    finally:
+      self.codec.close()
+    self.print_summary(results)
+    self.record_dumps(tstamp, results)
+    for res in results:
+      self.metrics.add_phase("dump", res["database"], res["duration"],
+        res["result"], size=res["size"])
+
+    # chunks only used by expired dumps are collected once the new dumps
+    # reference the chunks they share
+    if isinstance(self.codec, chunkstore.ChunkCodec):
+      with self.metrics.phase("chunk_gc"):
+        self.codec.chunk_store.gc()
+
+    # the positions are kept with the binlogs, binlogs older than the oldest
+    # dump still in the store are expired
+    if self.binlogs:
+      start = time.time()
+      positions = dict([(res["database"], res["binlog"]) for res in results 
+        if not res["result"] and res.get("binlog")])
+      if positions:
+        binlogbackup.save_positions(self.store, tstamp, positions)
+      binlog_backup = binlogbackup.BinlogBackup(self.store, self.user, 
+        self.password, self.host)
+      binlog_backup.expire(set([t for t, dumps in self.list_backups()]))
+      self.metrics.add_phase("binlogs", None, time.time() - start)
+    return results
+
+  def dump_database(self, tstamp, db):
+
+    dbbackup_name = ".".join([tstamp, db, "sql"])
+    dbbackup_path = self.store + os.sep + dbbackup_name + self.codec.extension
+    logging.info("Dump db, %s to %s." % (db, dbbackup_path))
+
+    # mysqldump output is compressed in process as it streams out
+    start = time.time()
+    dump_cmd = ["mysqldump"] + self.connect_args() + ["-e", "--opt", "-c"]
+    if self.binlogs:
+      dump_cmd.extend(["--single-transaction", "--master-data=2"])
+    dump_cmd.append(db)
+    position = None
+    err_file = tempfile.TemporaryFile()
+    try:
+      with open(dbbackup_path, "wb") as out_file:
+        dump = subprocess.Popen(dump_cmd, stdout=subprocess.PIPE, 
+          stderr=err_file)
+        try:
+          reader = binlogbackup.DumpPositionReader(dump.stdout)
+          dumpcodecs.compress_stream(self.codec, reader, out_file)
+          position = reader.position
+        finally:
+          dump.stdout.close()
+          result = dump.wait()
+      err_file.seek(0)
+      err = err_file.read()
+      if err:
+        logging.warning("Dump db, %s: %s" % (db, err.decode("utf-8", 
+          "replace").strip()))
+    except Exception:
+
+      # a broken codec pool or worker fails this dump, not the whole run
+      logging.exception("Dump db, %s failed." % db)
+      result = -1
+    finally:
+      err_file.close()
+
+    # a failed dump is removed so it is never offered for restore
+    size = 0
+    if result:
+      if os.path.exists(dbbackup_path):
+        os.remove(dbbackup_path)
+    else:
+      size = os.path.getsize(dbbackup_path)
+    return {"database": db, "result": result, "duration": time.time() - start,
+      "size": size, "path": dbbackup_path, "binlog": position}
+
+  def dump_tables(self, tstamp, dbs):
+
+    # every table of every database shares one pool and one snapshot, so the
+    # dump takes as long as the largest chunk instead of the largest database
+    logging.info("Dump tables of %s." % ",".join(dbs))
+    dump = tabledump.TableDump(self.store, self.user, self.password, 
+      self.host, self.codec, self.jobs, self.chunk_rows, self.skip_unchanged,
+      self.checksum)
+    return dump.dump(tstamp, dbs)
+
+  def print_summary(self, results):
+    failed = 0
+    lines = ["Dump summary:"]
+    for res in results:
+      status = "ok"
+      if res["result"]:
+        status = "failed"
+        failed += 1
+      line = "  %s %s (exit %d, %.1fs, %d bytes" % (status, res["database"], 
+        res["result"], res["duration"], res["size"])
+      if res.get("linked"):
+        line += ", %d tables unchanged" % res["linked"]
+      lines.append(line + ")")
+    lines.append("%d of %d databases failed." % (failed, len(results)))
+    print("\n".join(lines))
+    if failed:
+      logging.warning("%d of %d database dumps failed." % (failed, 
+        len(results)))
 
 """
 Prints out the usage for the command line.
 """
 def usage():
-  usage = ["mysqlbackup.py [-hkdbups]\n"]
+  usage = ["mysqlbackup.py [-hkdbupsjzTcReBUSKM]\n"]
   usage.append("  [-h | --help] prints this help and usage message\n")
   usage.append("  [-k | --keep] number of days to keep backups before deleting\n")
   usage.append("  [-d | --databases] a comma separated list of databases\n")
@@ -221,7 +593,18 @@ def usage():
   usage.append("  [-p | --password] the database password\n")
   usage.append("  [-s | --host] the database server hostname\n")
   usage.append("  [-o | --options] the json file to load the options from instead of using command line\n")
-  usage.append("  [-r | --restore] enables restore mode\n")
+  usage.append("  [-r | --restore] enables interactive restore mode\n")
+  usage.append("  [-R | --restore-from] restore the backup with this timestamp, or latest\n")
+  usage.append("  [-e | --restore-tables] comma separated db.table list to restore\n")
+  usage.append("  [-B | --binlogs] record binlog positions for binlog incrementals\n")
+  usage.append("  [-U | --until] restore to this time, YYYY-MM-DD HH:MM:SS, replaying binlogs\n")
+  usage.append("  [-j | --jobs] number of databases or files to dump or restore at once\n")
+  usage.append("  [-z | --compression] dump codec and level, gzip:6, pgzip:6, bz2, xz:6, zstd:3, dedup:6 or none\n")
+  usage.append("  [-T | --tables] dump each table to its own files, needs pymysql\n")
+  usage.append("  [-c | --chunk-rows] rows per chunk when splitting large tables\n")
+  usage.append("  [-S | --skip-unchanged] hardlink tables unchanged since the last table dump\n")
+  usage.append("  [-K | --checksum] checksum tables not known unchanged by update time\n")
+  usage.append("  [-M | --metrics-dir] write the run report and prometheus textfile here\n")
   message = "".join(usage)
   print(message)
 
@@ -240,13 +623,26 @@ def main(argv):
   store = None
   options = None
   restore = False
+  jobs = 1
+  compression = None
+  tables = False
+  chunk_rows = 1000000
+  restore_from = None
+  restore_tables = None
+  binlogs = False
+  until = None
+  skip_unchanged = False
+  checksum = False
+  metrics_dir = None
 
   try:
     
     # process the command line options
-    st = "hn:k:d:t:u:p:s:o:r"
+    st = "hn:k:d:t:u:p:s:o:rj:z:Tc:R:e:BU:SKM:"
     lt = ["help", "keep=", "databases=", "store=", "user=", "password=", 
-        "host=", "options=", "restore"]
+        "host=", "options=", "restore", "jobs=", "compression=", "tables",
+        "chunk-rows=", "restore-from=", "restore-tables=", "binlogs", 
+        "until=", "skip-unchanged", "checksum", "metrics-dir="]
     opts, args = getopt.getopt(argv, st, lt)
     
     # if no arguments print usage
@@ -264,19 +660,27 @@ def main(argv):
       with open(vals[opt], 'r') as content_file:
         fopts = json.load(content_file)
     
-    # merge with opts
-    opts_keys = map(lambda val: val[0], opts)
+    # merge with opts, the file options go first so the command line wins
+    # even when it names the option in its other form, flags are only set by
+    # a true value in the file
+    takes_arg = {}
+    for idx, letter in enumerate(st):
+      if letter != ":":
+        takes_arg["-" + letter] = st[idx + 1:idx + 2] == ":"
+    for name in lt:
+      takes_arg["--" + name.rstrip("=")] = name.endswith("=")
+    opts_keys = [o for o, a in opts]
     if fopts:
+      file_opts = []
       for key in fopts.keys():
-        prefix = ""
-        if key in st.split(":"):
-          prefix = "-"
-        elif key in map(lambda t: t[:-1] if t[-1] == "=" else t, lt):
-          prefix = "--"
-        else:
+        opt = ("-" if len(key) == 1 else "--") + key
+        if opt not in takes_arg or opt in opts_keys:
           continue
-        if prefix+key not in opts_keys:
-          opts.append((prefix+key, fopts[key]))
+        if takes_arg[opt]:
+          file_opts.append((opt, fopts[key]))
+        elif fopts[key]:
+          file_opts.append((opt, ""))
+      opts = file_opts + opts
             
     # loop through all of the command line options and set the appropriate
     # values, overriding defaults
@@ -298,8 +702,30 @@ def main(argv):
         host = arg
       elif opt in ("-r", "--restore"):
         restore = True
+      elif opt in ("-j", "--jobs"):
+        jobs = int(arg)
+      elif opt in ("-z", "--compression"):
+        compression = arg
+      elif opt in ("-T", "--tables"):
+        tables = True
+      elif opt in ("-c", "--chunk-rows"):
+        chunk_rows = int(arg)
+      elif opt in ("-R", "--restore-from"):
+        restore_from = arg
+      elif opt in ("-e", "--restore-tables"):
+        restore_tables = [s.strip() for s in arg.split(",")]
+      elif opt in ("-B", "--binlogs"):
+        binlogs = True
+      elif opt in ("-U", "--until"):
+        until = datetime.datetime.strptime(arg, "%Y-%m-%d %H:%M:%S")
+      elif opt in ("-S", "--skip-unchanged"):
+        skip_unchanged = True
+      elif opt in ("-K", "--checksum"):
+        checksum = True
+      elif opt in ("-M", "--metrics-dir"):
+        metrics_dir = arg
            
-  except(getopt.GetoptError, msg):    
+  except getopt.GetoptError as msg:
     logging.warning(msg)
     # if an error happens print the usage and exit with an error       
     usage()                          
@@ -326,14 +752,29 @@ def main(argv):
       f.close()
       
     # create the backup object and call its backup method    
-    mysql_backup = MysqlBackup(keep, databases, store, user, password, host)
-    if restore:
+    mysql_backup = MysqlBackup(keep, databases, store, user, password, host,
+      jobs, compression, tables, chunk_rows, binlogs, skip_unchanged, checksum,
+      metrics_dir)
+    if until != None and not restore_from:
+        restore_from = "latest"
+    if restore_from:
+        dbs = None
+        if databases != None:
+          dbs = mysql_backup.get_databases()
+        results = mysql_backup.restore_backup(restore_from, dbs, 
+          restore_tables, until)
+        if [res for res in results if res["result"]]:
+          sys.exit(1)
+    elif restore:
         mysql_backup.restore()
     else:
-        mysql_backup.backup()
+        results = mysql_backup.backup()
+        if [res for res in results if res["result"]]:
+          sys.exit(1)
 
   except(Exception):            
     logging.exception("Mysql backups failed.")      
+    sys.exit(1)
   finally:
     os.remove(pid_file)
       
@@ -13,7 +13,11 @@ import tempfile
 import datetime
 import subprocess
 import json
-import paramiko
+import time
+import sshmaster
+import rsyncbatch
+import bwscheduler
+import runmetrics
 
 from operator import itemgetter
 
@@ -26,6 +30,26 @@ that the rotatebackups.py script exists on the remote backup server and that
 the proper ssh keys have been setup from the pushing server to the backup
 server.
 
+The whole run uses one multiplexed ssh connection to the backup server, the
+remote rotation and every rsync go over it instead of connecting on their own,
+see sshmaster.py.
+
+Pushes go into a staging directory in the remote store linked against the
+newest snapshot, and the paths that finished are checkpointed in a file on the
+pushing machine.  An interrupted push is resumed by the next run, which only
+pushes the unfinished paths and picks up partly sent files from the rsync
+partial dir.  Once every path is pushed the staged snapshot is rotated in as
+the new snapshot in one journaled step, so a snapshot is never half written.
+
+In batch mode the unfinished paths are sent by a single rsync from a files-from
+list instead of one rsync per path, see rsyncbatch.py.  Bandwidth budgets and
+time of day windows from the config file are applied by the same scheduler as
+pulled backups, see bwscheduler.py.
+
+The connection, every rsync with its stats and the publish are timed, a JSON
+report and a Prometheus textfile of the run are written to the metrics_dir of
+the config file, see runmetrics.py.
+
 A pid file is placed into the system temp directory to prevent concurrent 
 backups from running at once.  The script provides options for the number of 
 backups to keep.  After the max number of backups is reached, backups are 
@@ -40,17 +64,30 @@ Use the -h or the --help flag to get a listing of options.
 Program: Push Backups
 Author: Dennis E. Kubes
 Date: May 01, 2013
-Revision: 1.0
+Revision: 1.5
 
 Revision      | Author            | Comment
 -----------------------------------------------------------------------------
 20131430-1.0  Dennis E. Kubes     Initial creation of script.
+20261017-1.1  Dennis E. Kubes     One multiplexed ssh connection per run.
+20261017-1.2  Dennis E. Kubes     Resumable staged pushes, atomic publish.
+20261017-1.3  Dennis E. Kubes     Batch mode, all paths in one rsync.
+20261017-1.4  Dennis E. Kubes     Bandwidth budgets and transfer windows.
+20261017-1.5  Dennis E. Kubes     Run metrics and phase timings.
 -----------------------------------------------------------------------------
 """
+
+# the staging directory of a namespace in the remote store
+STAGING_PREFIX = ".staging."
+
+# partly sent files are kept here inside the staged snapshot
+PARTIAL_DIR = ".rsync-partial"
+
 class PushBackup:
 
   def __init__(self, name="backup", server=None, keep=90, store=None, 
-    config_file=None, user="root", ssh_key=None, rotate_script=None):
+    config_file=None, user="root", ssh_key=None, rotate_script=None,
+    layout=None, checkpoint_file=None):
     self.name = name
     self.server = server
     self.keep = keep
@@ -59,6 +96,11 @@ class PushBackup:
     self.user = user
     self.ssh_key = ssh_key
     self.rotate_script = rotate_script
+    self.layout = layout
+    self.checkpoint_file = checkpoint_file or os.path.expanduser(
+      "~/.pushbackup." + name + ".json")
+    self.metrics = runmetrics.RunMetrics("pushbackup", name,
+      ok_codes=(0,) + rsyncbatch.RSYNC_PARTIAL_CODES)
     
   def run_command(self, command=None, shell=False, ignore_errors=False, 
     ignore_codes=None):
@@ -68,64 +110,197 @@ class PushBackup:
         
   def backup(self):
 
-    # create the ssh client to run the remote rotate script
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.load_system_host_keys()
-    client.connect(self.server, username=self.user, key_filename=self.ssh_key)
-
-    # rotate the backups remotely by running the rotatebackups.py script on the
-    # remote backup server
-    rotate_cmd = [self.rotate_script, "-k", str(self.keep), "-t", self.store]
-    stdin, stdout, stderr = client.exec_command(" ".join(rotate_cmd))
-    rotated_names = stdout.readlines()
-    client.close()
-
-    rsync_to = None
-    if not rotated_names:
-      # get the current date and timestamp and the zero backup name
-      now = datetime.datetime.now()
-      padding = len(str(self.keep))
-      tstamp = now.strftime("%Y%m%d%H%M%S")
-      zbackup_name = ".".join(["".zfill(padding), tstamp, self.name])
-      rsync_to = self.store + os.sep + zbackup_name
-    else:
-      rsync_to = rotated_names[0]
-    
-    # create the base rsync command with excludes
-    rsync_base = ["rsync", "-avR", "--ignore-errors", "--delete", "--delete-excluded"]
-    
-    # get the paths to backup either from the command line or from a paths file
-    bpaths = []
-    expaths = []
+    # load the config file with the paths to backup and the push options
+    config = {}
     if self.config_file:
-
       pf = open(self.config_file, "r")
       config = json.load(pf)
       pf.close()
 
-      # add the paths to backup
-      bpaths.extend(config["backup"])
+    # one connection to the backup server for the rotation and all rsyncs,
+    # shut down however the backup ends, the run report is written after it
+    self.metrics.metrics_dir = config.get("metrics_dir")
+    with self.metrics.run():
+      master = sshmaster.SSHMaster(self.server, self.user, self.ssh_key)
+      with self.metrics.phase("connect", self.server):
+        master.start()
+      try:
+        self.push(master, config)
+      finally:
+        master.stop()
+
+  def load_checkpoint(self):
+
+    # a checkpoint left by an interrupted push to the same store is resumed,
+    # anything else starts a new staged snapshot
+    if os.path.exists(self.checkpoint_file):
+      with open(self.checkpoint_file, "r") as cf:
+        checkpoint = json.load(cf)
+      if (checkpoint.get("server"), checkpoint.get("store")) == (self.server,
+        self.store):
+        return checkpoint
+    return {"server": self.server, "store": self.store, "name": self.name,
+      "staging": self.store + os.sep + STAGING_PREFIX + self.name,
+      "done": []}
+
+  def save_checkpoint(self, checkpoint):
+
+    # written and renamed after every finished path
+    tmp_file = self.checkpoint_file + ".tmp"
+    with open(tmp_file, "w") as cf:
+      json.dump(checkpoint, cf, indent=2, sort_keys=True)
+    os.rename(tmp_file, self.checkpoint_file)
 
-      # add and filter/exclude options
-      if "exclude" in config:
-        for exclude in config["exclude"]:
-          rsync_base.extend(["--exclude", exclude])
+  def rotate_command(self, *args):
+    rotate_cmd = [self.rotate_script, "-k", str(self.keep), "-t", self.store,
+      "-n", self.name]
+    if self.layout:
+      rotate_cmd.extend(["-L", self.layout])
+    rotate_cmd.extend(args)
+    return rotate_cmd
+
+  def push_batch(self, rsync_base, pending, staging, checkpoint, scheduler):
+
+    # all unfinished paths in one rsync, they are only checkpointed together
+    files_from = rsyncbatch.write_files_from(pending)
+    stats = {}
+    try:
+      rsync_cmd = rsyncbatch.batch_command(rsync_base, files_from, "/",
+        self.user + "@" + self.server + ":" + staging)
+      results = rsyncbatch.run_batch(rsync_cmd,
+        rsyncbatch.BatchResults(pending), scheduler, stats)
+    finally:
+      os.remove(files_from)
+    codes = [result for bpath, result, elapsed in results if result]
+    self.metrics.add_phase("rsync", "batch", results and results[0][2] or 0.0,
+      (codes or [0])[0], **stats)
+    failed = [(bpath, result) for bpath, result, elapsed in results
+      if result and result not in rsyncbatch.RSYNC_PARTIAL_CODES]
+    if failed:
+      self.metrics.status = failed[0][1]
+      raise BaseException("Batch push interrupted, exit %d, %d of %d paths done" %
+        (failed[0][1], len(checkpoint["done"]), len(checkpoint["done"]) +
+        len(pending)))
+    for bpath, result, elapsed in results:
+      if result:
+        logging.warning("Push of %s was partial, exit %d." % (bpath, result))
+        self.metrics.status = self.metrics.status or result
+    checkpoint["done"].extend(pending)
+    self.save_checkpoint(checkpoint)
+
+  def latest(self, master):
+
+    # the newest published snapshot in the remote store, None for a new store
+    with self.metrics.phase("latest") as phase:
+      result, lines = master.run(self.rotate_command("-a"))
+      phase["status"] = result
+    if result:
+      raise BaseException("Unable to find the latest snapshot, exit %d" %
+        result)
+    return "".join(lines).strip() or None
+
+  def resume_checkpoint(self, master):
+
+    # a checkpoint whose staging dir is gone was either published by a run
+    # that lost the result of the publish, then the latest snapshot moved on
+    # from the one it was linked against, or its staging was lost, either
+    # way the push starts over
+    checkpoint = self.load_checkpoint()
+    if "latest" not in checkpoint:
+      return checkpoint
+    result, lines = master.run(["test", "-d", checkpoint["staging"]])
+    if result == 0:
+      return checkpoint
+    if result != 1:
+      raise BaseException("Unable to check the staging dir, exit %d" % result)
+    latest = self.latest(master)
+    if latest != checkpoint["latest"]:
+      logging.info("Staged snapshot was already published as %s." % latest)
+    else:
+      logging.warning("Staged snapshot %s is gone, starting over." %
+        checkpoint["staging"])
+    os.remove(self.checkpoint_file)
+    return self.load_checkpoint()
+
+  def push_path(self, bpath, rsync_cmd, scheduler):
+
+    # echoes the rsync output and keeps the stats of the attempt that
+    # finished with the phase
+    start = time.time()
+    stats = {}
+    def on_line(line):
+      sys.stdout.write(line)
+      runmetrics.add_stat(stats, line)
+    result = scheduler.run(bpath, rsync_cmd, on_line,
+      on_restart=stats.clear)
+    self.metrics.add_phase("rsync", bpath, time.time() - start, result, **stats)
+    return result
+
+  def push(self, master, config):
+
+    # get the paths to backup from the config file
+    bpaths = [bpath.strip() for bpath in config.get("backup", [])]
+
+    # the staged snapshot is linked against the newest published snapshot, the
+    # rotation is left alone until every path is pushed
+    checkpoint = self.resume_checkpoint(master)
+    if "latest" not in checkpoint:
+      checkpoint["latest"] = self.latest(master)
+      self.save_checkpoint(checkpoint)
+    staging = checkpoint["staging"]
+    
+    # create the base rsync command with excludes, interrupted files are kept
+    # in the partial dir and picked up by the next run
+    rsync_base = ["rsync", "-avR", "--stats", "--ignore-errors", "--delete",
+      "--delete-excluded", "--partial-dir=" + PARTIAL_DIR, "-e",
+      master.rsync_shell()]
+    if checkpoint["latest"]:
+      rsync_base.append("--link-dest=" + checkpoint["latest"])
+    for exclude in config.get("exclude", []):
+      rsync_base.extend(["--exclude", exclude])
     
-    # one rsync command per path, ignore files vanished errors
-    for bpath in bpaths:
-      bpath = bpath.strip()
+    # one rsync command per path not pushed by an earlier run, ignore files
+    # vanished errors, a dropped connection stops the push to resume later
+    pending = [bpath for bpath in bpaths if bpath not in checkpoint["done"]]
+    if len(pending) < len(bpaths):
+      logging.info("Resuming push, %d of %d paths left." % (len(pending),
+        len(bpaths)))
+    scheduler = bwscheduler.TransferScheduler(config)
+    if config.get("batch", False) and pending:
+      self.push_batch(rsync_base, pending, staging, checkpoint, scheduler)
+    for bpath in [b for b in pending if b not in checkpoint["done"]]:
       rsync_cmd = rsync_base[:]
       rsync_cmd.append(bpath)
-      rsync_cmd.append(self.user + "@" + self.server + ":" + rsync_to)
+      rsync_cmd.append(self.user + "@" + self.server + ":" + staging)
       logging.debug(rsync_cmd)
-      self.run_command(command=rsync_cmd, ignore_errors=True)
+      result = self.push_path(bpath, rsync_cmd, scheduler)
+      if result and result not in rsyncbatch.RSYNC_PARTIAL_CODES:
+        self.metrics.status = result
+        raise BaseException("Push of %s interrupted, exit %d, %d of %d paths done" %
+          (bpath, result, len(checkpoint["done"]), len(bpaths)))
+      if result:
+        self.metrics.status = self.metrics.status or result
+      checkpoint["done"].append(bpath)
+      self.save_checkpoint(checkpoint)
+
+    # every path is pushed, rotate the staged snapshot in as the new one
+    rotate_cmd = self.rotate_command("-P", staging)
+    with self.metrics.phase("publish") as phase:
+      result, lines = master.run(rotate_cmd)
+      phase["status"] = result
+    if result:
+      self.metrics.status = result
+      raise BaseException(str(rotate_cmd) + " " + str(result))
+    os.remove(self.checkpoint_file)
+    rotated_names = [name.strip() for name in lines if name.strip()]
+    if rotated_names:
+      logging.info("Published %s." % rotated_names[0])
 
 """
 Prints out the usage for the command line.
 """
 def usage():
-  usage = ["pushbackup.py [-hnksctuxr]\n"]
+  usage = ["pushbackup.py [-hnksctuxrLC]\n"]
   usage.append("  [-h | --help] prints this help and usage message\n")
   usage.append("  [-n | --name] backup namespace\n")
   usage.append("  [-k | --keep] number of backups to keep before deleting\n")
@@ -135,6 +310,8 @@ def usage():
   usage.append("  [-u | --user] the remote username used to ssh for backups\n")
   usage.append("  [-x | --ssh-key] the ssh key used to connect to the backup\n")
   usage.append("  [-r | --rotate-script] the rotatebackups script remote location\n")
+  usage.append("  [-L | --layout] remote store layout, numbered or timestamp\n")
+  usage.append("  [-C | --checkpoint] file recording the paths pushed, to resume\n")
   message = "".join(usage)
   print(message)
 
@@ -153,13 +330,15 @@ def main(argv):
   user = "backup"
   ssh_key = os.path.expanduser("~/.ssh/id_rsa")
   rotate_script = "rotatebackups.py"
+  layout = None
+  checkpoint_file = None
                    
   try:
     
     # process the command line options   
-    opts, args = getopt.getopt(argv, "hn:k:s:c:t:u:x:r:", ["help", "name=", 
+    opts, args = getopt.getopt(argv, "hn:k:s:c:t:u:x:r:L:C:", ["help", "name=", 
       "keep=", "server=", "config=", "store=", "user=", "ssh-key=", 
-      "rotate-script="])
+      "rotate-script=", "layout=", "checkpoint="])
     
     # if no arguments print usage
     if len(argv) == 0:      
@@ -188,8 +367,12 @@ def main(argv):
         ssh_key = arg
       elif opt in ("-r", "--rotate-script"): 
         rotate_script = arg
+      elif opt in ("-L", "--layout"): 
+        layout = arg
+      elif opt in ("-C", "--checkpoint"): 
+        checkpoint_file = arg
 
-  except(getopt.GetoptError, msg):
+  except getopt.GetoptError as msg:
     # if an error happens print the usage and exit with an error       
     usage()                          
     sys.exit(errno.EIO)
@@ -215,7 +398,7 @@ def main(argv):
 
     # create the backup object and call its backup method
     pbackup = PushBackup(name, server, keep, store, config_file, user,
-      ssh_key, rotate_script)
+      ssh_key, rotate_script, layout, checkpoint_file)
     pbackup.backup()
 
   except(Exception):            
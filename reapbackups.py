@@ -0,0 +1,319 @@
+#!/usr/bin/python
+
+import sys
+import getopt
+import os
+import os.path
+import errno
+import signal
+import logging
+import threading
+import datetime
+import time
+import storelock
+
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+-----------------------------------------------------------------------------
+Deletes expired backups in the background.  Instead of deleting an expired
+backup inline the rotation renames it into a trash directory inside the store,
+which is a single atomic rename, and returns right away.  The reaper then
+deletes everything in the trash with a pool of threads.
+
+Deletion can be limited to a number of unlinks per second so it doesn't starve
+running backups of I/O, and to a time of day window such as 01:00-06:00.  A
+reaper that runs out of its window stops and the next run picks up where it
+left off.  The reaper holds its own lock on the trash so only one reaper runs
+per store, rotation never waits on it since it only renames complete backups
+into the trash under new names.
+
+Use the -h or the --help flag to get a listing of options.
+
+Program: Reap Backups
+Author: agent
+Date: October 17, 2026
+Revision: 1.0
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+-----------------------------------------------------------------------------
+"""
+
+TRASH_NAME = ".trash"
+REAPER_LOCK_NAME = ".reaper.lock"
+
+def trash_path(store):
+  return os.path.join(os.path.abspath(store), TRASH_NAME)
+
+def trash_name(store, bpath):
+
+  # the name is made unique in case the same backup name is expired twice
+  tstamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+  return os.path.join(trash_path(store), "%s.%s.%d" % (
+    os.path.basename(bpath), tstamp, os.getpid()))
+
+def move_to_trash(store, bpath):
+
+  # the trash is inside the store so the move is an atomic rename
+  trash = trash_path(store)
+  if not os.path.isdir(trash):
+    os.mkdir(trash)
+  trashed = trash_name(store, bpath)
+  logging.debug(["trash", bpath, trashed])
+  os.rename(bpath, trashed)
+  return trashed
+
+def parse_window(window):
+
+  # a window of HH:MM-HH:MM, it may wrap past midnight
+  if not window:
+    return None
+  start, end = window.split("-")
+  start = datetime.datetime.strptime(start.strip(), "%H:%M").time()
+  end = datetime.datetime.strptime(end.strip(), "%H:%M").time()
+  return (start, end)
+
+def in_window(window, now=None):
+  if window == None:
+    return True
+  now = (now or datetime.datetime.now()).time()
+  start, end = window
+  if start <= end:
+    return start <= now < end
+  return now >= start or now < end
+
+class RateLimiter:
+
+  def __init__(self, rate=None):
+    self.rate = rate
+    self.lock = threading.Lock()
+    self.next_time = time.time()
+
+  def wait(self, count=1):
+
+    # spaces out operations to rate per second across all threads
+    if not self.rate:
+      return
+    with self.lock:
+      now = time.time()
+      start = max(now, self.next_time)
+      self.next_time = start + float(count) / self.rate
+    if start > now:
+      time.sleep(start - now)
+
+class Reaper:
+
+  def __init__(self, store=None, jobs=4, rate=None, window=None):
+    self.store = store
+    self.trash = trash_path(store)
+    self.jobs = jobs
+    self.limiter = RateLimiter(rate)
+    self.window = parse_window(window)
+    self.stop_event = threading.Event()
+    self.condition = threading.Condition()
+    self.unfinished = 0
+    self.dirs = []
+    self.errors = []
+    self.unlinked = 0
+
+  def stop(self):
+    self.stop_event.set()
+
+  def stopped(self):
+    if not self.stop_event.is_set() and not in_window(self.window):
+      logging.info("Outside of reap window, stopping.")
+      self.stop_event.set()
+    return self.stop_event.is_set()
+
+  def pending(self):
+
+    # backups waiting in the trash, bytes counts only files with no links
+    # outside of the trash, which is the space deleting them would free
+    entries = []
+    if os.path.isdir(self.trash):
+      entries = [e for e in sorted(os.listdir(self.trash))
+        if e != REAPER_LOCK_NAME]
+    files = 0
+    total_bytes = 0
+    free_bytes = 0
+    for entry in entries:
+      for root, dirs, names in os.walk(os.path.join(self.trash, entry)):
+        for name in names:
+          st = os.lstat(os.path.join(root, name))
+          files += 1
+          total_bytes += st.st_size
+          if st.st_nlink == 1:
+            free_bytes += st.st_size
+    return {"backups": entries, "files": files, "bytes": total_bytes,
+      "free_bytes": free_bytes}
+
+  def submit(self, pool, path):
+    with self.condition:
+      self.unfinished += 1
+    pool.submit(self.reap_dir, pool, path)
+
+  def reap_dir(self, pool, path):
+    unlinked = 0
+    try:
+      if self.stopped():
+        return
+      for entry in os.scandir(path):
+        if self.stopped():
+          return
+        if entry.is_dir(follow_symlinks=False):
+          self.submit(pool, entry.path)
+        else:
+          self.limiter.wait()
+          os.unlink(entry.path)
+          unlinked += 1
+      with self.condition:
+        self.dirs.append(path)
+    except Exception as e:
+      logging.exception("Reap of %s failed." % path)
+      with self.condition:
+        self.errors.append((path, e))
+      self.stop()
+    finally:
+      with self.condition:
+        self.unlinked += unlinked
+        self.unfinished -= 1
+        self.condition.notify_all()
+
+  def reap_backup(self, pool, bpath):
+
+    # unlink the files in parallel, then remove the emptied directories
+    # deepest first
+    self.dirs = []
+    self.submit(pool, bpath)
+    with self.condition:
+      while self.unfinished > 0:
+        self.condition.wait()
+    if self.stopped() or self.errors:
+      return False
+    self.dirs.sort(key=lambda d: d.count(os.sep), reverse=True)
+    for path in self.dirs:
+      self.limiter.wait()
+      os.rmdir(path)
+    return True
+
+  def reap(self):
+
+    # only one reaper per store
+    if not os.path.isdir(self.trash):
+      return 0
+    lock = storelock.StoreLock(self.trash, REAPER_LOCK_NAME)
+    lock.acquire()
+    reaped = 0
+    start = time.time()
+    try:
+      with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+        for entry in sorted(os.listdir(self.trash)):
+          if entry == REAPER_LOCK_NAME or self.stopped():
+            continue
+          bpath = os.path.join(self.trash, entry)
+          if not os.path.isdir(bpath) or os.path.islink(bpath):
+            os.unlink(bpath)
+          elif not self.reap_backup(pool, bpath):
+            break
+          logging.info("Reaped %s." % bpath)
+          reaped += 1
+    finally:
+      lock.release()
+
+    if self.errors:
+      raise self.errors[0][1]
+    logging.info("Reaped %d backups, %d files in %.1fs." % (reaped,
+      self.unlinked, time.time() - start))
+    return reaped
+
+"""
+Prints out the usage for the command line.
+"""
+def usage():
+  usage = ["reapbackups.py [-htjrwp]\n"]
+  usage.append("  [-h | --help] prints this help and usage message\n")
+  usage.append("  [-t | --store] the backup store to empty the trash of\n")
+  usage.append("  [-j | --jobs] number of directories to delete at once\n")
+  usage.append("  [-r | --rate] max number of files to delete per second\n")
+  usage.append("  [-w | --window] only delete between these times, HH:MM-HH:MM\n")
+  usage.append("  [-p | --pending] print the backups and size pending in the trash\n")
+  message = "".join(usage)
+  print(message)
+
+"""
+Main method that starts up the reaper.
+"""
+def main(argv):
+
+  # set the default values
+  store = None
+  jobs = 4
+  rate = None
+  window = None
+  pending = False
+
+  try:
+
+    # process the command line options
+    opts, args = getopt.getopt(argv, "ht:j:r:w:p", ["help", "store=", "jobs=",
+      "rate=", "window=", "pending"])
+
+    # if no arguments print usage
+    if len(argv) == 0:
+      usage()
+      sys.exit()
+
+    # loop through all of the command line options and set the appropriate
+    # values, overriding defaults
+    for opt, arg in opts:
+      if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+      elif opt in ("-t", "--store"):
+        store = arg
+      elif opt in ("-j", "--jobs"):
+        jobs = int(arg)
+      elif opt in ("-r", "--rate"):
+        rate = float(arg)
+      elif opt in ("-w", "--window"):
+        window = arg
+      elif opt in ("-p", "--pending"):
+        pending = True
+
+  except getopt.GetoptError as msg:
+    # if an error happens print the usage and exit with an error
+    logging.warning(msg)
+    usage()
+    sys.exit(errno.EIO)
+
+  # check options are set correctly
+  if store == None:
+    usage()
+    sys.exit(errno.EPERM)
+
+  reaper = Reaper(store, jobs, rate, window)
+  if pending:
+    info = reaper.pending()
+    for backup in info["backups"]:
+      print(backup)
+    print("%d backups, %d files, %d bytes, %d bytes to free" % (
+      len(info["backups"]), info["files"], info["bytes"], info["free_bytes"]))
+    return
+
+  # interrupting the reaper stops it cleanly, the next run continues
+  signal.signal(signal.SIGINT, lambda signum, frame: reaper.stop())
+  signal.signal(signal.SIGTERM, lambda signum, frame: reaper.stop())
+  try:
+    reaper.reap()
+  except storelock.StoreLockBusy as e:
+    logging.warning("Reaper running, %s, exiting." % e)
+    sys.exit(errno.EBUSY)
+  except(Exception):
+    logging.exception("Reap backups failed.")
+    sys.exit(1)
+
+# if we are running the script from the command line, run the main function
+if __name__ == "__main__":
+  main(sys.argv[1:])
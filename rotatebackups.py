@@ -13,6 +13,12 @@ import tempfile
 import datetime
 import subprocess
 import json
+import reapbackups
+import rotatejournal
+import snapshotstore
+import catalog
+import storelock
+import runmetrics
 
 from operator import itemgetter
 
@@ -21,24 +27,79 @@ from operator import itemgetter
 Rotates backup folders, keeping a given number of backups and deleting older
 backups.
 
+By default the 0 backup is hardlink copied to 1 and rsync then updates 0 in
+place.  In link dest mode 0 is moved to 1 like every other backup and a new
+empty 0 directory is created.  The caller then rsyncs into the new 0 with
+--link-dest pointing at 1 so unchanged files are linked during the transfer
+instead of in a separate pass over the whole tree.
+
+If clone jobs are given the hardlink copy of 0 is done in process by a pool of
+threads instead of by cp -al.
+
+With a publish directory, a staged snapshot already written elsewhere in the
+store, 0 is moved to 1 as in link dest mode and the staged directory is renamed
+to the new 0 by the same journaled rotation, so the snapshot appears complete
+or not at all.
+
+With deferred delete expired backups are renamed into the trash directory of
+the store instead of being deleted, reapbackups.py deletes them later.
+
+Stores in the timestamp layout, see snapshotstore.py, are rotated without
+renaming any backups.  A store is in that layout if it has an index file or if
+the timestamp layout is asked for, in which case a new store is created in it.
+
+The steps of a rotation are planned first and written to a journal in the
+store, see rotatejournal.py, then run in process.  A rotation that is killed
+part way is finished by the next rotation.
+
+Run on its own a rotation takes the lock of the store, see storelock.py, so
+it never runs alongside a backup, another rotation or a migration of the
+same store.
+
+The backups to rotate are read from the store catalog, see catalog.py, and the
+renames and removals are recorded in it by the last step of the rotation.
+
+The recovery of an interrupted rotation and the run of the journal are timed
+as phases of the run metrics, see runmetrics.py.  Run on its own with a
+metrics directory a report of the rotation is written there.
+
 Use the -h or the --help flag to get a listing of options.
 
 Program: Rotate Backups
 Author: Dennis E. Kubes
 Date: May 01, 2013
-Revision: 1.0
+Revision: 1.9
 
 Revision      | Author            | Comment
 -----------------------------------------------------------------------------
 20130501-1.0  Dennis E. Kubes     Initial creation of script.
+20261017-1.1  Dennis E. Kubes     Added link dest mode, no hardlink copy of 0.
+20261017-1.2  Dennis E. Kubes     Added in process parallel hardlink copy.
+20261017-1.3  Dennis E. Kubes     Added deferred delete into the store trash.
+20261017-1.4  Dennis E. Kubes     Added timestamp snapshot store layout.
+20261017-1.5  Dennis E. Kubes     Journaled rotation steps, run in process.
+20261017-1.6  Dennis E. Kubes     Backups read from and recorded in the catalog.
+20261017-1.7  Dennis E. Kubes     Publish staged snapshots, latest snapshot option.
+20261017-1.8  Dennis E. Kubes     Rotation phase timings, metrics dir option.
+20261017-1.9  Dennis E. Kubes     Per store lock instead of a global pid file.
 -----------------------------------------------------------------------------
 """
 class RotateBackups:
 
-  def __init__(self, keep=90, store=None, name=None):
+  def __init__(self, keep=90, store=None, name=None, link_dest=False,
+    clone_jobs=None, defer_delete=False, layout=None, view=False,
+    publish=None, metrics=None):
     self.keep = keep
     self.store = store
     self.name = name
+    self.link_dest = link_dest
+    self.clone_jobs = clone_jobs
+    self.defer_delete = defer_delete
+    self.layout = layout
+    self.view = view
+    self.publish = publish
+    self.metrics = metrics or runmetrics.RunMetrics("rotatebackups",
+      name or "backup")
 
   def run_command(self, command=None, shell=False, ignore_errors=False, 
     ignore_codes=None):
@@ -48,15 +109,45 @@ class RotateBackups:
 
   def rotate_backups(self):
 
+    # finish a rotation that was interrupted before starting a new one
+    journal = rotatejournal.RotationJournal(self.store, self.clone_jobs)
+    with self.metrics.phase("recover"):
+      journal.recover()
+
+    # a missing staged snapshot would leave a journal that can't be finished
+    if self.publish and not os.path.isdir(self.publish):
+      raise BaseException("Staged snapshot %s does not exist" % self.publish)
+
+    # timestamp layout stores never renumber, the new snapshot is created and
+    # returned first in the same way as the numbered 0 backup
+    if self.layout == "timestamp" or snapshotstore.is_snapshot_store(self.store):
+      sstore = snapshotstore.SnapshotStore(self.store, self.keep,
+        self.name or "backup", self.link_dest, self.clone_jobs,
+        self.defer_delete, self.view, self.publish)
+      with self.metrics.phase("journal"):
+        return sstore.rotate()
+
     padding = len(str(self.keep))
 
     backups = []
     final_backup_names = []
+    steps = []
+    changes = []
+    published = False
     
-    # add the backup directories to a list, dirs are the form num.prefix.date
-    for backup_dir in os.listdir(self.store):
+    # add the backup directories to a list, dirs are the form num.prefix.date,
+    # they are read from the catalog after it is synced with the store so
+    # directories that were never recorded are rotated too
+    backup_catalog = catalog.Catalog(self.store)
+    try:
+      backup_catalog.scan()
+      entries = backup_catalog.entries("snapshot")
+    finally:
+      backup_catalog.close()
+    for entry in entries:
+      backup_dir = entry["path"]
       bparts = backup_dir.split(".")
-      if bparts[0].isdigit():
+      if os.sep not in backup_dir and bparts[0].isdigit():
         backups.append((backup_dir, bparts))
     
     # only need to process backup directories if we have some
@@ -65,7 +156,8 @@ class RotateBackups:
       # order the backups in the list by reverse number, highest first
       backups = sorted(backups, key=itemgetter(0), reverse=True)
 
-      # perform shifting and processing on the backup directories
+      # plan the shifting and processing on the backup directories, the steps
+      # are journaled and run once they are all planned
       for btup in backups:
 
         # unpack the original directory and backup parts
@@ -75,9 +167,13 @@ class RotateBackups:
         # remove backups >= number of days to keep
         bnum = int(bparts[0])
         if bnum >= self.keep:
-          bpath = self.store + os.sep + origdir
-          logging.debug(["rm", "-fr", bpath])
-          self.run_command(["rm", "-fr", bpath])
+          bpath = os.path.abspath(self.store) + os.sep + origdir
+          if self.defer_delete:
+            steps.append({"op": "rename", "src": bpath,
+              "dst": reapbackups.trash_name(self.store, bpath)})
+          else:
+            steps.append({"op": "remove", "path": bpath})
+          changes.append({"action": "remove", "path": origdir})
         else:
         
           # above 0 gets shifted to one number higher and moved, 0 gets hardlink
@@ -88,17 +184,14 @@ class RotateBackups:
           num_prefix = str(bnum + 1).zfill(padding)
           incr_name = num_prefix + "." + ".".join(bparts[1:])
           new_bpath = base_path + os.sep + incr_name        
+          changes.append({"action": "move", "src": origdir, "dst": incr_name})
           if bnum > 0:
-            logging.debug([bnum, "mv", old_bpath, new_bpath])
-            self.run_command(["mv", old_bpath, new_bpath])
+            steps.append({"op": "rename", "src": old_bpath, "dst": new_bpath})
             final_backup_names.append(new_bpath)
 
           elif bnum == 0:
 
             if os.path.isdir(old_bpath):
-              logging.debug(["cp", "-al", old_bpath, new_bpath])          
-              self.run_command(["cp", "-al", old_bpath, new_bpath])
-              final_backup_names.append(new_bpath)
 
               # get the current date and timestamp and create the zero backup path
               now = datetime.datetime.now()
@@ -106,30 +199,97 @@ class RotateBackups:
               zero_parts = ["".zfill(padding), tstamp]
               zero_parts.extend(bparts[2:])
               zbackup_path = base_path + os.sep + ".".join(zero_parts)
+              changes.append({"action": "add", "entry": {"kind": "snapshot",
+                "tstamp": tstamp, "namespace": ".".join(bparts[2:]),
+                "path": ".".join(zero_parts)}})
+
+              if self.link_dest or self.publish:
+
+                # move zero to one and create an empty zero to be linked
+                # against one by rsync, or move the staged snapshot to zero
+                steps.append({"op": "rename", "src": old_bpath,
+                  "dst": new_bpath})
+                final_backup_names.append(new_bpath)
+                if self.publish:
+                  steps.append({"op": "rename", "src": os.path.abspath(
+                    self.publish), "dst": zbackup_path})
+                  published = True
+                else:
+                  steps.append({"op": "mkdir", "path": zbackup_path})
+                final_backup_names.append(zbackup_path)
+
+              else:
+                steps.append({"op": "clone", "src": old_bpath,
+                  "dst": new_bpath})
+                final_backup_names.append(new_bpath)
   
-              # move the zero directory to the new timestamp
-              logging.debug([0, "mv", old_bpath, zbackup_path])   
-              self.run_command(["mv", old_bpath, zbackup_path])
-              final_backup_names.append(zbackup_path)
+                # move the zero directory to the new timestamp
+                steps.append({"op": "rename", "src": old_bpath,
+                  "dst": zbackup_path})
+                final_backup_names.append(zbackup_path)
 
             else:
-              logging.debug(["mv",  old_bpath, new_bpath])          
-              self.run_command(["mv", old_bpath, new_bpath])
+              steps.append({"op": "rename", "src": old_bpath,
+                "dst": new_bpath})
               final_backup_names.append(new_bpath)
 
+    # the first staged snapshot of a store becomes its zero
+    if self.publish and not published:
+      tstamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+      zero_name = ".".join(["".zfill(padding), tstamp, self.name or "backup"])
+      zbackup_path = os.path.abspath(self.store) + os.sep + zero_name
+      steps.append({"op": "rename", "src": os.path.abspath(self.publish),
+        "dst": zbackup_path})
+      changes.append({"action": "add", "entry": {"kind": "snapshot",
+        "tstamp": tstamp, "namespace": self.name or "backup",
+        "path": zero_name}})
+      final_backup_names.append(zbackup_path)
+
+    # run the planned steps through the journal, the catalog is updated last
+    if steps:
+      steps.append({"op": "catalog", "changes": changes})
+      with self.metrics.phase("journal") as phase:
+        phase["steps"] = len(steps)
+        journal.run(steps)
+
     # return the final backup file or directory names, most recent to least
     final_backup_names.reverse()
     return final_backup_names                  
 
+  def latest(self):
+
+    # the newest snapshot of the namespace, or of the store without one,
+    # including names the catalog doesn't know yet
+    backup_catalog = catalog.Catalog(self.store)
+    try:
+      entries = backup_catalog.entries("snapshot", self.name)
+      entries.extend(backup_catalog.unknown("snapshot", self.name))
+      entries.sort(key=lambda entry: (entry["tstamp"], entry["path"]),
+        reverse=True)
+      if entries:
+        return backup_catalog.full_path(entries[0])
+    finally:
+      backup_catalog.close()
+    return None
+
 
 """
 Prints out the usage for the command line.
 """
 def usage():
-  usage = ["rotatebackups.py [-hkt]\n"]
+  usage = ["rotatebackups.py [-hktljdnLvPaM]\n"]
   usage.append("  [-h | --help] prints this help and usage message\n")
   usage.append("  [-k | --keep] number of backups to keep before deleting\n")
   usage.append("  [-t | --store] directory locally to store the backups\n")
+  usage.append("  [-l | --link-dest] move 0 to 1 instead of hardlink copying it\n")
+  usage.append("  [-j | --clone-jobs] hardlink copy 0 in process with this many threads\n")
+  usage.append("  [-d | --defer-delete] move expired backups to the trash for reapbackups.py\n")
+  usage.append("  [-n | --name] backup namespace, used by the timestamp layout\n")
+  usage.append("  [-L | --layout] store layout for new stores, numbered or timestamp\n")
+  usage.append("  [-v | --view] keep a numbered symlink view of a timestamp layout store\n")
+  usage.append("  [-P | --publish] rotate in this staged snapshot as the new 0\n")
+  usage.append("  [-a | --latest] print the newest snapshot without rotating\n")
+  usage.append("  [-M | --metrics-dir] write the run report and prometheus textfile here\n")
   message = "".join(usage)
   print(message)
 
@@ -139,15 +299,25 @@ Main method that starts up the backup.
 def main(argv):
 
   # set the default values
-  pid_file = tempfile.gettempdir() + os.sep + "rotbackup.pid"
   keep = 90
   store = None
   padding = 5
+  link_dest = False
+  clone_jobs = None
+  defer_delete = False
+  name = None
+  layout = None
+  view = False
+  publish = None
+  latest = False
+  metrics_dir = None
                    
   try:
     
     # process the command line options   
-    opts, args = getopt.getopt(argv, "hk:t:p:", ["help", "keep=", "store="])
+    opts, args = getopt.getopt(argv, "hk:t:p:lj:dn:L:vP:aM:", ["help", "keep=", 
+      "store=", "link-dest", "clone-jobs=", "defer-delete", "name=", "layout=",
+      "view", "publish=", "latest", "metrics-dir="])
     
     # if no arguments print usage
     if len(argv) == 0:      
@@ -164,8 +334,26 @@ def main(argv):
         keep = int(arg)
       elif opt in ("-t", "--store"): 
         store = arg
+      elif opt in ("-l", "--link-dest"): 
+        link_dest = True
+      elif opt in ("-j", "--clone-jobs"): 
+        clone_jobs = int(arg)
+      elif opt in ("-d", "--defer-delete"): 
+        defer_delete = True
+      elif opt in ("-n", "--name"): 
+        name = arg
+      elif opt in ("-L", "--layout"): 
+        layout = arg
+      elif opt in ("-v", "--view"): 
+        view = True
+      elif opt in ("-P", "--publish"): 
+        publish = arg
+      elif opt in ("-a", "--latest"): 
+        latest = True
+      elif opt in ("-M", "--metrics-dir"): 
+        metrics_dir = arg
                                        
-  except(getopt.GetoptError, msg):
+  except getopt.GetoptError as msg:
     # if an error happens print the usage and exit with an error       
     usage()                          
     sys.exit(errno.EIO)
@@ -177,27 +365,36 @@ def main(argv):
 
   # process, catch any errors, and perform cleanup
   try:
-  
-    # another rotate can't already be running
-    if os.path.exists(pid_file):
-      logging.warning("Rotate backups running, %s pid exists, exiting." % pid_file)
-      sys.exit(errno.EBUSY)
-    else:
-      pid = str(os.getpid())
-      f = open(pid_file, "w")
-      f.write("%s\n" % pid)
-      f.close()
       
     # create the backup object and call its backup method
-    rotback = RotateBackups(keep, store)
-    rotated_names = rotback.rotate_backups()
+    metrics = runmetrics.RunMetrics("rotatebackups", name or "backup",
+      metrics_dir=metrics_dir)
+    rotback = RotateBackups(keep, store, name, link_dest=link_dest,
+      clone_jobs=clone_jobs, defer_delete=defer_delete, layout=layout,
+      view=view, publish=publish, metrics=metrics)
+    if latest:
+      print(rotback.latest() or "")
+      return
+
+    # a rotation can't run while a backup, rotation or migration holds the
+    # store, rotations of other stores are not blocked
+    lock = storelock.StoreLock(store)
+    try:
+      lock.acquire()
+    except storelock.StoreLockBusy as e:
+      logging.warning("Store busy, %s, exiting." % e)
+      sys.exit(errno.EBUSY)
+    try:
+      with metrics.run():
+        rotated_names = rotback.rotate_backups()
+    finally:
+      lock.release()
     if (len(rotated_names) > 0):
       print("\n".join(rotated_names))
 
   except(Exception):            
     logging.exception("Rotate backups failed.")      
-  finally:
-    os.remove(pid_file)
+    sys.exit(1)
       
 # if we are running the script from the command line, run the main function
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import errno
+import logging
+import json
+import shutil
+import subprocess
+import hardlinkclone
+import reapbackups
+import catalog
+
+"""
+-----------------------------------------------------------------------------
+A write ahead journal for backup rotation.  A rotation is planned as a list of
+filesystem steps, renames, hardlink copies, deletes, that are written to the
+journal in the store before any of them run.  Each step is marked done in the
+journal as it completes and the journal is removed once the rotation is done.
+
+If a rotation is killed part way the journal is still in the store and the
+next rotation rolls it forward first.  Every step can be run again safely, a
+rename whose source is gone and whose destination exists is already done, as
+is a move into the trash the reaper has since deleted, and a hardlink copy is
+resumed by the in process cloner, so an interrupted rotation is finished
+without copying any data again.
+
+The steps are run in process, no mv or rm commands are forked.  The last step
+of a rotation records its changes in the store catalog, see catalog.py, so the
+catalog is updated with the rotation even if it is interrupted.
+
+Program: Rotation Journal
+Author: agent
+Date: October 17, 2026
+Revision: 1.1
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+20261017-1.1  agent               Catalog step.
+-----------------------------------------------------------------------------
+"""
+
+JOURNAL_NAME = ".rotate.journal"
+
+def fsync_dir(path):
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+def write_file(path, content):
+
+  # write to a temp file and rename so readers never see a partial file
+  tmp_path = path + ".tmp"
+  with open(tmp_path, "w") as tmp_file:
+    tmp_file.write(content)
+    tmp_file.flush()
+    os.fsync(tmp_file.fileno())
+  os.rename(tmp_path, path)
+
+"""
+The filesystem steps a rotation is made of.  Each one checks the state it
+finds so it can be run again after a crash.
+"""
+def rename_step(src, dst):
+  if src == dst:
+    return
+  if os.path.lexists(src):
+    if os.path.lexists(dst):
+      raise OSError(errno.EEXIST, "Rename target exists", dst)
+    parent = os.path.dirname(dst)
+    if not os.path.isdir(parent):
+      os.mkdir(parent)
+    os.rename(src, dst)
+  elif os.path.basename(os.path.dirname(dst)) == reapbackups.TRASH_NAME:
+
+    # the reaper doesn't take the store lock, a backup moved into the trash
+    # before a crash may already be deleted when the journal is recovered
+    logging.info("Rename of %s into the trash already reaped." % src)
+  elif not os.path.lexists(dst):
+    raise OSError(errno.ENOENT, "Rename source missing", src)
+
+def clone_step(src, dst, jobs=None, resumed=False):
+
+  # cp -al can't continue a partial copy, a resumed copy always uses the
+  # cloner which skips the entries already linked
+  if jobs or resumed:
+    cloner = hardlinkclone.HardlinkCloner(src, dst, jobs or 8)
+    if not cloner.clone():
+      raise BaseException("Clone of %s stopped" % src)
+  else:
+    subprocess.check_call(["cp", "-al", src, dst])
+
+def remove_step(path):
+  if os.path.isdir(path) and not os.path.islink(path):
+    shutil.rmtree(path)
+  elif os.path.lexists(path):
+    os.unlink(path)
+
+def mkdir_step(path):
+  if not os.path.isdir(path):
+    os.mkdir(path)
+
+def write_step(path, content):
+  write_file(path, content)
+
+def symlink_step(target, path):
+  tmp_link = path + ".tmp"
+  if os.path.lexists(tmp_link):
+    os.unlink(tmp_link)
+  os.symlink(target, tmp_link)
+  os.rename(tmp_link, path)
+
+def catalog_step(store, changes):
+  backup_catalog = catalog.Catalog(store)
+  try:
+    backup_catalog.apply(changes)
+  finally:
+    backup_catalog.close()
+
+class RotationJournal:
+
+  def __init__(self, store=None, clone_jobs=None):
+    self.store = os.path.abspath(store)
+    self.journal_path = os.path.join(self.store, JOURNAL_NAME)
+    self.clone_jobs = clone_jobs
+
+  def run_step(self, step, resumed=False):
+    op = step["op"]
+    logging.debug([op, step])
+    if op == "rename":
+      rename_step(step["src"], step["dst"])
+    elif op == "clone":
+      clone_step(step["src"], step["dst"], self.clone_jobs,
+        resumed or os.path.lexists(step["dst"]))
+    elif op == "remove":
+      remove_step(step["path"])
+    elif op == "mkdir":
+      mkdir_step(step["path"])
+    elif op == "write":
+      write_step(step["path"], step["content"])
+    elif op == "symlink":
+      symlink_step(step["target"], step["path"])
+    elif op == "catalog":
+      catalog_step(self.store, step["changes"])
+    else:
+      raise ValueError("Unknown rotation step %s" % op)
+
+  def load(self):
+
+    # the first line is the plan, each line after marks a step done, a torn
+    # last line is ignored since that step is simply run again
+    steps = None
+    done = set()
+    with open(self.journal_path, "r") as journal:
+      for line in journal:
+        try:
+          record = json.loads(line)
+        except ValueError:
+          break
+        if steps == None:
+          steps = record["steps"]
+        else:
+          done.add(record["done"])
+    return steps, done
+
+  def mark_done(self, journal, idx):
+    journal.write(json.dumps({"done": idx}) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+
+  def finish(self):
+    os.remove(self.journal_path)
+    fsync_dir(self.store)
+
+  def run(self, steps, resumed=False, done=None):
+
+    # the plan is durable before the first step runs
+    done = done or set()
+    if not resumed:
+      write_file(self.journal_path, json.dumps({"steps": steps}) + "\n")
+      fsync_dir(self.store)
+    with open(self.journal_path, "a") as journal:
+      for idx, step in enumerate(steps):
+        if idx in done:
+          continue
+        self.run_step(step, resumed)
+        self.mark_done(journal, idx)
+    self.finish()
+
+  def recover(self):
+
+    # roll forward a rotation left behind by a killed process
+    if not os.path.exists(self.journal_path):
+      return False
+    steps, done = self.load()
+    if steps == None:
+      logging.warning("Discarding unwritten rotation journal %s." %
+        self.journal_path)
+      self.finish()
+      return False
+    logging.warning("Resuming interrupted rotation, %d of %d steps done." %
+      (len(done), len(steps)))
+    self.run(steps, resumed=True, done=done)
+    return True
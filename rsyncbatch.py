@@ -0,0 +1,196 @@
+#!/usr/bin/python
+
+import sys
+import os
+import os.path
+import re
+import logging
+import tempfile
+import threading
+import time
+import snapmanifest
+import bwscheduler
+import runmetrics
+
+"""
+-----------------------------------------------------------------------------
+Batched transfers of all the configured backup paths in one rsync.  Instead of
+one rsync per path, each repeating the ssh setup, the remote rsync startup and
+the exclude compilation, the paths are written to a files-from list and sent
+by a single rsync relative to the root of the source.
+
+rsync only reports a single exit code for the batch, so per path results are
+worked out from its output.  Itemized changes are counted against the path
+they fall under and error and vanished file messages mark their path as
+partial.  A failure that stopped the whole transfer fails every path.
+
+A single huge path can also be split into shards of its top level
+directories, each sent by its own rsync from a files-from list.  The shards
+are balanced by the entry counts of each directory in the manifest of the
+previous snapshot, see snapmanifest.py.  The top level of the path is first
+synced without recursion, which copies its files, removes the directories
+deleted since the last backup and creates new ones, so with --delete inside
+every shard the snapshot ends up the same as a single rsync of the path.
+
+Program: Batched Rsync Transfers
+Author: agent
+Date: October 17, 2026
+Revision: 1.2
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+20261017-1.1  agent               Shards of a huge path balanced by file counts.
+20261017-1.2  agent               Rsync stats of a batch for run metrics.
+-----------------------------------------------------------------------------
+"""
+
+# rsync exit codes for transfers that completed with some files skipped
+RSYNC_PARTIAL_CODES = (23, 24)
+
+# messages naming a file rsync could not transfer and the code they lead to
+RSYNC_ERRORS = [
+  (re.compile(r'^file has vanished: "(.+)"'), 24),
+  (re.compile(r'^rsync: .*?"(.+?)"'), 23)
+]
+
+def write_files_from(bpaths):
+
+  # the paths relative to the source root, one per line
+  fd, path = tempfile.mkstemp(prefix="rsyncbatch.", suffix=".list")
+  with os.fdopen(fd, "w") as files_from:
+    for bpath in bpaths:
+      files_from.write(bpath.strip().lstrip("/") + "\n")
+  return path
+
+def batch_command(rsync_base, files_from, source_root, dest):
+
+  # files from turns off recursion implied by -a, -r turns it back on
+  rsync_cmd = rsync_base[:]
+  if snapmanifest.OUT_FORMAT not in rsync_cmd:
+    rsync_cmd.append(snapmanifest.OUT_FORMAT)
+  rsync_cmd.extend(["-r", "--files-from=" + files_from, source_root, dest])
+  return rsync_cmd
+
+class BatchResults:
+
+  def __init__(self, bpaths):
+    self.bpaths = [bpath.strip() for bpath in bpaths]
+    self.lock = threading.Lock()
+    self.changed = dict([(bpath, 0) for bpath in self.bpaths])
+    self.codes = dict([(bpath, 0) for bpath in self.bpaths])
+
+  def restart(self):
+
+    # errors of a stopped attempt are retried by the next one
+    with self.lock:
+      self.codes = dict([(bpath, 0) for bpath in self.bpaths])
+
+  def path_for(self, name):
+
+    # the longest configured path a transferred name falls under
+    name = "/" + name.strip().lstrip("/").rstrip("/")
+    found = None
+    for bpath in self.bpaths:
+      root = "/" + bpath.strip("/")
+      if name == root or name.startswith(root.rstrip("/") + "/"):
+        if found == None or len(root) > len(found[1]):
+          found = (bpath, root)
+    return found and found[0]
+
+  def add_line(self, line):
+    item = snapmanifest.parse_item(line)
+    if item != None:
+      bpath = self.path_for(item[1])
+      if bpath:
+        with self.lock:
+          self.changed[bpath] += 1
+      return
+    for pattern, code in RSYNC_ERRORS:
+      match = pattern.match(line)
+      if match:
+        bpath = self.path_for(match.group(1))
+        if bpath:
+          with self.lock:
+            self.codes[bpath] = max(self.codes[bpath], code)
+        return
+
+  def results(self, result, elapsed):
+
+    # a failed batch fails every path, as does a partial one whose messages
+    # didn't name a path, otherwise only the paths named are partial
+    if result and (result not in RSYNC_PARTIAL_CODES or
+      not [code for code in self.codes.values() if code]):
+      return [(bpath, result, elapsed) for bpath in self.bpaths]
+    for bpath in self.bpaths:
+      logging.info("%s: %d entries changed." % (bpath, self.changed[bpath]))
+    return [(bpath, self.codes[bpath], elapsed) for bpath in self.bpaths]
+
+def top_level_counts(manifest_path, bpaths):
+
+  # the total entries under each path in a manifest and the entries under
+  # each of its top level directories, read in one pass over the manifest,
+  # top level files and empty directories are left to the top level sync
+  roots = dict([(bpath.strip().strip("/"), bpath) for bpath in bpaths])
+  found = dict([(bpath, [0, {}]) for bpath in bpaths])
+  for path, record in snapmanifest.read_manifest(manifest_path):
+    for root, bpath in roots.items():
+      if not path.startswith(root + "/"):
+        continue
+      found[bpath][0] += 1
+      parts = path[len(root) + 1:].split("/", 1)
+      if len(parts) > 1:
+        counts = found[bpath][1]
+        counts[parts[0]] = counts.get(parts[0], 0) + 1
+  return found
+
+def balance_shards(counts, shards):
+
+  # largest directories first, each onto the least loaded shard
+  loads = [[0, []] for shard in range(shards)]
+  for name, count in sorted(counts.items(), key=lambda item: (-item[1],
+    item[0])):
+    load = min(loads, key=lambda load: load[0])
+    load[0] += count + 1
+    load[1].append(name)
+  return [names for count, names in loads if names]
+
+def top_level_command(rsync_base, source, dest):
+
+  # the entries directly in the path, without recursing into directories
+  rsync_cmd = rsync_base[:]
+  if snapmanifest.OUT_FORMAT not in rsync_cmd:
+    rsync_cmd.append(snapmanifest.OUT_FORMAT)
+  rsync_cmd.extend(["--no-recursive", "--dirs", source.rstrip("/") + "/", dest])
+  return rsync_cmd
+
+def new_directories(lines, bpath):
+
+  # top level directories the top level sync created
+  root = bpath.strip().strip("/")
+  found = []
+  for line in lines:
+    item = snapmanifest.parse_item(line)
+    if item and item[0][1:2] == "d" and "+++" in item[0]:
+      name = item[1].strip("/")
+      if name.startswith(root + "/") and "/" not in name[len(root) + 1:]:
+        found.append(name[len(root) + 1:])
+  return found
+
+def run_batch(rsync_cmd, batch_results, scheduler=None, stats=None):
+
+  # runs the batch rsync echoing its output, returns the per path results,
+  # the rsync stats of the attempt that finished are added to stats if given
+  scheduler = scheduler or bwscheduler.TransferScheduler()
+  start = time.time()
+  def on_line(line):
+    sys.stdout.write(line)
+    batch_results.add_line(line)
+    if stats != None:
+      runmetrics.add_stat(stats, line)
+  def on_restart():
+    batch_results.restart()
+    if stats != None:
+      stats.clear()
+  result = scheduler.run("batch", rsync_cmd, on_line, on_restart=on_restart)
+  return batch_results.results(result, time.time() - start)
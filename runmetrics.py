@@ -0,0 +1,232 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import json
+import socket
+import logging
+import threading
+import contextlib
+import time
+
+"""
+-----------------------------------------------------------------------------
+Metrics and phase timings of a backup run.  The rotation, every rsync and every
+database dump of a run is recorded as a phase with its duration, its exit
+status and what it moved, the files and bytes from the rsync --stats output or
+the size of a dump.
+
+At the end of the run, however it ended, a JSON report of the run and its
+phases and a Prometheus textfile collector file are written to the metrics
+directory, both replaced atomically.  The report keeps the time of the last
+successful run across runs so a backup that keeps failing can be alerted on.
+
+      <metrics dir>/<job>.<name>.json
+      <metrics dir>/<job>.<name>.prom
+
+Without a metrics directory the phases are still timed but nothing is written.
+
+Program: Backup Run Metrics
+Author: agent
+Date: October 17, 2026
+Revision: 1.0
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+-----------------------------------------------------------------------------
+"""
+
+# the rsync --stats lines kept for each rsync, older rsyncs name the
+# transferred files differently
+RSYNC_STATS = {
+  "Number of files:": "files",
+  "Number of created files:": "files_created",
+  "Number of deleted files:": "files_deleted",
+  "Number of regular files transferred:": "files_transferred",
+  "Number of files transferred:": "files_transferred",
+  "Total file size:": "size",
+  "Total transferred file size:": "bytes_transferred",
+  "Total bytes sent:": "bytes_sent",
+  "Total bytes received:": "bytes_received"
+}
+
+# the phase fields exported to prometheus with their metric and help text,
+# fields not listed are only kept in the report
+PHASE_METRICS = {
+  "duration": ("backup_phase_duration_seconds",
+    "Seconds the phase of the backup run took."),
+  "status": ("backup_phase_status", "Exit status of the phase, 0 is ok."),
+  "files": ("backup_phase_files", "Files in the transferred paths."),
+  "files_created": ("backup_phase_files_created",
+    "Files created by the transfer."),
+  "files_deleted": ("backup_phase_files_deleted",
+    "Files deleted by the transfer."),
+  "files_transferred": ("backup_phase_files_transferred",
+    "Regular files transferred."),
+  "size": ("backup_phase_size_bytes",
+    "Bytes in the transferred paths or written by the dump."),
+  "bytes_transferred": ("backup_phase_transferred_bytes",
+    "Bytes of the files transferred."),
+  "bytes_sent": ("backup_phase_sent_bytes", "Bytes sent over the wire."),
+  "bytes_received": ("backup_phase_received_bytes",
+    "Bytes received over the wire.")
+}
+
+def parse_stat(line):
+
+  # the first number of a stats line, rsync groups digits with commas
+  for prefix, key in RSYNC_STATS.items():
+    if line.startswith(prefix):
+      value = line[len(prefix):].split()[0].replace(",", "")
+      if value.isdigit():
+        return key, int(value)
+  return None, None
+
+def add_stat(stats, line):
+
+  # adds a stats line to the totals, returns the key it was added to
+  key, value = parse_stat(line)
+  if key:
+    stats[key] = stats.get(key, 0) + value
+  return key
+
+def escape_label(value):
+  return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n",
+    "\\n")
+
+def format_labels(labels):
+  return "{" + ",".join(["%s=\"%s\"" % (key, escape_label(value))
+    for key, value in labels]) + "}"
+
+def write_atomic(path, content):
+
+  # the collector and readers of the report never see a partial file
+  tmp_path = path + ".tmp"
+  with open(tmp_path, "w") as out_file:
+    out_file.write(content)
+  os.rename(tmp_path, path)
+
+class RunMetrics:
+
+  def __init__(self, job, name="backup", host=None, metrics_dir=None,
+    ok_codes=(0,)):
+    self.job = job
+    self.name = name
+    self.host = host or socket.gethostname()
+    self.metrics_dir = metrics_dir
+    self.ok_codes = ok_codes
+    self.lock = threading.Lock()
+    self.phases = []
+    self.start = None
+    self.end = None
+    self.status = 0
+
+  def add_phase(self, phase, target=None, duration=0.0, status=0, **fields):
+    record = {"phase": phase, "target": target, "start": time.time() -
+      duration, "duration": duration, "status": status}
+    record.update(fields)
+    with self.lock:
+      self.phases.append(record)
+    return record
+
+  @contextlib.contextmanager
+  def phase(self, phase, target=None):
+
+    # times the block, the caller can set the status and fields of the phase
+    # in the dict it is given, an exception fails the phase
+    fields = {"status": 0}
+    start = time.time()
+    try:
+      yield fields
+    except BaseException:
+      fields["status"] = fields["status"] or -1
+      raise
+    finally:
+      self.add_phase(phase, target, time.time() - start, **fields)
+
+  @contextlib.contextmanager
+  def run(self):
+
+    # the report is written however the run ends
+    self.start = time.time()
+    try:
+      yield self
+    except BaseException:
+      self.status = self.status or -1
+      raise
+    finally:
+      self.end = time.time()
+      self.write()
+
+  def paths(self):
+    base = os.path.join(self.metrics_dir, ".".join([self.job, self.name]))
+    return base + ".json", base + ".prom"
+
+  def last_success(self, report_path):
+
+    # carried over from the previous report until this run succeeds
+    if self.status in self.ok_codes:
+      return self.end
+    try:
+      with open(report_path, "r") as report_file:
+        return json.load(report_file).get("last_success")
+    except (IOError, OSError, ValueError):
+      return None
+
+  def report(self, last_success=None):
+    with self.lock:
+      phases = sorted(self.phases, key=lambda record: record["start"])
+    return {"job": self.job, "name": self.name, "host": self.host,
+      "start": self.start, "end": self.end,
+      "duration": (self.end or time.time()) - (self.start or time.time()),
+      "status": self.status, "success": self.status in self.ok_codes,
+      "last_success": last_success, "phases": phases}
+
+  def textfile(self, report):
+
+    # one gauge per run value and per phase field, labeled by the job, the
+    # namespace and host and for phases by the phase and its target
+    run_labels = [("job", self.job), ("name", self.name), ("host", self.host)]
+    lines = []
+    def gauge(metric, help_text, samples):
+      if not samples:
+        return
+      lines.append("# HELP %s %s" % (metric, help_text))
+      lines.append("# TYPE %s gauge" % metric)
+      for labels, value in samples:
+        lines.append("%s%s %s" % (metric, format_labels(labels), repr(
+          float(value))))
+    gauge("backup_run_duration_seconds", "Seconds the backup run took.",
+      [(run_labels, report["duration"])])
+    gauge("backup_run_status", "Exit status of the backup run, 0 is ok.",
+      [(run_labels, report["status"])])
+    gauge("backup_run_success", "1 if the backup run succeeded.",
+      [(run_labels, int(report["success"]))])
+    gauge("backup_run_end_timestamp_seconds", "Time the backup run ended.",
+      [(run_labels, report["end"])])
+    if report["last_success"]:
+      gauge("backup_run_last_success_timestamp_seconds",
+        "Time the last successful backup run ended.",
+        [(run_labels, report["last_success"])])
+    for field, (metric, help_text) in sorted(PHASE_METRICS.items()):
+      gauge(metric, help_text, [(run_labels + [("phase", record["phase"]),
+        ("target", record["target"] or "")], record[field])
+        for record in report["phases"]
+        if isinstance(record.get(field), (int, float))])
+    return "\n".join(lines) + "\n"
+
+  def write(self):
+
+    # a run that can't write its metrics isn't failed for it
+    if not self.metrics_dir:
+      return
+    try:
+      if not os.path.isdir(self.metrics_dir):
+        os.makedirs(self.metrics_dir)
+      report_path, textfile_path = self.paths()
+      report = self.report(self.last_success(report_path))
+      write_atomic(report_path, json.dumps(report, indent=2, sort_keys=True))
+      write_atomic(textfile_path, self.textfile(report))
+    except (IOError, OSError):
+      logging.exception("Unable to write the metrics of %s." % self.job)
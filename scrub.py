@@ -0,0 +1,428 @@
+#!/usr/bin/python
+
+import sys
+import getopt
+import os
+import os.path
+import stat
+import errno
+import logging
+import threading
+import sqlite3
+import time
+import catalog
+import snapmanifest
+import reapbackups
+
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+-----------------------------------------------------------------------------
+Integrity scrub of the snapshots in a backup store.  Snapshots share most of
+their files through hard links so each unique inode is hashed once, no matter
+how many snapshots link to it.  Hashes are kept in a .scrub.db sqlite cache in
+the store keyed by device and inode along with the size and mtime they were
+taken at and the snapshot and path they were read from.
+
+Snapshots are scrubbed one at a time, oldest first, and marked as scrubbed in
+the cache.  Only the files of a new snapshot whose inodes aren't in the
+manifest of the snapshot before it are checked, the rest were checked with
+that snapshot, so a nightly scrub only reads what the latest backups added.
+Checked files that are gone from the snapshot are reported as missing and
+files whose manifest records a hash are checked against it, see
+snapmanifest.py.  The all option checks every file of every snapshot again.
+
+Cached hashes older than the reverify age are hashed again from the cache,
+without going through the snapshots, and a hash that changed while the size
+and mtime did not is reported as corrupt.  Inodes no snapshot links to anymore
+are dropped from the cache as they come up for reverify.  Hashing runs on a
+pool of threads in batches with an optional limit on the bytes read per
+second.
+
+Use the -h or the --help flag to get a listing of options.
+
+Program: Snapshot Scrub
+Author: agent
+Date: October 17, 2026
+Revision: 1.1
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+20261017-1.1  agent               Stream snapshots, only check new inodes.
+-----------------------------------------------------------------------------
+"""
+
+SCRUB_NAME = ".scrub.db"
+
+# inodes hashed per batch, bounds the memory of a scrub
+SCRUB_BATCH = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inodes (
+  dev INTEGER NOT NULL,
+  ino INTEGER NOT NULL,
+  size INTEGER,
+  mtime INTEGER,
+  hash TEXT,
+  verified REAL,
+  snapshot TEXT,
+  path TEXT,
+  PRIMARY KEY (dev, ino)
+);
+CREATE INDEX IF NOT EXISTS inodes_verified ON inodes (verified);
+CREATE TABLE IF NOT EXISTS snapshots (
+  snapshot TEXT PRIMARY KEY,
+  scrubbed REAL
+);
+"""
+
+class HashCache:
+
+  def __init__(self, store=None):
+    self.path = os.path.join(os.path.abspath(store), SCRUB_NAME)
+    self.lock = threading.Lock()
+    self.conn = sqlite3.connect(self.path, timeout=60,
+      check_same_thread=False)
+    with self.conn:
+      self.conn.executescript(SCHEMA)
+
+      # caches from before the snapshot and path were kept
+      columns = [row[1] for row in self.conn.execute(
+        "PRAGMA table_info(inodes)")]
+      for column in ("snapshot", "path"):
+        if column not in columns:
+          self.conn.execute("ALTER TABLE inodes ADD COLUMN %s TEXT" % column)
+
+  def close(self):
+    self.conn.close()
+
+  def get(self, dev, ino):
+    with self.lock:
+      return self.conn.execute("SELECT size, mtime, hash, verified FROM " +
+        "inodes WHERE dev = ? AND ino = ?", (dev, ino)).fetchone()
+
+  def put(self, dev, ino, size, mtime, digest, snapshot, path):
+    with self.lock:
+      with self.conn:
+        self.conn.execute("INSERT OR REPLACE INTO inodes VALUES " +
+          "(?, ?, ?, ?, ?, ?, ?, ?)", (dev, ino, size, mtime, digest,
+          time.time(), snapshot, path))
+
+  def remove(self, dev, ino):
+    with self.lock:
+      with self.conn:
+        self.conn.execute("DELETE FROM inodes WHERE dev = ? AND ino = ?",
+          (dev, ino))
+
+  def due(self, cutoff):
+
+    # batches of the inodes verified before the cutoff, inodes hashed again
+    # get a new rowid so every inode comes up once
+    last = 0
+    while True:
+      with self.lock:
+        rows = self.conn.execute("SELECT rowid, dev, ino, size, mtime, " +
+          "hash, snapshot, path FROM inodes WHERE verified < ? AND " +
+          "rowid > ? ORDER BY rowid LIMIT ?", (cutoff, last,
+          SCRUB_BATCH)).fetchall()
+      if not rows:
+        return
+      last = rows[-1][0]
+      yield [row[1:] for row in rows]
+
+  def scrubbed(self, snapshot):
+    with self.lock:
+      return self.conn.execute("SELECT scrubbed FROM snapshots WHERE " +
+        "snapshot = ?", (snapshot,)).fetchone() != None
+
+  def mark(self, snapshot):
+    with self.lock:
+      with self.conn:
+        self.conn.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?)",
+          (snapshot, time.time()))
+
+  def forget(self, snapshots):
+
+    # snapshots that were expired from the store
+    with self.lock:
+      with self.conn:
+        known = [row[0] for row in self.conn.execute(
+          "SELECT snapshot FROM snapshots")]
+        self.conn.executemany("DELETE FROM snapshots WHERE snapshot = ?",
+          [(key,) for key in known if key not in snapshots])
+
+class Scrubber:
+
+  def __init__(self, store=None, name=None, jobs=4, rate=None,
+    reverify_days=None, full=False):
+    self.store = os.path.abspath(store)
+    self.name = name
+    self.jobs = jobs
+    self.limiter = reapbackups.RateLimiter(rate)
+    self.reverify = reverify_days and reverify_days * 86400
+    self.full = full
+    self.lock = threading.Lock()
+    self.hashed = 0
+    self.hashed_bytes = 0
+    self.checked = 0
+
+  def snapshots(self):
+
+    # the snapshots of every namespace, oldest first, with their manifest key
+    backup_catalog = catalog.Catalog(self.store)
+    try:
+      entries = backup_catalog.entries("snapshot", self.name)
+      entries.sort(key=lambda entry: (entry["namespace"], entry["tstamp"]))
+      return [(entry["namespace"], entry["tstamp"] + "." +
+        entry["namespace"], backup_catalog.full_path(entry))
+        for entry in entries]
+    finally:
+      backup_catalog.close()
+
+  def snapshot_records(self, snapshot_path):
+
+    # the records of a snapshot from its manifest, otherwise by walking it
+    key = snapmanifest.manifest_key(self.store, snapshot_path)
+    manifest_path = key and snapmanifest.manifest_path(self.store, key)
+    if manifest_path and os.path.exists(manifest_path):
+      return snapmanifest.read_manifest(manifest_path)
+    return snapmanifest.walk_records(snapshot_path).items()
+
+  def snapshot_inodes(self, snapshot_path):
+
+    # the size and mtime of the regular file inodes of a snapshot
+    return dict([(record[3], (record[0], record[1])) for path, record in
+      self.snapshot_records(snapshot_path) if stat.S_ISREG(record[2])])
+
+  def hash_inode(self, cache, full_path, st, cached, key, path):
+
+    # reads are paced by the rate limit shared by all threads
+    self.limiter.wait(max(st.st_size, 1))
+    digest = snapmanifest.hash_file(full_path)
+    with self.lock:
+      self.hashed += 1
+      self.hashed_bytes += st.st_size
+    if cached and (cached[0], cached[1]) == (st.st_size, int(st.st_mtime)):
+      if cached[2] != digest:
+        return digest, False
+    cache.put(st.st_dev, st.st_ino, st.st_size, int(st.st_mtime), digest,
+      key, path)
+    return digest, True
+
+  def hash_pending(self, cache, pending):
+
+    # a file is corrupt if its inode changed under the same size and mtime
+    # or its contents don't match the hash its manifest recorded
+    with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+      futures = [(entry, pool.submit(self.hash_inode, cache, *entry[:5]))
+        for entry in pending.values()]
+    for entry, future in futures:
+      try:
+        digest, ok = future.result()
+      except (IOError, OSError) as e:
+        logging.warning("Unable to read %s, %s." % (entry[0], e))
+        digest, ok = None, False
+      for problems, path, expected in entry[5]:
+        if not ok or (expected and digest and expected != digest):
+          problems.append(("corrupt", path))
+    pending.clear()
+
+  def scrub_snapshot(self, cache, key, snapshot_path, carried, problems):
+
+    # the files of the snapshot whose inodes weren't in the previous one
+    pending = {}
+    for path, record in self.snapshot_records(snapshot_path):
+      if not stat.S_ISREG(record[2]):
+        continue
+      if carried.get(record[3]) == (record[0], record[1]):
+        continue
+      self.checked += 1
+      full_path = os.path.join(snapshot_path, path)
+      try:
+        st = os.lstat(full_path)
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
+        problems.append(("missing", path))
+        continue
+      if not stat.S_ISREG(st.st_mode):
+        continue
+      inode = (st.st_dev, st.st_ino)
+      expected = record[4]
+      if inode in pending:
+        pending[inode][5].append((problems, path, expected))
+        continue
+      cached = cache.get(*inode)
+      if (cached == None or cached[2] == None or
+        (cached[0], cached[1]) != (st.st_size, int(st.st_mtime))):
+        pending[inode] = (full_path, st, cached, key, path,
+          [(problems, path, expected)])
+        if len(pending) >= SCRUB_BATCH:
+          self.hash_pending(cache, pending)
+      elif expected and expected != cached[2]:
+        problems.append(("corrupt", path))
+    self.hash_pending(cache, pending)
+
+  def locate(self, dev, ino, key, path, snapshots):
+
+    # the inode at its cached path, or at the same path in a newer snapshot
+    # of the namespace once its own snapshot expired
+    keys = [k for k, p in snapshots]
+    candidates = snapshots
+    if key in keys:
+      candidates = snapshots[keys.index(key):]
+    namespace = key.split(".", 1)[-1]
+    for candidate_key, snapshot_path in candidates:
+      if candidate_key.split(".", 1)[-1] != namespace:
+        continue
+      full_path = os.path.join(snapshot_path, path)
+      try:
+        st = os.lstat(full_path)
+      except OSError:
+        continue
+      if (st.st_dev, st.st_ino) == (dev, ino):
+        return candidate_key, snapshot_path, full_path, st
+    return None
+
+  def reverify_inodes(self, cache, cutoff, snapshots, report):
+
+    # cached hashes past their age are read again, inodes that can't be found
+    # in any snapshot are gone and dropped
+    for rows in cache.due(cutoff):
+      pending = {}
+      for dev, ino, size, mtime, digest, key, path in rows:
+        if key == None or path == None:
+          cache.remove(dev, ino)
+          continue
+        if self.name and key.split(".", 1)[-1] != self.name:
+          continue
+        found = self.locate(dev, ino, key, path, snapshots)
+        if found == None:
+          cache.remove(dev, ino)
+          continue
+        key, snapshot_path, full_path, st = found
+        problems = report.setdefault(snapshot_path, [])
+        pending[(dev, ino)] = (full_path, st, (size, mtime, digest), key,
+          path, [(problems, path, None)])
+      self.hash_pending(cache, pending)
+
+  def scrub(self):
+
+    # each namespace oldest snapshot first, a snapshot is checked against the
+    # inodes of the one before it so only new inodes are read
+    start = time.time()
+    cache = HashCache(self.store)
+    report = {}
+    snapshots = self.snapshots()
+    try:
+      previous = None
+      for namespace, key, snapshot_path in snapshots:
+        problems = report.setdefault(snapshot_path, [])
+        if previous and previous[0] != namespace:
+          previous = None
+        if self.full or not cache.scrubbed(key):
+          carried = {}
+          if previous and not self.full:
+            carried = self.snapshot_inodes(previous[1])
+          self.scrub_snapshot(cache, key, snapshot_path, carried, problems)
+          cache.mark(key)
+        previous = (namespace, snapshot_path)
+
+      if self.reverify:
+        self.reverify_inodes(cache, start - self.reverify,
+          [(key, path) for namespace, key, path in snapshots], report)
+      if self.name == None:
+        cache.forget(set([key for namespace, key, path in snapshots]))
+    finally:
+      cache.close()
+    logging.info("Checked %d files, hashed %d files, %d bytes in %.1fs." % (
+      self.checked, self.hashed, self.hashed_bytes, time.time() - start))
+    return report
+
+"""
+Prints out the usage for the command line.
+"""
+def usage():
+  usage = ["scrub.py [-htnjrda]\n"]
+  usage.append("  [-h | --help] prints this help and usage message\n")
+  usage.append("  [-t | --store] the backup store to scrub\n")
+  usage.append("  [-n | --name] only scrub the snapshots of this namespace\n")
+  usage.append("  [-j | --jobs] number of files to hash concurrently\n")
+  usage.append("  [-r | --rate] maximum bytes read per second\n")
+  usage.append("  [-d | --reverify-days] hash cached files again after this many days\n")
+  usage.append("  [-a | --all] check every file of every snapshot again\n")
+  message = "".join(usage)
+  print(message)
+
+"""
+Main method that starts up the scrub.
+"""
+def main(argv):
+
+  # set the default values
+  store = None
+  name = None
+  jobs = 4
+  rate = None
+  reverify_days = None
+  full = False
+
+  try:
+
+    # process the command line options
+    opts, args = getopt.getopt(argv, "ht:n:j:r:d:a", ["help", "store=",
+      "name=", "jobs=", "rate=", "reverify-days=", "all"])
+
+    # if no arguments print usage
+    if len(argv) == 0:
+      usage()
+      sys.exit()
+
+    # loop through all of the command line options and set the appropriate
+    # values, overriding defaults
+    for opt, arg in opts:
+      if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+      elif opt in ("-t", "--store"):
+        store = arg
+      elif opt in ("-n", "--name"):
+        name = arg
+      elif opt in ("-j", "--jobs"):
+        jobs = int(arg)
+      elif opt in ("-r", "--rate"):
+        rate = float(arg)
+      elif opt in ("-d", "--reverify-days"):
+        reverify_days = float(arg)
+      elif opt in ("-a", "--all"):
+        full = True
+
+  except getopt.GetoptError as msg:
+    # if an error happens print the usage and exit with an error
+    logging.warning(msg)
+    usage()
+    sys.exit(errno.EIO)
+
+  # check options are set correctly
+  if store == None:
+    usage()
+    sys.exit(errno.EPERM)
+
+  scrubber = Scrubber(store, name, max(1, jobs), rate, reverify_days, full)
+  report = scrubber.scrub()
+  failed = 0
+  for snapshot_path in sorted(report.keys()):
+    problems = report[snapshot_path]
+    failed += len(problems)
+    for problem, path in problems:
+      print("%s %s %s" % (problem, os.path.basename(snapshot_path), path))
+    print("%s: %d problems" % (os.path.basename(snapshot_path), len(problems)))
+  print("Hashed %d files, %d bytes." % (scrubber.hashed,
+    scrubber.hashed_bytes))
+  if failed:
+    sys.exit(1)
+
+# if we are running the script from the command line, run the main function
+if __name__ == "__main__":
+  main(sys.argv[1:])
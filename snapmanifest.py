@@ -0,0 +1,381 @@
+#!/usr/bin/python
+
+import sys
+import getopt
+import os
+import os.path
+import stat
+import bisect
+import errno
+import fnmatch
+import logging
+import threading
+import hashlib
+import gzip
+import time
+import catalog
+
+"""
+-----------------------------------------------------------------------------
+File manifests of backup snapshots.  Every snapshot gets a compressed manifest
+in the manifests directory of the store listing the path, size, mtime, mode and
+inode of each entry, and optionally a sha256 of each file.
+
+The manifest is built from the itemized output of rsync while the backup runs.
+Entries rsync did not report are unchanged and are copied forward from the
+manifest of the previous snapshot, only the entries rsync changed are stat'd
+and hashed.  The snapshot is only walked when there is no previous manifest.
+
+Listing and searching a snapshot read its manifest instead of the tree.
+Verifying compares the tree against the manifest.  Manifests are named by the
+timestamp and namespace of the snapshot so they don't change when a numbered
+store is rotated.
+
+Use the -h or the --help flag to get a listing of options.
+
+Program: Snapshot Manifests
+Author: agent
+Date: October 17, 2026
+Revision: 1.0
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+-----------------------------------------------------------------------------
+"""
+
+MANIFESTS_NAME = "manifests"
+MANIFEST_SUFFIX = ".manifest.gz"
+MANIFEST_HEADER = "# snapmanifest 1 "
+
+# rsync reports each changed entry as a marked line of its itemized changes
+ITEM_PREFIX = "+ "
+OUT_FORMAT = "--out-format=" + ITEM_PREFIX + "%i %n"
+
+HASH_BLOCK = 1024 * 1024
+
+def manifests_path(store):
+  return os.path.join(os.path.abspath(store), MANIFESTS_NAME)
+
+def manifest_key(store, snapshot_path):
+
+  # the timestamp.namespace of a snapshot, the same in either layout
+  parsed = catalog.parse_entry(os.path.relpath(os.path.abspath(
+    snapshot_path), os.path.abspath(store)))
+  if parsed == None:
+    return None
+  return ".".join(parsed[1:])
+
+def manifest_path(store, key):
+  return os.path.join(manifests_path(store), key + MANIFEST_SUFFIX)
+
+def escape(path):
+  return path.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+def unescape(path):
+  parts = path.split("\\\\")
+  return "\\".join([p.replace("\\t", "\t").replace("\\n", "\n")
+    for p in parts])
+
+def hash_file(path):
+  digest = hashlib.sha256()
+  with open(path, "rb") as hash_input:
+    while True:
+      block = hash_input.read(HASH_BLOCK)
+      if not block:
+        break
+      digest.update(block)
+  return digest.hexdigest()
+
+def stat_record(root, path, hashes=False):
+
+  # a manifest record of an entry in the snapshot, None if it is gone
+  full_path = os.path.join(root, path)
+  try:
+    st = os.lstat(full_path)
+  except OSError as e:
+    if e.errno == errno.ENOENT:
+      return None
+    raise
+  digest = None
+  if hashes and stat.S_ISREG(st.st_mode):
+    digest = hash_file(full_path)
+  return (st.st_size, int(st.st_mtime), st.st_mode, st.st_ino, digest)
+
+def read_manifest(path):
+
+  # yields the path and record of every entry
+  with gzip.open(path, "rt", encoding="utf-8", errors="surrogateescape") as lines:
+    for line in lines:
+      if line.startswith("#"):
+        continue
+      fields = line.rstrip("\n").split("\t")
+      yield unescape(fields[0]), (int(fields[1]), int(fields[2]),
+        int(fields[3], 8), int(fields[4]), None if fields[5] == "-"
+        else fields[5])
+
+def write_manifest(path, key, records):
+
+  # sorted by path, written and renamed so a reader never sees it partial
+  parent = os.path.dirname(path)
+  if not os.path.isdir(parent):
+    os.mkdir(parent)
+  tmp_path = path + ".tmp"
+  with gzip.open(tmp_path, "wt", encoding="utf-8",
+    errors="surrogateescape") as lines:
+    lines.write(MANIFEST_HEADER + key + "\n")
+    for name in sorted(records.keys()):
+      size, mtime, mode, inode, digest = records[name]
+      lines.write("%s\t%d\t%d\t%o\t%d\t%s\n" % (escape(name), size, mtime, mode,
+        inode, digest or "-"))
+  os.rename(tmp_path, path)
+
+def parse_item(line):
+
+  # the itemized change string and the name of a marked rsync line
+  if not line.startswith(ITEM_PREFIX):
+    return None
+  item = line[len(ITEM_PREFIX):].rstrip("\n")
+  return item[:11].strip(), item[12:]
+
+def walk_records(root, hashes=False):
+  records = {}
+  for dirpath, dirs, names in os.walk(root):
+    for name in dirs + names:
+      path = os.path.relpath(os.path.join(dirpath, name), root)
+      record = stat_record(root, path, hashes)
+      if record != None:
+        records[path] = record
+  return records
+
+class ManifestBuilder:
+
+  def __init__(self, store=None, snapshot_path=None, previous_path=None,
+    hashes=False, prefixes=None):
+    self.store = os.path.abspath(store)
+    self.snapshot_path = os.path.abspath(snapshot_path)
+    self.previous_path = previous_path
+    self.hashes = hashes
+    self.prefixes = prefixes
+    self.lock = threading.Lock()
+    self.items = []
+
+  def add_line(self, line):
+
+    # called with every line of rsync output, from concurrent rsyncs
+    item = parse_item(line)
+    if item != None:
+      with self.lock:
+        self.items.append(item)
+    return item != None
+
+  def previous_records(self):
+
+    # the previous manifest, in link dest mode only the entries under the
+    # transferred paths are carried into the new snapshot
+    key = None
+    if self.previous_path:
+      key = manifest_key(self.store, self.previous_path)
+    if key == None or not os.path.exists(manifest_path(self.store, key)):
+      return None
+    records = {}
+    for path, record in read_manifest(manifest_path(self.store, key)):
+      if self.prefixes == None or [p for p in self.prefixes
+        if path == p or path.startswith(p + "/")]:
+        records[path] = record
+    return records
+
+  def apply_items(self, records):
+
+    # rsync prints a deleting line for every file, the entries under a deleted
+    # directory are cut out of the sorted paths once all the lines are in,
+    # except those added again after the directory was deleted
+    deleted_dirs = []
+    added = {}
+    for idx, (item, name) in enumerate(self.items):
+      is_dir = name.endswith("/")
+      name = name.rstrip("/").lstrip("/")
+      if not name or name == ".":
+        continue
+      if item.startswith("*deleting"):
+        record = records.pop(name, None)
+        if is_dir or (record != None and stat.S_ISDIR(record[2])):
+          deleted_dirs.append((name + "/", idx))
+        continue
+      record = stat_record(self.snapshot_path, name, self.hashes)
+      if record == None:
+        records.pop(name, None)
+      else:
+        records[name] = record
+        added[name] = idx
+    if not deleted_dirs:
+      return
+    paths = sorted(records)
+    for prefix, deleted_at in deleted_dirs:
+      start = bisect.bisect_left(paths, prefix)
+      end = bisect.bisect_left(paths, prefix[:-1] + "0")
+      for path in paths[start:end]:
+        if added.get(path, -1) < deleted_at:
+          records.pop(path, None)
+
+  def build(self):
+
+    # copy forward the previous manifest and apply the changes rsync reported,
+    # the whole snapshot is only walked if there is no previous manifest
+    start = time.time()
+    records = self.previous_records()
+    if records == None:
+      logging.info("No previous manifest, walking %s." % self.snapshot_path)
+      records = walk_records(self.snapshot_path, self.hashes)
+    else:
+      self.apply_items(records)
+    key = manifest_key(self.store, self.snapshot_path)
+    write_manifest(manifest_path(self.store, key), key, records)
+    logging.info("Wrote manifest of %s, %d entries, %d changed in %.1fs." % (
+      key, len(records), len(self.items), time.time() - start))
+    return len(records)
+
+def expire_manifests(store, name, snapshot_paths):
+
+  # manifests of the namespace whose snapshots are gone
+  path = manifests_path(store)
+  if not os.path.isdir(path):
+    return 0
+  keep = set([manifest_key(store, s) for s in snapshot_paths])
+  expired = 0
+  for manifest_name in os.listdir(path):
+    key = manifest_name[:-len(MANIFEST_SUFFIX)]
+    if (manifest_name.endswith(MANIFEST_SUFFIX) and key not in keep and
+      key.split(".", 1)[1] == name):
+      os.remove(os.path.join(path, manifest_name))
+      expired += 1
+  return expired
+
+def find_snapshot(store, name, tstamp=None):
+
+  # a snapshot of the namespace from the catalog, the newest by default
+  backup_catalog = catalog.Catalog(store)
+  try:
+    for entry in backup_catalog.entries("snapshot", name):
+      if tstamp in (None, "latest", entry["tstamp"]):
+        return backup_catalog.full_path(entry)
+  finally:
+    backup_catalog.close()
+  return None
+
+def verify(store, snapshot_path, hashes=False):
+
+  # compare the tree with its manifest, returns the differing paths
+  key = manifest_key(store, snapshot_path)
+  records = dict(read_manifest(manifest_path(store, key)))
+  found = walk_records(snapshot_path)
+  problems = []
+  for path, record in sorted(records.items()):
+    current = found.pop(path, None)
+    if current == None:
+      problems.append(("missing", path))
+    elif current[:3] != record[:3]:
+      problems.append(("changed", path))
+    elif hashes and record[4] and hash_file(os.path.join(snapshot_path,
+      path)) != record[4]:
+      problems.append(("corrupt", path))
+  for path in sorted(found.keys()):
+    problems.append(("extra", path))
+  return problems
+
+"""
+Prints out the usage for the command line.
+"""
+def usage():
+  usage = ["snapmanifest.py [-htnsflvH]\n"]
+  usage.append("  [-h | --help] prints this help and usage message\n")
+  usage.append("  [-t | --store] the backup store\n")
+  usage.append("  [-n | --name] backup namespace\n")
+  usage.append("  [-s | --snapshot] snapshot timestamp, latest by default\n")
+  usage.append("  [-l | --list] list the entries of the snapshot\n")
+  usage.append("  [-f | --find] list the entries matching a glob pattern\n")
+  usage.append("  [-v | --verify] compare the snapshot with its manifest\n")
+  usage.append("  [-H | --hashes] verify file contents against the manifest hashes\n")
+  message = "".join(usage)
+  print(message)
+
+"""
+Main method that starts up the manifest commands.
+"""
+def main(argv):
+
+  # set the default values
+  store = None
+  name = "backup"
+  tstamp = None
+  list_entries = False
+  pattern = None
+  check = False
+  hashes = False
+
+  try:
+
+    # process the command line options
+    opts, args = getopt.getopt(argv, "ht:n:s:lf:vH", ["help", "store=",
+      "name=", "snapshot=", "list", "find=", "verify", "hashes"])
+
+    # if no arguments print usage
+    if len(argv) == 0:
+      usage()
+      sys.exit()
+
+    # loop through all of the command line options and set the appropriate
+    # values, overriding defaults
+    for opt, arg in opts:
+      if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+      elif opt in ("-t", "--store"):
+        store = arg
+      elif opt in ("-n", "--name"):
+        name = arg
+      elif opt in ("-s", "--snapshot"):
+        tstamp = arg
+      elif opt in ("-l", "--list"):
+        list_entries = True
+      elif opt in ("-f", "--find"):
+        pattern = arg
+      elif opt in ("-v", "--verify"):
+        check = True
+      elif opt in ("-H", "--hashes"):
+        hashes = True
+
+  except getopt.GetoptError as msg:
+    # if an error happens print the usage and exit with an error
+    logging.warning(msg)
+    usage()
+    sys.exit(errno.EIO)
+
+  # check options are set correctly
+  if store == None:
+    usage()
+    sys.exit(errno.EPERM)
+
+  snapshot_path = find_snapshot(store, name, tstamp)
+  key = snapshot_path and manifest_key(store, snapshot_path)
+  if key == None or not os.path.exists(manifest_path(store, key)):
+    logging.warning("No manifest for snapshot %s of %s." % (tstamp or "latest",
+      name))
+    sys.exit(errno.ENOENT)
+
+  if list_entries or pattern:
+    for path, record in read_manifest(manifest_path(store, key)):
+      if pattern == None or fnmatch.fnmatch(path, pattern):
+        print("%s\t%d\t%s\t%s" % (stat.filemode(record[2]), record[0],
+          time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record[1])), path))
+  if check:
+    problems = verify(store, snapshot_path, hashes)
+    for problem, path in problems:
+      print("%s %s" % (problem, path))
+    print("%d problems in %s." % (len(problems), snapshot_path))
+    if problems:
+      sys.exit(1)
+
+# if we are running the script from the command line, run the main function
+if __name__ == "__main__":
+  main(sys.argv[1:])
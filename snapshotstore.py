@@ -0,0 +1,333 @@
+#!/usr/bin/python
+
+import sys
+import getopt
+import os
+import os.path
+import errno
+import logging
+import datetime
+import json
+import reapbackups
+import rotatejournal
+import storelock
+import catalog
+
+"""
+-----------------------------------------------------------------------------
+A backup store layout where snapshots are never renamed.  Each snapshot lives
+in the snapshots directory of the store under an immutable timestamp.namespace
+name.  The order of the snapshots, newest first, is kept per namespace in an
+index file and a latest.namespace symlink points at the newest snapshot.
+
+Rotating a store in this layout creates the new snapshot, adds it to the index
+and expires the snapshots past the number to keep.  Nothing else is touched so
+rotation costs the same no matter how many snapshots are kept.  The steps of
+a rotation are journaled, see rotatejournal.py, and recorded in the store
+catalog, see catalog.py.
+
+For scripts that expect the numbered NNN.timestamp.namespace layout a view
+directory of numbered symlinks to the snapshots can be kept up to date, the
+links are replaced on each rotation.  An existing numbered store is converted
+to this layout with the migrate option, journaled the same way as a rotation,
+and a store is not rotated in this layout while it still has numbered backups.
+
+Use the -h or the --help flag to get a listing of options.
+
+Program: Snapshot Store
+Author: agent
+Date: October 17, 2026
+Revision: 1.2
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+20261017-1.1  agent               Snapshots recorded in the store catalog.
+20261017-1.2  agent               Publish a staged snapshot as the new one.
+-----------------------------------------------------------------------------
+"""
+
+INDEX_NAME = "index.json"
+SNAPSHOTS_NAME = "snapshots"
+VIEW_NAME = "view"
+LATEST_PREFIX = "latest."
+
+def is_snapshot_store(store):
+  return os.path.exists(os.path.join(store, INDEX_NAME))
+
+def numbered_backups(store):
+
+  # the NNN.timestamp.namespace directories of a numbered store in number order
+  backups = []
+  for backup_dir in os.listdir(store):
+    bparts = backup_dir.split(".")
+    bpath = os.path.join(store, backup_dir)
+    if bparts[0].isdigit() and len(bparts) > 2 and os.path.isdir(bpath):
+      backups.append((int(bparts[0]), backup_dir, bparts))
+  backups.sort()
+  return backups
+
+class SnapshotStore:
+
+  def __init__(self, store=None, keep=90, name="backup", link_dest=False,
+    clone_jobs=None, defer_delete=False, view=False, publish=None):
+    self.store = os.path.abspath(store)
+    self.keep = keep
+    self.name = name
+    self.link_dest = link_dest
+    self.clone_jobs = clone_jobs
+    self.defer_delete = defer_delete
+    self.view = view
+    self.publish = publish
+    self.index_path = os.path.join(self.store, INDEX_NAME)
+    self.snapshots_path = os.path.join(self.store, SNAPSHOTS_NAME)
+
+  def snapshot_path(self, snapshot):
+    return os.path.join(self.snapshots_path, snapshot)
+
+  def load_index(self):
+    if not os.path.exists(self.index_path):
+      return {"namespaces": {}}
+    with open(self.index_path, "r") as index_file:
+      return json.load(index_file)
+
+  def save_index(self, index):
+
+    # write and rename so the index is never seen half written
+    rotatejournal.write_file(self.index_path, json.dumps(index, indent=2,
+      sort_keys=True))
+
+  def snapshots(self, name=None):
+    index = self.load_index()
+    return list(index["namespaces"].get(name or self.name, []))
+
+  def update_latest(self, name, snapshot):
+
+    # swap the latest symlink atomically by renaming a new link over it
+    rotatejournal.symlink_step(os.path.join(SNAPSHOTS_NAME, snapshot),
+      os.path.join(self.store, LATEST_PREFIX + name))
+
+  def update_view(self, name, snapshots):
+
+    # numbered symlinks for scripts that expect the old layout, the number is
+    # part of every link name so each rotation replaces all the links of the
+    # namespace, only the symlinks change and never the snapshots
+    view_path = os.path.join(self.store, VIEW_NAME)
+    if not os.path.isdir(view_path):
+      os.mkdir(view_path)
+    padding = len(str(self.keep))
+    wanted = {}
+    for bnum, snapshot in enumerate(snapshots):
+      wanted[str(bnum).zfill(padding) + "." + snapshot] = snapshot
+    for link in os.listdir(view_path):
+      parsed = catalog.parse_entry(link)
+      if (parsed != None and parsed[2] == name and link not in wanted and
+        os.path.islink(os.path.join(view_path, link))):
+        os.unlink(os.path.join(view_path, link))
+    for link, snapshot in wanted.items():
+      link_path = os.path.join(view_path, link)
+      if not os.path.lexists(link_path):
+        os.symlink(os.path.join("..", SNAPSHOTS_NAME, snapshot), link_path)
+
+  def rotate(self):
+
+    # the new snapshot is named by the current timestamp and namespace
+    tstamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    snapshot = ".".join([tstamp, self.name])
+    # a numbered store would end up with both layouts side by side
+    if not is_snapshot_store(self.store) and numbered_backups(self.store):
+      raise RuntimeError("Store %s has numbered backups, migrate it with "
+        "snapshotstore.py -m first" % self.store)
+    if not os.path.isdir(self.snapshots_path):
+      os.mkdir(self.snapshots_path)
+
+    index = self.load_index()
+    snapshots = index["namespaces"].get(self.name, [])
+    if snapshots and snapshots[0] == snapshot:
+      raise BaseException("Snapshot %s already exists" % snapshot)
+
+    # the new snapshot is a hardlink copy of the latest that rsync updates in
+    # place, or empty for rsync to link against the latest with link dest, or
+    # a finished staged snapshot renamed into place
+    steps = []
+    new_path = self.snapshot_path(snapshot)
+    if self.publish:
+      steps.append({"op": "rename", "src": os.path.abspath(self.publish),
+        "dst": new_path})
+    elif snapshots and not self.link_dest:
+      steps.append({"op": "clone", "src": self.snapshot_path(snapshots[0]),
+        "dst": new_path})
+    else:
+      steps.append({"op": "mkdir", "path": new_path})
+
+    # keep the same number of snapshots as the numbered layout, numbers 0
+    # through keep after the rotation
+    snapshots.insert(0, snapshot)
+    expired = snapshots[self.keep + 1:]
+    snapshots = snapshots[:self.keep + 1]
+    index["namespaces"][self.name] = snapshots
+    steps.append({"op": "write", "path": self.index_path,
+      "content": json.dumps(index, indent=2, sort_keys=True)})
+    steps.append({"op": "symlink", "target": os.path.join(SNAPSHOTS_NAME,
+      snapshot), "path": os.path.join(self.store, LATEST_PREFIX + self.name)})
+
+    # expired snapshots are out of the index before they are removed
+    changes = [{"action": "add", "entry": {"kind": "snapshot",
+      "tstamp": tstamp, "namespace": self.name,
+      "path": os.path.join(SNAPSHOTS_NAME, snapshot)}}]
+    for expired_snapshot in expired:
+      spath = self.snapshot_path(expired_snapshot)
+      if self.defer_delete:
+        steps.append({"op": "rename", "src": spath,
+          "dst": reapbackups.trash_name(self.store, spath)})
+      else:
+        steps.append({"op": "remove", "path": spath})
+      changes.append({"action": "remove",
+        "path": os.path.join(SNAPSHOTS_NAME, expired_snapshot)})
+    steps.append({"op": "catalog", "changes": changes})
+
+    journal = rotatejournal.RotationJournal(self.store, self.clone_jobs)
+    journal.run(steps)
+    if self.view:
+      self.update_view(self.name, snapshots)
+
+    return [self.snapshot_path(s) for s in snapshots]
+
+  def migrate(self):
+
+    # move the numbered NNN.timestamp.namespace directories into the snapshots
+    # directory in number order, newest first, without their numbers, the
+    # moves and the index are journaled so a crash part way is rolled forward
+    # instead of leaving moved snapshots that neither layout knows about
+    journal = rotatejournal.RotationJournal(self.store, self.clone_jobs)
+    journal.recover()
+    backups = numbered_backups(self.store)
+
+    index = self.load_index()
+    steps = [{"op": "mkdir", "path": self.snapshots_path}]
+    changes = []
+    for bnum, backup_dir, bparts in backups:
+      name = ".".join(bparts[2:])
+      snapshot = ".".join(bparts[1:])
+      logging.debug(["migrate", backup_dir, snapshot])
+      steps.append({"op": "rename", "src": os.path.join(self.store,
+        backup_dir), "dst": self.snapshot_path(snapshot)})
+      index["namespaces"].setdefault(name, []).append(snapshot)
+      changes.append({"action": "move", "src": backup_dir,
+        "dst": os.path.join(SNAPSHOTS_NAME, snapshot)})
+    steps.append({"op": "write", "path": self.index_path,
+      "content": json.dumps(index, indent=2, sort_keys=True)})
+
+    # the catalog keeps what it recorded about each snapshot under its new name
+    steps.append({"op": "catalog", "changes": changes})
+    for name, snapshots in index["namespaces"].items():
+      if snapshots:
+        steps.append({"op": "symlink", "target": os.path.join(SNAPSHOTS_NAME,
+          snapshots[0]), "path": os.path.join(self.store, LATEST_PREFIX +
+          name)})
+    journal.run(steps)
+
+    if self.view:
+      for name, snapshots in index["namespaces"].items():
+        self.update_view(name, snapshots)
+    return index
+
+"""
+Prints out the usage for the command line.
+"""
+def usage():
+  usage = ["snapshotstore.py [-htnkmvl]\n"]
+  usage.append("  [-h | --help] prints this help and usage message\n")
+  usage.append("  [-t | --store] directory locally to store the backups\n")
+  usage.append("  [-n | --name] backup namespace to list\n")
+  usage.append("  [-k | --keep] number of backups kept, used for view numbering\n")
+  usage.append("  [-m | --migrate] convert a numbered store to the snapshot layout\n")
+  usage.append("  [-v | --view] create or refresh the numbered symlink view\n")
+  usage.append("  [-l | --list] list the snapshots of the namespace, newest first\n")
+  message = "".join(usage)
+  print(message)
+
+"""
+Main method that starts up the store commands.
+"""
+def main(argv):
+
+  # set the default values
+  store = None
+  name = "backup"
+  keep = 90
+  migrate = False
+  view = False
+  list_snapshots = False
+
+  try:
+
+    # process the command line options
+    opts, args = getopt.getopt(argv, "ht:n:k:mvl", ["help", "store=", "name=",
+      "keep=", "migrate", "view", "list"])
+
+    # if no arguments print usage
+    if len(argv) == 0:
+      usage()
+      sys.exit()
+
+    # loop through all of the command line options and set the appropriate
+    # values, overriding defaults
+    for opt, arg in opts:
+      if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+      elif opt in ("-t", "--store"):
+        store = arg
+      elif opt in ("-n", "--name"):
+        name = arg
+      elif opt in ("-k", "--keep"):
+        keep = int(arg)
+      elif opt in ("-m", "--migrate"):
+        migrate = True
+      elif opt in ("-v", "--view"):
+        view = True
+      elif opt in ("-l", "--list"):
+        list_snapshots = True
+
+  except getopt.GetoptError as msg:
+    # if an error happens print the usage and exit with an error
+    logging.warning(msg)
+    usage()
+    sys.exit(errno.EIO)
+
+  # check options are set correctly
+  if store == None:
+    usage()
+    sys.exit(errno.EPERM)
+
+  # the store is locked so no backup rotates it while it is changed
+  lock = storelock.StoreLock(store)
+  try:
+    lock.acquire()
+  except storelock.StoreLockBusy as e:
+    logging.warning("Backup running, %s, exiting." % e)
+    sys.exit(errno.EBUSY)
+
+  try:
+    sstore = SnapshotStore(store, keep, name, view=view)
+    if migrate:
+      index = sstore.migrate()
+      for name, snapshots in sorted(index["namespaces"].items()):
+        print("%s: %d snapshots" % (name, len(snapshots)))
+    elif view:
+      index = sstore.load_index()
+      for name, snapshots in index["namespaces"].items():
+        sstore.update_view(name, snapshots)
+    if list_snapshots:
+      for snapshot in sstore.snapshots(name):
+        print(sstore.snapshot_path(snapshot))
+  except(Exception):
+    logging.exception("Snapshot store failed.")
+    sys.exit(1)
+  finally:
+    lock.release()
+
+# if we are running the script from the command line, run the main function
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+
+import sys
+import getopt
+import os
+import os.path
+import errno
+import logging
+import sqlite3
+import time
+import catalog
+import snapmanifest
+
+"""
+-----------------------------------------------------------------------------
+Hardlink aware space accounting for the snapshots of a backup store.  For each
+snapshot of a namespace it reports the exclusive bytes only that snapshot
+links to, which is what removing it would free, the bytes it shares with other
+snapshots and the number and size of the inodes it added.
+
+An inode is linked from a run of consecutive snapshots, from the backup that
+wrote it until the backup that replaced or deleted it, so each inode is kept
+in a .space.db sqlite file in the store with the first and last snapshot it
+appears in.  Accounting is updated after each backup by comparing the inodes
+in the manifest of the new snapshot with the previous one and by dropping the
+snapshots that expired, the store is never rescanned.  Snapshots without a
+manifest are walked once, see snapmanifest.py.
+
+Use the -h or the --help flag to get a listing of options.
+
+Program: Snapshot Space Usage
+Author: agent
+Date: October 17, 2026
+Revision: 1.0
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+-----------------------------------------------------------------------------
+"""
+
+SPACE_NAME = ".space.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inodes (
+  namespace TEXT NOT NULL,
+  ino INTEGER NOT NULL,
+  size INTEGER,
+  first TEXT,
+  last TEXT,
+  PRIMARY KEY (namespace, ino)
+);
+CREATE INDEX IF NOT EXISTS inodes_last ON inodes (namespace, last);
+CREATE TABLE IF NOT EXISTS snapshots (
+  namespace TEXT NOT NULL,
+  tstamp TEXT NOT NULL,
+  PRIMARY KEY (namespace, tstamp)
+);
+"""
+
+def snapshot_inodes(store, snapshot_path):
+
+  # the size of every inode in a snapshot, links within it counted once
+  key = snapmanifest.manifest_key(store, snapshot_path)
+  manifest_path = key and snapmanifest.manifest_path(store, key)
+  if manifest_path and os.path.exists(manifest_path):
+    records = snapmanifest.read_manifest(manifest_path)
+  else:
+    logging.info("No manifest, walking %s." % snapshot_path)
+    records = snapmanifest.walk_records(snapshot_path).items()
+  inodes = {}
+  for path, record in records:
+    inodes[record[3]] = record[0]
+  return inodes
+
+class SpaceUsage:
+
+  def __init__(self, store=None, name="backup"):
+    self.store = os.path.abspath(store)
+    self.name = name
+    self.path = os.path.join(self.store, SPACE_NAME)
+    self.conn = sqlite3.connect(self.path, timeout=60)
+    with self.conn:
+      self.conn.executescript(SCHEMA)
+
+  def close(self):
+    self.conn.close()
+
+  def accounted(self):
+    return [row[0] for row in self.conn.execute("SELECT tstamp FROM " +
+      "snapshots WHERE namespace = ? ORDER BY tstamp", (self.name,))]
+
+  def add_snapshot(self, tstamp, snapshot_path, previous):
+
+    # inodes still linked from the new snapshot extend their run to it, all
+    # others start a new run
+    inodes = snapshot_inodes(self.store, snapshot_path)
+    carried = set()
+    if previous:
+      carried = set([row[0] for row in self.conn.execute("SELECT ino FROM " +
+        "inodes WHERE namespace = ? AND last = ?", (self.name, previous))])
+    self.conn.executemany("UPDATE inodes SET last = ? WHERE namespace = ? " +
+      "AND ino = ?", [(tstamp, self.name, ino) for ino in inodes
+      if ino in carried])
+    self.conn.executemany("INSERT OR REPLACE INTO inodes VALUES " +
+      "(?, ?, ?, ?, ?)", [(self.name, ino, size, tstamp, tstamp)
+      for ino, size in inodes.items() if ino not in carried])
+    self.conn.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?)",
+      (self.name, tstamp))
+    return len(inodes) - len(carried & set(inodes.keys()))
+
+  def remove_snapshot(self, tstamp, preceding, following):
+
+    # runs only in the snapshot are freed, runs that started or ended with it
+    # now start with the next or end with the previous snapshot
+    self.conn.execute("DELETE FROM inodes WHERE namespace = ? AND " +
+      "first = ? AND last = ?", (self.name, tstamp, tstamp))
+    if following:
+      self.conn.execute("UPDATE inodes SET first = ? WHERE namespace = ? " +
+        "AND first = ?", (following, self.name, tstamp))
+    if preceding:
+      self.conn.execute("UPDATE inodes SET last = ? WHERE namespace = ? " +
+        "AND last = ?", (preceding, self.name, tstamp))
+    self.conn.execute("DELETE FROM snapshots WHERE namespace = ? AND " +
+      "tstamp = ?", (self.name, tstamp))
+
+  def rebuild(self):
+    with self.conn:
+      self.conn.execute("DELETE FROM inodes WHERE namespace = ?", (self.name,))
+      self.conn.execute("DELETE FROM snapshots WHERE namespace = ?",
+        (self.name,))
+    return self.update()
+
+  def update(self):
+
+    # bring the accounting in line with the catalog, expired snapshots are
+    # removed oldest first and new snapshots added oldest first
+    start = time.time()
+    backup_catalog = catalog.Catalog(self.store)
+    try:
+      snapshots = dict([(entry["tstamp"], backup_catalog.full_path(entry))
+        for entry in backup_catalog.entries("snapshot", self.name)])
+    finally:
+      backup_catalog.close()
+    accounted = self.accounted()
+    added = sorted([t for t in snapshots if t not in accounted])
+
+    # a snapshot older than the newest accounted one breaks the runs
+    if added and accounted and added[0] < accounted[-1]:
+      logging.info("Snapshot %s is out of order, rebuilding." % added[0])
+      return self.rebuild()
+
+    with self.conn:
+      live = [t for t in accounted if t in snapshots]
+      for tstamp in [t for t in accounted if t not in snapshots]:
+        preceding = [t for t in live if t < tstamp]
+        following = [t for t in live if t > tstamp]
+        self.remove_snapshot(tstamp, preceding[-1] if preceding else None,
+          following[0] if following else None)
+    new_inodes = 0
+    for tstamp in added:
+      with self.conn:
+        accounted = self.accounted()
+        new_inodes += self.add_snapshot(tstamp, snapshots[tstamp],
+          accounted[-1] if accounted else None)
+    logging.info("Accounted %d snapshots of %s, %d new inodes in %.1fs." % (
+      len(added), self.name, new_inodes, time.time() - start))
+    return len(added)
+
+  def report(self):
+
+    # per snapshot totals, newest first
+    rows = []
+    for tstamp, in self.conn.execute("SELECT tstamp FROM " +
+      "snapshots WHERE namespace = ? ORDER BY tstamp DESC", (self.name,)):
+      total, exclusive, new_inodes, new_bytes = self.conn.execute(
+        "SELECT COALESCE(SUM(size), 0), " +
+        "COALESCE(SUM(CASE WHEN first = last THEN size ELSE 0 END), 0), " +
+        "COALESCE(SUM(first = ?), 0), " +
+        "COALESCE(SUM(CASE WHEN first = ? THEN size ELSE 0 END), 0) " +
+        "FROM inodes WHERE namespace = ? AND first <= ? AND last >= ?",
+        (tstamp, tstamp, self.name, tstamp, tstamp)).fetchone()
+      rows.append({"tstamp": tstamp, "total": total,
+        "exclusive": exclusive, "shared": total - exclusive,
+        "new_inodes": new_inodes, "new_bytes": new_bytes})
+    return rows
+
+  def unique_bytes(self):
+    return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM inodes " +
+      "WHERE namespace = ?", (self.name,)).fetchone()[0]
+
+"""
+Prints out the usage for the command line.
+"""
+def usage():
+  usage = ["spaceusage.py [-htnurk]\n"]
+  usage.append("  [-h | --help] prints this help and usage message\n")
+  usage.append("  [-t | --store] the backup store\n")
+  usage.append("  [-n | --name] backup namespace\n")
+  usage.append("  [-u | --update] account new and expired snapshots first\n")
+  usage.append("  [-r | --rebuild] account every snapshot again from scratch\n")
+  usage.append("  [-k | --keep] project the namespace size at this many snapshots\n")
+  message = "".join(usage)
+  print(message)
+
+"""
+Main method that starts up the space report.
+"""
+def main(argv):
+
+  # set the default values
+  store = None
+  name = "backup"
+  update = False
+  rebuild = False
+  keep = None
+
+  try:
+
+    # process the command line options
+    opts, args = getopt.getopt(argv, "ht:n:urk:", ["help", "store=", "name=",
+      "update", "rebuild", "keep="])
+
+    # if no arguments print usage
+    if len(argv) == 0:
+      usage()
+      sys.exit()
+
+    # loop through all of the command line options and set the appropriate
+    # values, overriding defaults
+    for opt, arg in opts:
+      if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+      elif opt in ("-t", "--store"):
+        store = arg
+      elif opt in ("-n", "--name"):
+        name = arg
+      elif opt in ("-u", "--update"):
+        update = True
+      elif opt in ("-r", "--rebuild"):
+        rebuild = True
+      elif opt in ("-k", "--keep"):
+        keep = int(arg)
+
+  except getopt.GetoptError as msg:
+    # if an error happens print the usage and exit with an error
+    logging.warning(msg)
+    usage()
+    sys.exit(errno.EIO)
+
+  # check options are set correctly
+  if store == None:
+    usage()
+    sys.exit(errno.EPERM)
+
+  space = SpaceUsage(store, name)
+  try:
+    if rebuild:
+      space.rebuild()
+    elif update:
+      space.update()
+    rows = space.report()
+    print("%-14s %14s %14s %14s %10s %14s" % ("snapshot", "total",
+      "exclusive", "shared", "new inodes", "new bytes"))
+    for row in rows:
+      print("%-14s %14d %14d %14d %10d %14d" % (row["tstamp"], row["total"],
+        row["exclusive"], row["shared"], row["new_inodes"], row["new_bytes"]))
+    unique = space.unique_bytes()
+    print("%d snapshots of %s, %d bytes on disk." % (len(rows), name, unique))
+
+    # the namespace grows by the average new bytes per backup until keep
+    # snapshots are reached
+    if keep and len(rows) > 1:
+      growth = sum([row["new_bytes"] for row in rows[:-1]]) / (len(rows) - 1)
+      print("Projected %d bytes at %d snapshots, %d bytes per backup." % (
+        unique + max(0, keep - len(rows)) * growth, keep, growth))
+  finally:
+    space.close()
+
+# if we are running the script from the command line, run the main function
+if __name__ == "__main__":
+  main(sys.argv[1:])
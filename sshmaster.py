@@ -0,0 +1,129 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import shlex
+import shutil
+import logging
+import tempfile
+import subprocess
+
+"""
+-----------------------------------------------------------------------------
+A single multiplexed ssh connection to a backup server.  The connection is an
+OpenSSH control master started once per run, the remote commands and every
+rsync of the run go over it through its control socket instead of each doing
+their own ssh handshake and authentication.
+
+The master sends keep alives so a dead link is noticed instead of hanging the
+transfers, and is shut down and its socket removed when the run is done.
+
+Program: SSH Master Connections
+Author: agent
+Date: October 17, 2026
+Revision: 1.0
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+-----------------------------------------------------------------------------
+"""
+
+KEEPALIVE_INTERVAL = 30
+KEEPALIVE_COUNT = 4
+
+class SSHMasterError(Exception):
+  pass
+
+class SSHMaster:
+
+  def __init__(self, server=None, user=None, ssh_key=None, port=None,
+    keepalive=KEEPALIVE_INTERVAL):
+    self.server = server
+    self.user = user
+    self.ssh_key = ssh_key
+    self.port = port
+    self.keepalive = keepalive
+    self.control_dir = None
+    self.control_path = None
+
+  def target(self):
+    if self.user:
+      return self.user + "@" + self.server
+    return self.server
+
+  def ssh_options(self):
+    options = ["-o", "BatchMode=yes"]
+    if self.ssh_key:
+      options.extend(["-i", self.ssh_key])
+    if self.port:
+      options.extend(["-p", str(self.port)])
+    if self.control_path:
+      options.extend(["-S", self.control_path])
+    return options
+
+  def start(self):
+
+    # the socket lives in a private temp directory, short enough for the unix
+    # socket path limit
+    self.control_dir = tempfile.mkdtemp(prefix="sshmaster.")
+    self.control_path = os.path.join(self.control_dir, "master")
+    cmd = ["ssh", "-M", "-N", "-f", "-o", "ControlPersist=no",
+      "-o", "ServerAliveInterval=%d" % self.keepalive,
+      "-o", "ServerAliveCountMax=%d" % KEEPALIVE_COUNT]
+    cmd.extend(self.ssh_options())
+    cmd.append(self.target())
+    logging.debug(cmd)
+    result = subprocess.call(cmd)
+    if result or not self.check():
+      self.cleanup()
+      raise SSHMasterError("Unable to connect to %s, exit %d" % (
+        self.target(), result))
+    logging.debug("Started ssh master to %s" % self.target())
+
+  def check(self):
+    return subprocess.call(["ssh", "-S", self.control_path, "-O", "check",
+      self.target()], stdout=subprocess.DEVNULL,
+      stderr=subprocess.DEVNULL) == 0
+
+  def command(self, remote_cmd):
+
+    # an ssh command running the remote command over the master
+    cmd = ["ssh"] + self.ssh_options() + [self.target(), "--"]
+    cmd.append(" ".join([shlex.quote(arg) for arg in remote_cmd]))
+    return cmd
+
+  def run(self, remote_cmd):
+
+    # returns the exit code and the output lines of the remote command
+    proc = subprocess.Popen(self.command(remote_cmd), stdout=subprocess.PIPE,
+      universal_newlines=True)
+    lines = proc.stdout.readlines()
+    proc.stdout.close()
+    return proc.wait(), lines
+
+  def rsync_shell(self):
+
+    # the remote shell for rsync -e, rsync splits it on spaces and quotes
+    return " ".join(["ssh"] + [shlex.quote(option) for option in
+      self.ssh_options()])
+
+  def stop(self):
+    if self.control_path and os.path.exists(self.control_path):
+      subprocess.call(["ssh", "-S", self.control_path, "-O", "exit",
+        self.target()], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+      logging.debug("Stopped ssh master to %s" % self.target())
+    self.cleanup()
+
+  def cleanup(self):
+    if self.control_dir:
+      shutil.rmtree(self.control_dir, ignore_errors=True)
+    self.control_dir = None
+    self.control_path = None
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.stop()
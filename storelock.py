@@ -0,0 +1,81 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import errno
+import fcntl
+import logging
+
+"""
+-----------------------------------------------------------------------------
+A lock held on a backup store while a backup or rotation writes to it.  The
+lock file lives inside the store so backups into different stores never block
+each other, only backups into the same store do.
+
+The lock is an flock on the lock file, it is released by the kernel if the
+process dies so a crashed backup never leaves a stale lock behind.  The pid of
+the holder is written into the lock file for informational purposes.
+
+Program: Store Locks
+Author: agent
+Date: October 17, 2026
+Revision: 1.0
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+-----------------------------------------------------------------------------
+"""
+
+LOCK_NAME = ".backup.lock"
+
+class StoreLockBusy(Exception):
+  pass
+
+class StoreLock:
+
+  def __init__(self, store=None, lock_name=LOCK_NAME):
+    self.store = store
+    self.lock_path = os.path.join(store, lock_name)
+    self.fd = None
+
+  def acquire(self):
+
+    # non blocking, if another process holds the store we fail immediately
+    fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+      fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError) as e:
+      os.close(fd)
+      if e.errno in (errno.EAGAIN, errno.EACCES):
+        raise StoreLockBusy("Store %s is locked by %s" % (self.store,
+          self.holder()))
+      raise
+
+    # record the pid of the holder
+    os.ftruncate(fd, 0)
+    os.write(fd, ("%d\n" % os.getpid()).encode("ascii"))
+    self.fd = fd
+    logging.debug("Locked store %s" % self.store)
+
+  def release(self):
+    if self.fd != None:
+      os.ftruncate(self.fd, 0)
+      fcntl.flock(self.fd, fcntl.LOCK_UN)
+      os.close(self.fd)
+      self.fd = None
+      logging.debug("Unlocked store %s" % self.store)
+
+  def holder(self):
+    try:
+      with open(self.lock_path, "r") as lf:
+        return lf.read().strip() or "unknown"
+    except (IOError, OSError):
+      return "unknown"
+
+  def __enter__(self):
+    self.acquire()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.release()
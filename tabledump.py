@@ -0,0 +1,477 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import logging
+import subprocess
+import time
+import json
+import queue
+import shutil
+import dumpcodecs
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+  import pymysql
+  import pymysql.cursors
+except ImportError:
+  pymysql = None
+
+"""
+-----------------------------------------------------------------------------
+Table level dumps of mysql databases.  Instead of one dump file per database
+each table is dumped to its own compressed file, and very large tables are
+split into ranges of their integer primary key with one file per range.  The
+files of a database are written to a tstamp.db directory in the store along
+with a manifest listing every table, its chunks and the order to restore them.
+
+All of the tables and chunks are dumped concurrently by a pool of connections
+that share one consistent snapshot.  The snapshot is taken by starting a
+consistent snapshot transaction on every connection while a global read lock
+is held, the lock is released as soon as the transactions have started.  The
+binlog position of the snapshot is recorded in the manifest.
+
+Schema and data files turn off foreign key checks so the tables of a phase can
+be restored in any order.  Views are dumped as schema only.  Triggers, routines
+and events are dumped with mysqldump into a post file that is restored after
+the data.
+
+With skip unchanged the create time, update time, engine and row count of
+every table are read while the read lock is held and stored in the manifest.
+A table whose values match the previous dump of the database, and whose
+update time is from before the second the previous snapshot was taken, is not
+dumped again, its files are hardlinked from the previous dump.  Tables with no
+update time, innodb after a restart, or updated in that second or later are
+always dumped unless checksums are enabled, then their CHECKSUM TABLE value is
+compared instead.  MySQL 8 caches these
+values for up to a day, the cache is turned off for the read and where it
+can't be every table is treated as having no update time.
+
+Table dumps need the pymysql module.
+
+Program: Table Dumps
+Author: agent
+Date: October 17, 2026
+Revision: 1.1
+
+Revision      | Author            | Comment
+-----------------------------------------------------------------------------
+20261017-1.0  agent               Initial creation of script.
+20261017-1.1  agent               Hardlink unchanged tables from the last dump.
+-----------------------------------------------------------------------------
+"""
+
+MANIFEST_NAME = "manifest.json"
+
+# bumped when the files of a dump change, files of an older format are never
+# linked into a new dump
+MANIFEST_FORMAT = 2
+
+# approximate size of each insert statement written to a chunk
+INSERT_BYTES = 1024 * 1024
+
+# written at the top of every schema file, schemas are restored in any order
+# so a table can be created before the tables its foreign keys reference
+SCHEMA_HEADER = ("SET NAMES utf8mb4;\n" +
+  "SET FOREIGN_KEY_CHECKS=0;\n")
+
+# written at the top of every data file so loads skip the key checks
+DATA_HEADER = SCHEMA_HEADER + "SET UNIQUE_CHECKS=0;\n"
+
+def quote_name(name):
+  return "`" + name.replace("`", "``") + "`"
+
+def dump_dir_name(tstamp, db):
+  return ".".join([tstamp, db])
+
+def load_manifest(dump_dir):
+  with open(os.path.join(dump_dir, MANIFEST_NAME), "r") as manifest_file:
+    return json.load(manifest_file)
+
+def restore_phases(dump_dir, tables=None):
+
+  # files of a table dump in the order they must be restored, each phase is
+  # a list of files that can be restored in any order once the phase before
+  # it is done, views and triggers are only restored with the whole database
+  manifest = load_manifest(dump_dir)
+  schemas = []
+  chunks = []
+  for table in manifest["tables"]:
+    if tables != None and table["name"] not in tables:
+      continue
+    schemas.append(os.path.join(dump_dir, table["schema"]))
+    for chunk in table["chunks"]:
+      chunks.append(os.path.join(dump_dir, chunk["file"]))
+  post = []
+  if tables == None:
+    post = [os.path.join(dump_dir, view["schema"]) 
+      for view in manifest["views"]]
+    if manifest.get("post"):
+      post.append(os.path.join(dump_dir, manifest["post"]))
+  return [schemas, chunks, post]
+
+class TableDump:
+
+  def __init__(self, store=None, user="root", password=None, host=None,
+    codec=None, jobs=1, chunk_rows=1000000, skip_unchanged=False,
+    checksum=False):
+    if pymysql == None:
+      raise ValueError("Table dumps need the pymysql module")
+    self.store = store
+    self.user = user
+    self.password = password
+    self.host = host
+    self.codec = codec or dumpcodecs.get_codec()
+    self.jobs = max(1, jobs)
+    self.chunk_rows = chunk_rows
+    self.skip_unchanged = skip_unchanged
+    self.checksum = checksum
+    self.connections = queue.Queue()
+    self.binlog = None
+    self.snapshot_time = None
+    self.states = {}
+
+  def connect(self):
+    return pymysql.connect(host=self.host or "localhost", user=self.user,
+      password=self.password or "", charset="utf8mb4", autocommit=True)
+
+  def query(self, conn, sql, args=None):
+    with conn.cursor() as cursor:
+      cursor.execute(sql, args)
+      return cursor.fetchall()
+
+  def table_states(self, conn, dbs):
+
+    # the change signals of every table, read while writes are blocked so
+    # they describe exactly the data in the snapshot, cached stats could hide
+    # a recent change so without turning the cache off update times are not
+    # trusted
+    try:
+      self.query(conn, "SET SESSION information_schema_stats_expiry = 0")
+      trusted = True
+    except pymysql.MySQLError:
+      logging.warning("Unable to turn off the table stats cache, update " +
+        "times are ignored.")
+      trusted = False
+    rows = self.query(conn, "SELECT table_schema, table_name, engine, " +
+      "table_rows, create_time, update_time FROM information_schema.tables " +
+      "WHERE table_type = 'BASE TABLE' AND table_schema IN (" +
+      ",".join(["%s"] * len(dbs)) + ")", list(dbs))
+    states = {}
+    for db, table, engine, table_rows, create_time, update_time in rows:
+      states[(db, table)] = {"engine": engine, "rows": table_rows,
+        "create_time": str(create_time) if create_time else None,
+        "update_time": str(update_time) if update_time and trusted else None}
+    return states
+
+  def previous_dump(self, tstamp, db):
+
+    # the newest complete table dump of the database before this one
+    previous = None
+    for name in os.listdir(self.store):
+      bparts = name.split(".", 1)
+      path = os.path.join(self.store, name)
+      if (len(bparts) == 2 and bparts[1] == db and bparts[0].isdigit() and
+        bparts[0] < tstamp and os.path.exists(os.path.join(path, 
+        MANIFEST_NAME))):
+        if previous == None or name > os.path.basename(previous):
+          previous = path
+    if previous == None:
+      return None, {}, None
+    manifest = load_manifest(previous)
+    if (manifest.get("format", 1) != MANIFEST_FORMAT or
+      manifest["codec"] != self.codec.spec()):
+      return None, {}, None
+    return (previous, dict([(t["name"], t) for t in manifest["tables"]]),
+      manifest.get("snapshot_time"))
+
+  def table_state(self, conn, db, table, since=None):
+
+    # update times only have second resolution, a write in the same second
+    # as the previous snapshot but after it leaves the update time as it was,
+    # so only a table last updated in an earlier second is known unchanged
+    # without a checksum
+    state = self.states.get((db, table))
+    if state == None:
+      return None
+    state = dict(state)
+    if (state["update_time"] == None or since == None or
+      state["update_time"] >= since):
+      if not self.checksum:
+        return None
+      state["checksum"] = self.query(conn, "CHECKSUM TABLE %s.%s" % (
+        quote_name(db), quote_name(table)))[0][1]
+    return state
+
+  def link_table(self, previous, dump_dir, entry):
+    for file_name in [entry["schema"]] + [c["file"] for c in entry["chunks"]]:
+      os.link(os.path.join(previous, file_name), os.path.join(dump_dir,
+        file_name))
+
+  def start_snapshot(self, dbs=None):
+
+    # every worker connection starts its snapshot while writes are blocked,
+    # so all of them see the same point in time
+    control = self.connect()
+    try:
+      self.query(control, "FLUSH TABLES WITH READ LOCK")
+
+      # read on the server clock, any write after the snapshot has an update
+      # time of this second or later
+      self.snapshot_time = str(self.query(control, "SELECT NOW()")[0][0])
+      if self.skip_unchanged and dbs:
+        self.states = self.table_states(control, dbs)
+      for i in range(self.jobs):
+        conn = self.connect()
+        self.query(conn, "SET SESSION TRANSACTION ISOLATION LEVEL " +
+          "REPEATABLE READ")
+        self.query(conn, "START TRANSACTION WITH CONSISTENT SNAPSHOT")
+        self.connections.put(conn)
+      status = self.query(control, "SHOW MASTER STATUS")
+      if status:
+        self.binlog = {"file": status[0][0], "position": int(status[0][1])}
+    finally:
+      self.query(control, "UNLOCK TABLES")
+      control.close()
+
+  def end_snapshot(self):
+    while not self.connections.empty():
+      conn = self.connections.get()
+      try:
+        self.query(conn, "COMMIT")
+      finally:
+        conn.close()
+
+  def plan_table(self, conn, db, table):
+
+    # tables bigger than the chunk size with a single integer primary key
+    # are split into ranges of the key, anything else is one chunk
+    rows = self.query(conn, "SELECT table_rows FROM " +
+      "information_schema.tables WHERE table_schema = %s AND " +
+      "table_name = %s", (db, table))
+    est_rows = int(rows[0][0] or 0) if rows else 0
+    keys = self.query(conn, "SELECT k.column_name, c.data_type FROM " +
+      "information_schema.key_column_usage k JOIN " +
+      "information_schema.columns c ON c.table_schema = k.table_schema AND " +
+      "c.table_name = k.table_name AND c.column_name = k.column_name " +
+      "WHERE k.table_schema = %s AND k.table_name = %s AND " +
+      "k.constraint_name = 'PRIMARY'", (db, table))
+    int_types = ("tinyint", "smallint", "mediumint", "int", "bigint")
+    if (est_rows <= self.chunk_rows or len(keys) != 1 or
+      keys[0][1] not in int_types):
+      return est_rows, [None]
+
+    key = quote_name(keys[0][0])
+    low, high = self.query(conn, "SELECT MIN(%s), MAX(%s) FROM %s.%s" % (
+      key, key, quote_name(db), quote_name(table)))[0]
+    if low == None:
+      return est_rows, [None]
+    count = (est_rows + self.chunk_rows - 1) // self.chunk_rows
+    step = max(1, (high - low + count) // count)
+    wheres = []
+    for start in range(low, high + 1, step):
+      wheres.append("%s >= %d AND %s < %d" % (key, start, key, start + step))
+    return est_rows, wheres
+
+  def write_file(self, path, statements):
+
+    # statements are streamed through the codec as they are produced
+    with open(path, "wb") as out_file:
+      writer = self.codec.open_writer(out_file)
+      try:
+        for statement in statements:
+          writer.write(statement.encode("utf-8"))
+      finally:
+        if writer is not out_file:
+          writer.close()
+    return os.path.getsize(path)
+
+  def schema_statements(self, conn, db, table, view=False):
+    create = self.query(conn, "SHOW CREATE TABLE %s.%s" % (quote_name(db),
+      quote_name(table)))[0][1]
+    drop = "DROP VIEW IF EXISTS " if view else "DROP TABLE IF EXISTS "
+    yield SCHEMA_HEADER
+    yield drop + quote_name(table) + ";\n"
+    yield create + ";\n"
+
+  def insert_statements(self, conn, db, table, where, counter):
+
+    # rows are streamed from the server with an unbuffered cursor and batched
+    # into multi row inserts
+    sql = "SELECT * FROM %s.%s" % (quote_name(db), quote_name(table))
+    if where:
+      sql += " WHERE " + where
+    yield DATA_HEADER
+    cursor = conn.cursor(pymysql.cursors.SSCursor)
+    try:
+      cursor.execute(sql)
+      prefix = "INSERT INTO " + quote_name(table) + " VALUES "
+      batch = []
+      batch_bytes = 0
+      for row in cursor:
+        value = conn.escape(row)
+        batch.append(value)
+        batch_bytes += len(value)
+        counter[0] += 1
+        if batch_bytes >= INSERT_BYTES:
+          yield prefix + ",".join(batch) + ";\n"
+          batch = []
+          batch_bytes = 0
+      if batch:
+        yield prefix + ",".join(batch) + ";\n"
+    finally:
+      cursor.close()
+
+  def run_task(self, task):
+
+    # each task borrows one of the snapshot connections
+    conn = self.connections.get()
+    try:
+      if task["kind"] == "data":
+        counter = [0]
+        task["size"] = self.write_file(task["path"], self.insert_statements(
+          conn, task["db"], task["table"], task["where"], counter))
+        task["rows"] = counter[0]
+      else:
+        task["size"] = self.write_file(task["path"], self.schema_statements(
+          conn, task["db"], task["table"], task["kind"] == "view"))
+    finally:
+      self.connections.put(conn)
+    return task
+
+  def dump_post(self, db, dump_dir, file_name):
+
+    # triggers, routines and events through mysqldump, no table data
+    post_cmd = ["mysqldump", "-u", self.user]
+    if self.host != None:
+      post_cmd.extend(["-h", self.host])
+    if self.password != None:
+      post_cmd.append("-p" + self.password)
+    post_cmd.extend(["--no-create-info", "--no-data", "--skip-opt",
+      "--triggers", "--routines", "--events", db])
+    with open(os.path.join(dump_dir, file_name), "wb") as out_file:
+      dump = subprocess.Popen(post_cmd, stdout=subprocess.PIPE)
+      try:
+        dumpcodecs.compress_stream(self.codec, dump.stdout, out_file)
+      finally:
+        dump.stdout.close()
+        result = dump.wait()
+    if result:
+      raise RuntimeError("Dump of %s triggers and routines failed %d" % (db,
+        result))
+
+  def plan(self, tstamp, dbs):
+
+    # the manifests and the tasks of every database, planned inside the
+    # snapshot so the table list matches the data
+    conn = self.connections.get()
+    try:
+      manifests = {}
+      tasks = []
+      for db in dbs:
+        dump_dir = os.path.join(self.store, dump_dir_name(tstamp, db))
+        os.mkdir(dump_dir)
+        manifest = {"database": db, "tstamp": tstamp, "binlog": self.binlog,
+          "snapshot_time": self.snapshot_time, "format": MANIFEST_FORMAT,
+          "codec": self.codec.spec(), "tables": [], "views": [],
+          "post": "post.sql" + self.codec.extension}
+        previous, previous_tables, since = None, {}, None
+        if self.skip_unchanged:
+          previous, previous_tables, since = self.previous_dump(tstamp, db)
+        tables = self.query(conn, "SHOW FULL TABLES FROM %s" % quote_name(db))
+        for table, table_type in tables:
+          if table_type == "VIEW":
+            view = {"name": table, "schema": table + ".view.sql" +
+              self.codec.extension}
+            manifest["views"].append(view)
+            tasks.append({"kind": "view", "db": db, "table": table,
+              "path": os.path.join(dump_dir, view["schema"]), "order": 0})
+            continue
+
+          # an unchanged table keeps the files of the previous dump
+          state = None
+          if self.skip_unchanged:
+            state = self.table_state(conn, db, table, since)
+            previous_entry = previous_tables.get(table)
+            if (state != None and previous_entry != None and 
+              previous_entry.get("state") == state):
+              self.link_table(previous, dump_dir, previous_entry)
+              entry = dict(previous_entry)
+              entry["linked"] = os.path.basename(previous)
+              manifest["tables"].append(entry)
+              continue
+
+          est_rows, wheres = self.plan_table(conn, db, table)
+          entry = {"name": table, "rows": est_rows, "schema": table +
+            ".schema.sql" + self.codec.extension, "chunks": [], 
+            "state": state}
+          tasks.append({"kind": "schema", "db": db, "table": table,
+            "path": os.path.join(dump_dir, entry["schema"]), "order": 0})
+          for idx, where in enumerate(wheres):
+            chunk = {"file": "%s.%05d.sql%s" % (table, idx,
+              self.codec.extension), "where": where}
+            entry["chunks"].append(chunk)
+            tasks.append({"kind": "data", "db": db, "table": table,
+              "where": where, "chunk": chunk, "order": est_rows // len(wheres),
+              "path": os.path.join(dump_dir, chunk["file"])})
+          manifest["tables"].append(entry)
+        manifests[db] = (dump_dir, manifest)
+      return manifests, tasks
+    finally:
+      self.connections.put(conn)
+
+  def dump(self, tstamp, dbs):
+
+    # biggest chunks first so the dump ends with the small ones
+    start = time.time()
+    self.start_snapshot(dbs)
+    try:
+      manifests, tasks = self.plan(tstamp, dbs)
+      tasks.sort(key=lambda task: task["order"], reverse=True)
+      with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+        futures = [pool.submit(self.run_task, task) for task in tasks]
+      failed = {}
+      for task, future in zip(tasks, futures):
+        try:
+          future.result()
+          if task["kind"] == "data":
+            task["chunk"]["rows"] = task["rows"]
+            task["chunk"]["size"] = task["size"]
+        except Exception:
+          logging.exception("Dump of %s.%s failed." % (task["db"],
+            task["table"]))
+          failed[task["db"]] = True
+    finally:
+      self.end_snapshot()
+
+    # a database is complete once its post file and manifest are written,
+    # the manifest is written last so a partial dump has none
+    results = []
+    for db in dbs:
+      dump_dir, manifest = manifests[db]
+      result = 1 if db in failed else 0
+      if not result:
+        try:
+          self.dump_post(db, dump_dir, manifest["post"])
+          manifest_path = os.path.join(dump_dir, MANIFEST_NAME)
+          with open(manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        except Exception:
+          logging.exception("Dump of %s failed." % db)
+          result = 1
+
+      # a failed dump is removed so it is never offered for restore
+      size = 0
+      if result:
+        shutil.rmtree(dump_dir, ignore_errors=True)
+      else:
+        for name in os.listdir(dump_dir):
+          size += os.path.getsize(os.path.join(dump_dir, name))
+      linked = len([t for t in manifest["tables"] if t.get("linked")])
+      if linked:
+        logging.info("Linked %d unchanged tables of %s." % (linked, db))
+      results.append({"database": db, "result": result, "size": size,
+        "duration": time.time() - start, "path": dump_dir,
+        "binlog": self.binlog, "linked": linked})
+    return results
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+
+import os
+import os.path
+import sys
+import stat
+import shutil
+import datetime
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+  __file__))))
+
+import binlogbackup
+
+"""
+-----------------------------------------------------------------------------
+Tests of the binlog backups against a recorded binlog fixture.  The fixture
+directory holds three segments of a server whose binlog numbers roll over
+from mysql-bin.999999 to mysql-bin.1000000, the last one is the active
+segment.  Each segment starts with a format description event followed by
+three transactions a minute apart.
+
+Replays run a stand in mysqlbinlog and mysql from a temp directory on the
+path that record their arguments, so no mysqld is needed.
+-----------------------------------------------------------------------------
+"""
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+  "fixtures", "binlogs")
+
+# times of the first and last events in each fixture segment
+SEGMENT_TIMES = {
+  "mysql-bin.999999": (1760000000, 1760000240),
+  "mysql-bin.1000000": (1760000600, 1760000840),
+  "mysql-bin.1000001": (1760001200, 1760001380)
+}
+
+FAKE_MYSQLBINLOG = """#!/bin/sh
+echo "$@" > "$(dirname "$0")/mysqlbinlog.args"
+echo "COMMIT;"
+"""
+
+FAKE_MYSQL = """#!/bin/sh
+cat > /dev/null
+"""
+
+def at(tstamp):
+
+  # restore times are local times, like the --stop-datetime they are given as
+  return datetime.datetime.fromtimestamp(tstamp)
+
+class BinlogBackupTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.store = os.path.join(self.tmp_dir, "store")
+    os.mkdir(self.store)
+    self.backup = binlogbackup.BinlogBackup(self.store, compression="gzip",
+      binlog_dir=FIXTURE_DIR)
+    self.position = {"file": "mysql-bin.999999", "position": 4}
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_event_times(self):
+    for name, (first, last) in SEGMENT_TIMES.items():
+      times = binlogbackup.read_event_times(os.path.join(FIXTURE_DIR, name))
+      self.assertEqual((first, last), times[:2])
+
+  def test_segments_in_number_order(self):
+    self.assertEqual(["mysql-bin.999999", "mysql-bin.1000000",
+      "mysql-bin.1000001"], self.backup.source_segments())
+
+  def test_copy_skips_active_segment(self):
+    copied = self.backup.copy()
+    self.assertEqual(["mysql-bin.999999", "mysql-bin.1000000"],
+      [segment["name"] for segment in copied])
+    for segment in copied:
+      self.assertEqual(SEGMENT_TIMES[segment["name"]],
+        (segment["first_time"], segment["last_time"]))
+    self.assertEqual([], self.backup.copy())
+
+  def test_replay_segments_until(self):
+    self.backup.copy()
+    segments = self.backup.replay_segments(self.position, at(1760000300))
+    self.assertEqual(["mysql-bin.999999"], [s["name"] for s in segments])
+    segments = self.backup.replay_segments(self.position, at(1760000700))
+    self.assertEqual(["mysql-bin.999999", "mysql-bin.1000000"],
+      [s["name"] for s in segments])
+
+  def test_replay_segments_from_later_position(self):
+    self.backup.copy()
+    segments = self.backup.replay_segments({"file": "mysql-bin.1000000",
+      "position": 4}, at(1760000700))
+    self.assertEqual(["mysql-bin.1000000"], [s["name"] for s in segments])
+
+  def test_replay_segments_past_copied(self):
+    self.backup.copy()
+    with self.assertRaises(ValueError):
+      self.backup.replay_segments(self.position, at(1760001300))
+
+  def test_replay_segments_missing_position(self):
+    self.backup.copy()
+    with self.assertRaises(ValueError):
+      self.backup.replay_segments({"file": "mysql-bin.999998",
+        "position": 4}, at(1760000300))
+
+  def test_replay_stop_datetime(self):
+    self.backup.copy()
+    bin_dir = os.path.join(self.tmp_dir, "bin")
+    os.mkdir(bin_dir)
+    for name, script in [("mysqlbinlog", FAKE_MYSQLBINLOG),
+      ("mysql", FAKE_MYSQL)]:
+      path = os.path.join(bin_dir, name)
+      with open(path, "w") as script_file:
+        script_file.write(script)
+      os.chmod(path, stat.S_IRWXU)
+    until = at(1760000700)
+    saved_path = os.environ["PATH"]
+    os.environ["PATH"] = bin_dir + os.pathsep + saved_path
+    try:
+      replayed = self.backup.replay("shop", self.position, until)
+    finally:
+      os.environ["PATH"] = saved_path
+    self.assertEqual(2, replayed)
+    with open(os.path.join(bin_dir, "mysqlbinlog.args"), "r") as args_file:
+      args = args_file.read().split()
+    self.assertIn("--database=shop", args)
+    self.assertIn("--start-position=4", args)
+    self.assertIn("--stop-datetime=" + until.strftime("%Y-%m-%d"), args)
+    self.assertIn(until.strftime("%H:%M:%S"), args)
+    self.assertEqual(["mysql-bin.999999", "mysql-bin.1000000"],
+      [os.path.basename(arg) for arg in args if arg.startswith("/")])
+
+if __name__ == "__main__":
+  unittest.main()